@@ -1,41 +1,384 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, make_response, stream_with_context
 from dotenv import load_dotenv
 load_dotenv()
 
+import compression
 import database
+import db_metrics
+import exports
+import import_jobs
+import inventory_index
+import inventory_options
+from inventory_options import format_currency_with_commas
+import metrics_cache
+import models
+import repricing
+import reports
 import scryfall
+from json_provider import FastJSONProvider
 import datetime
 import os
-import csv
-import io
-import json
-from collections import defaultdict
 import math
 import re
 import sys
+import functools
+import hashlib
+import json
 
 app = Flask(__name__)
+app.json = FastJSONProvider(app)
+compression.init_app(app)
 app.secret_key = os.environ.get('FLASK_SECRET_KEY', 'your_very_secret_key_here_CHANGE_ME_TO_SOMETHING_RANDOM_AND_SECURE')
 
 ITEMS_PER_PAGE = 50
 
-def format_currency_with_commas(value):
-    if value is None: return "$0.00"
-    try:
-        num_value = float(value)
-        return f"-${abs(num_value):,.2f}" if num_value < 0 else f"${num_value:,.2f}"
-    except (ValueError, TypeError): return str(value)
 app.jinja_env.filters['currency_commas'] = format_currency_with_commas
 
+# --- Per-request DB instrumentation (see db_metrics.py) ---
+@app.before_request
+def start_db_metrics():
+    db_metrics.start_request()
+
+@app.after_request
+def report_db_metrics(response):
+    stats = db_metrics.finish_request()
+    db_metrics.log_request(stats, request.method, request.full_path.rstrip('?'), response.status_code)
+    return db_metrics.apply_response_headers(stats, response)
+
+# --- Conditional GET (ETag / If-None-Match) ---
+# Part of every ETag, so a deploy that changes response shapes doesn't match old browser caches.
+ETAG_SALT = os.environ.get('RENDER_GIT_COMMIT', '')
+
+def _conditional_response(etag, build_response):
+    """Returns 304 if the client already holds `etag`; otherwise builds the response and tags it."""
+    if request.if_none_match.contains_weak(etag):
+        response = app.response_class(status=304)
+    else:
+        response = make_response(build_response())
+        if response.status_code != 200:
+            return response
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'  # Browser may store it, but must revalidate each time.
+    return response
+
+def versioned_by(*table_names):
+    """
+    Adds ETag support to a GET view whose output depends only on `table_names` and the query string.
+    The ETag comes from the table_versions counters, so an unchanged result returns 304 before the view runs.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            versions = database.get_table_versions(table_names)
+            if versions is None:
+                return view(*args, **kwargs)
+            token = f"{ETAG_SALT}|{request.full_path}|{'.'.join(str(version) for version in versions)}"
+            etag = hashlib.sha1(token.encode('utf-8')).hexdigest()
+            return _conditional_response(etag, lambda: view(*args, **kwargs))
+        return wrapper
+    return decorator
+
 @app.route('/api/all_sets_info')
 def api_all_sets_info():
-    set_data = scryfall.fetch_all_set_data()
-    return jsonify(set_data) if set_data else (jsonify({"error": "Failed to fetch set data from Scryfall"}), 500)
+    set_data, etag = scryfall.get_all_set_data_cached()
+    if not set_data:
+        return jsonify({"error": "Failed to fetch set data from Scryfall"}), 500
+    return _conditional_response(f"{ETAG_SALT}{etag}", lambda: jsonify(set_data))
+
+# --- Versioned JSON API (v1) ---
+# The page shell no longer embeds inventory/sales/supplies; the active tab fetches what it shows from here.
+API_MAX_PER_PAGE = 500
+INVENTORY_FILTER_KEYS = ['filter_text', 'filter_type', 'filter_location', 'filter_set', 'filter_foil', 'filter_rarity',
+                         'filter_card_lang', 'filter_condition', 'filter_collector', 'filter_sealed_lang']
+
+def _inventory_filters_from_args(args):
+    """Reads the inventory tab filters from query args ('all' when absent)."""
+    filters = {key: args.get(key, 'all').strip() or 'all' for key in INVENTORY_FILTER_KEYS}
+    filters['filter_text'] = args.get('filter_text', '').strip().lower()
+    return filters
+
+def _pagination_from_args(args, default_per_page):
+    page = max(1, args.get('page', 1, type=int) or 1)
+    per_page = args.get('per_page', default_per_page, type=int) or default_per_page
+    return page, max(1, min(per_page, API_MAX_PER_PAGE))
+
+def _paginated_response(items, total_count, page, per_page, **extra):
+    total_pages = (total_count + per_page - 1) // per_page if total_count > 0 else 1
+    payload = {"items": items, "page": page, "per_page": per_page,
+               "total_count": total_count, "total_pages": total_pages}
+    payload.update(extra)
+    return jsonify(payload)
+
+@app.route('/api/v1/inventory')
+@versioned_by('cards', 'sealed_products', 'shipping_supplies_inventory')
+def api_v1_inventory():
+    filters = _inventory_filters_from_args(request.args)
+    sort_key = request.args.get('sort_key', 'display_name')
+    sort_dir = 'desc' if request.args.get('sort_dir') == 'desc' else 'asc'
+    page, per_page = _pagination_from_args(request.args, ITEMS_PER_PAGE)
+    rows, total_count = _inventory_page(filters, sort_key, sort_dir, page, per_page)
+    if not rows and total_count > 0:
+        # Requested page is past the end (e.g. after deletes); serve the last page instead.
+        page = (total_count + per_page - 1) // per_page
+        rows, total_count = _inventory_page(filters, sort_key, sort_dir, page, per_page)
+    return _paginated_response([models.inventory_item_from_row(row).to_item_dict() for row in rows], total_count, page, per_page,
+                               sort_key=sort_key, sort_dir=sort_dir)
+
+def _inventory_page(filters, sort_key, sort_dir, page, per_page):
+    """Serves the page from the in-memory inventory index when it's available, else from SQL."""
+    result = inventory_index.get_inventory_page(filters, sort_key, sort_dir, page, per_page)
+    return result if result is not None else database.get_inventory_page(filters, sort_key, sort_dir, page, per_page)
+
+@app.route('/api/v1/supplies')
+@versioned_by('shipping_supplies_inventory')
+def api_v1_supplies():
+    filters = _inventory_filters_from_args(request.args)
+    page, per_page = _pagination_from_args(request.args, ITEMS_PER_PAGE)
+    rows, total_count = database.get_shipping_supplies_page(filters, page, per_page)
+    return _paginated_response(rows, total_count, page, per_page)
+
+@app.route('/api/v1/sales')
+@versioned_by('sale_events', 'sale_items')
+def api_v1_sales():
+    page, per_page = _pagination_from_args(request.args, 25)
+    events, total_count = database.get_sale_events_page(
+        page, per_page,
+        date_from=request.args.get('date_from') or None,
+        date_to=request.args.get('date_to') or None,
+        filter_text=request.args.get('filter_text', '').strip() or None
+    )
+    return _paginated_response(events, total_count, page, per_page)
+
+@app.route('/api/v1/sale_inventory_options')
+@versioned_by('cards', 'sealed_products', 'shipping_supplies_inventory')
+def api_v1_sale_inventory_options():
+    return jsonify(inventory_options.build_sale_inventory_options())
+
+@app.route('/api/v1/shipping_supply_options')
+@versioned_by('shipping_supplies_inventory')
+def api_v1_shipping_supply_options():
+    """Every in-stock supply batch as a sale-form picker option; unpaginated, since the picker must list them all."""
+    return jsonify(inventory_options.build_shipping_supply_options())
+
+SALE_ITEM_SEARCH_LIMIT = 20
+
+@app.route('/api/sale_item_search')
+@versioned_by('cards', 'sealed_products', 'shipping_supplies_inventory')
+def sale_item_search():
+    """Typeahead for the sale forms: top matches for ?q= with current stock, best match first."""
+    query_text = request.args.get('q', '').strip()
+    limit = max(1, min(request.args.get('limit', SALE_ITEM_SEARCH_LIMIT, type=int) or SALE_ITEM_SEARCH_LIMIT, 100))
+    if not query_text:
+        return jsonify([])
+    return jsonify(inventory_options.search_sale_options(query_text, limit))
+
+def _date_range_from_args(args):
+    """(start_date, end_date) from ?start_date= / ?end_date= (YYYY-MM-DD, None when absent). Raises ValueError for a bad date."""
+    return tuple(datetime.date.fromisoformat(args[key]) if args.get(key) else None for key in ('start_date', 'end_date'))
+
+@app.route('/api/v1/cards/<int:card_id>/price_history')
+@versioned_by('cards', 'price_history')
+def api_v1_card_price_history(card_id):
+    """Recorded prices of the card's printing, oldest first; ?start_date= / ?end_date= (YYYY-MM-DD) bound the range."""
+    card = database.get_card_by_id(card_id)
+    if not card:
+        return jsonify({"error": "Card not found"}), 404
+    try:
+        start_date, end_date = _date_range_from_args(request.args)
+    except ValueError:
+        return jsonify({"error": "Dates must be YYYY-MM-DD"}), 400
+    points = database.get_price_history(card['set_code'], card['collector_number'], card['language'], start_date, end_date)
+    return jsonify({"card_id": card_id, "is_foil": bool(card['is_foil']), "points": points})
+
+@app.route('/api/v1/valuation_history')
+@versioned_by('valuation_snapshots')
+def api_v1_valuation_history():
+    """Daily valuation snapshots: ?dimension=total|item_type|location|set|rarity|product_type, optional ?value= and date range."""
+    dimension = request.args.get('dimension', 'total')
+    if dimension != 'total' and dimension not in database.VALUATION_DIMENSIONS:
+        return jsonify({"error": f"Unknown dimension '{dimension}'"}), 400
+    try:
+        start_date, end_date = _date_range_from_args(request.args)
+    except ValueError:
+        return jsonify({"error": "Dates must be YYYY-MM-DD"}), 400
+    snapshots = database.get_valuation_history(dimension, request.args.get('value'), start_date, end_date)
+    if snapshots is None:
+        return jsonify({"error": "Failed to read valuation snapshots"}), 500
+    return jsonify({"dimension": dimension, "snapshots": snapshots})
+
+@app.route('/api/v1/price_movers')
+@versioned_by('price_movers')
+def api_v1_price_movers():
+    """A price movers report (?date=YYYY-MM-DD, default the latest), biggest impact on stock value first."""
+    try:
+        detected_on = datetime.date.fromisoformat(request.args['date']) if request.args.get('date') else None
+    except ValueError:
+        return jsonify({"error": "Dates must be YYYY-MM-DD"}), 400
+    limit = max(1, min(request.args.get('limit', 100, type=int) or 100, API_MAX_PER_PAGE))
+    movers = database.get_price_movers(detected_on, limit)
+    if movers is None:
+        return jsonify({"error": "Failed to read price movers"}), 500
+    return jsonify({"detected_on": movers[0]['detected_on'] if movers else None, "movers": movers})
+
+@app.route('/api/v1/reports/pl')
+def api_v1_pl_report():
+    """
+    P/L over recorded sales grouped by ?dimensions= (comma-separated, any of reports.REPORT_DIMENSIONS,
+    outermost first) with ?mode=rollup|cube|sets|detail subtotals and an optional date range.
+    Cached per parameters until a sale (or, for set / rarity / location, an inventory item) changes.
+    """
+    try:
+        start_date, end_date = _date_range_from_args(request.args)
+    except ValueError:
+        return jsonify({"error": "Dates must be YYYY-MM-DD"}), 400
+    mode = request.args.get('mode', 'rollup')
+    try:
+        dimensions = reports.parse_dimensions(request.args.get('dimensions', 'month'))
+        report_query = reports.compile_pl_report(dimensions, mode, start_date, end_date)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    def compute():
+        rows = database.get_pl_report(report_query)
+        return reports.shape_pl_rows(dimensions, rows) if rows is not None else None
+
+    cache_name = f"pl_report:{mode}:{','.join(dimensions)}:{start_date or ''}:{end_date or ''}"
+    rows = metrics_cache.get_or_compute(cache_name, reports.cache_groups(dimensions), compute)
+    if rows is None:
+        return jsonify({"error": "Failed to build the P/L report"}), 500
+    return jsonify({"dimensions": dimensions, "mode": mode, "start_date": start_date, "end_date": end_date, "rows": rows})
+
+@app.route('/api/v1/supply_presets')
+@versioned_by('shipping_supply_presets', 'shipping_preset_items', 'shipping_supplies_inventory')
+def api_v1_supply_presets():
+    return jsonify(database.get_all_shipping_supply_presets())
+
+# --- Tab-scoped data providers for index() ---
+# Only the provider for the requested tab runs; other tabs load their data when opened.
+ALL_CONDITIONS = ['Mint', 'Near Mint', 'Lightly Played', 'Moderately Played', 'Heavily Played', 'Damaged']
+
+def _cached_monthly_sales_summary():
+    return metrics_cache.get_or_compute('monthly_sales_summary', ('sales',), database.get_monthly_sales_summary) or []
+
+def _cached_sales_summary_since(start_date):
+    """Sales summary from start_date to date (a range query that only reads that range's partitions)."""
+    summary = metrics_cache.get_or_compute(f'sales_summary_since:{start_date.isoformat()}', ('sales',),
+                                           lambda: database.get_sales_summary_between(start_date))
+    return summary or {'profit_loss': 0.0, 'sales_count': 0, 'single_cards_sold': 0, 'sealed_products_sold': 0}
+
+def _monthly_sales_summary():
+    return [dict(month_summary, month_name=datetime.date(month_summary['year'], month_summary['month'], 1).strftime('%B %Y'))
+            for month_summary in _cached_monthly_sales_summary()]
+
+# Dashboard value-over-time panel: the last VALUATION_HISTORY_DAYS of total snapshots, compared
+# with the snapshot on or before each of these offsets from the latest one.
+VALUATION_HISTORY_DAYS = 400
+VALUATION_COMPARISONS = [('1 week', 7), ('30 days', 30), ('1 year', 365)]
+VALUATION_CHART_WIDTH, VALUATION_CHART_HEIGHT = 600, 120
+
+def _valuation_chart_points(history):
+    """SVG polyline points for market value over time (x by date, y scaled to the min-max range)."""
+    first_date, last_date = history[0]['snapshot_date'], history[-1]['snapshot_date']
+    values = [snapshot['total_market_value'] for snapshot in history]
+    day_span = max((last_date - first_date).days, 1)
+    low, value_span = min(values), (max(values) - min(values)) or 1
+    return " ".join(
+        f"{(snapshot['snapshot_date'] - first_date).days / day_span * VALUATION_CHART_WIDTH:.1f},"
+        f"{VALUATION_CHART_HEIGHT - (snapshot['total_market_value'] - low) / value_span * VALUATION_CHART_HEIGHT:.1f}"
+        for snapshot in history)
+
+def _valuation_context(today_date_obj):
+    history = database.get_valuation_history('total', start_date=today_date_obj - datetime.timedelta(days=VALUATION_HISTORY_DAYS)) or []
+    if not history:
+        return {'valuation_latest': None, 'valuation_comparisons': [], 'valuation_chart_points': ''}
+    latest = history[-1]
+    comparisons = []
+    for label, days in VALUATION_COMPARISONS:
+        target_date = latest['snapshot_date'] - datetime.timedelta(days=days)
+        earlier = next((snapshot for snapshot in reversed(history) if snapshot['snapshot_date'] <= target_date), None)
+        if earlier is not None:
+            comparisons.append({'label': label, 'snapshot_date': earlier['snapshot_date'],
+                                'total_market_value': earlier['total_market_value'],
+                                'change': latest['total_market_value'] - earlier['total_market_value']})
+    return {'valuation_latest': latest, 'valuation_comparisons': comparisons,
+            'valuation_chart_points': _valuation_chart_points(history) if len(history) > 1 else ''}
+
+DASHBOARD_PRICE_MOVERS = 10
+
+def _dashboard_tab_context():
+    totals = metrics_cache.get_or_compute('dashboard_totals', ('inventory', 'sales', 'ledger'), database.get_dashboard_totals)
+    totals = totals or dict(database.EMPTY_DASHBOARD_TOTALS)
+    inventory_totals = inventory_index.inventory_totals()
+    if inventory_totals is not None:
+        # The index is checked against the table versions on every call, so its stock totals are current.
+        totals = dict(totals, **inventory_totals)
+    today_date_obj = datetime.date.today()
+    current_month = _cached_sales_summary_since(today_date_obj.replace(day=1))
+    current_year = _cached_sales_summary_since(today_date_obj.replace(month=1, day=1))
+
+    total_supplies_cost_deducted_in_sales_pl = totals['total_supplies_cost_for_sales']
+    app.logger.info(f"DEBUG: Total Shipping Supplies Cost Used in Sales (All Time): ${total_supplies_cost_deducted_in_sales_pl:,.2f}")
+    net_business_pl = totals['sales_pl'] + totals['total_other_income'] - totals['total_other_expenses'] + total_supplies_cost_deducted_in_sales_pl
+
+    context = {
+        'total_inventory_market_value': totals['total_inventory_market_value'],
+        'total_buy_cost_of_inventory': totals['total_buy_cost_of_inventory'],
+        'total_single_cards_quantity': totals['total_single_cards_quantity'],
+        'total_sealed_products_quantity': totals['total_sealed_products_quantity'],
+        'num_unique_card_inventory_entries': totals['num_unique_card_inventory_entries'],
+        'sales_pl': totals['sales_pl'],
+        'net_business_pl': net_business_pl,
+        'total_cogs': totals['total_cogs'],
+        'total_gross_sales': totals['total_gross_sales'],
+        'current_month_sales_count': current_month['sales_count'],
+        'current_month_sealed_sold_quantity': current_month['sealed_products_sold'],
+        'current_month_single_cards_sold_quantity': current_month['single_cards_sold'],
+        'current_month_profit_loss': current_month['profit_loss'],
+        'current_month_name': today_date_obj.strftime("%B"),
+        'current_year_profit_loss': current_year['profit_loss'],
+        'current_year_sales_count': current_year['sales_count'],
+    }
+    context.update(_valuation_context(today_date_obj))
+    context['price_movers'] = database.get_price_movers(limit=DASHBOARD_PRICE_MOVERS) or []
+    return context
+
+def _inventory_tab_context():
+    filter_options = metrics_cache.get_or_compute('inventory_filter_options', ('inventory',), database.get_inventory_filter_options)
+    filter_options = filter_options or {'locations': [], 'sets': [], 'rarities': [], 'card_languages': [], 'sealed_languages': []}
+    return {
+        'all_locations': filter_options['locations'],
+        'all_sets_identifiers': filter_options['sets'],
+        'all_rarities': filter_options['rarities'],
+        'all_card_languages': filter_options['card_languages'],
+        'all_sealed_languages': filter_options['sealed_languages'],
+        'all_conditions': ALL_CONDITIONS,
+    }
+
+def _add_items_tab_context():
+    return {}
+
+def _sales_history_tab_context():
+    return {'historical_monthly_sales_summary': _monthly_sales_summary()}
+
+def _business_ledger_tab_context():
+    # The template iterates this once, so rows stream from the server-side cursor into the page.
+    # A DB error ends the list early instead of failing the whole page.
+    return {'financial_entries': database.stream_rows_or_stop(database.iter_financial_entries())}
+
+TAB_CONTEXT_PROVIDERS = {
+    'dashboardTab': _dashboard_tab_context,
+    'inventoryTab': _inventory_tab_context,
+    'addItemsTab': _add_items_tab_context,
+    'salesHistoryTab': _sales_history_tab_context,
+    'businessLedgerTab': _business_ledger_tab_context,
+}
 
 @app.route('/')
 def index():
     active_tab = request.args.get('tab', 'dashboardTab')
-    page = request.args.get('page', 1, type=int)
+    if active_tab not in TAB_CONTEXT_PROVIDERS:
+        active_tab = 'dashboardTab'
+    page = max(1, request.args.get('page', 1, type=int) or 1)
 
     query_filter_text = request.args.get('filter_text', '').strip().lower()
     query_filter_type = request.args.get('filter_type', 'all')
@@ -60,391 +403,15 @@ def index():
             "qty_opened": request.args.get('from_pack_qty_opened', type=int)
         }
 
-    inventory_cards_data = database.get_all_cards()
-    sealed_products_data = database.get_all_sealed_products()
-    financial_entries = database.get_all_financial_entries()
-    sales_events_raw = database.get_all_sale_events_with_items()
-    shipping_supplies_data = database.get_all_shipping_supplies()
-    shipping_supply_presets = database.get_all_shipping_supply_presets()
-
-
-    processed_shipping_supplies = []
-    total_shipping_supplies_quantity = 0
-    total_shipping_supplies_value = 0
-    for supply_row in shipping_supplies_data:
-        supply = dict(supply_row) # Convert DictRow to dict
-        total_shipping_supplies_quantity += supply.get('quantity_on_hand', 0)
-        total_shipping_supplies_value += (supply.get('quantity_on_hand', 0) * supply.get('cost_per_unit', 0))
-
-        # Convert date objects to string for JSON serialization
-        if isinstance(supply.get('purchase_date'), datetime.date):
-            supply['purchase_date'] = supply['purchase_date'].isoformat()
-        if isinstance(supply.get('date_added'), datetime.datetime):
-            supply['date_added'] = supply['date_added'].isoformat()
-        if isinstance(supply.get('last_updated'), datetime.datetime):
-            supply['last_updated'] = supply['last_updated'].isoformat()
-
-        processed_shipping_supplies.append(supply)
-
-
-    sales_history_data_for_json = []
-    for event in sales_events_raw:
-        event_copy = dict(event)
-        if isinstance(event_copy.get('sale_date'), datetime.date):
-            event_copy['sale_date'] = event_copy['sale_date'].isoformat()
-        if isinstance(event_copy.get('date_recorded'), datetime.datetime):
-            event_copy['date_recorded'] = event_copy['date_recorded'].isoformat()
-
-        processed_items = []
-        for item_detail in event_copy.get('items', []):
-            item_copy = dict(item_detail)
-            processed_items.append(item_copy)
-        event_copy['items'] = processed_items
-        sales_history_data_for_json.append(event_copy)
-
-    current_month_sale_events_count = 0
-    current_month_sealed_sold_quantity = 0
-    current_month_single_cards_sold_quantity = 0
-    current_month_profit_loss = 0.0
-
-    today_date_obj = datetime.date.today()
-    current_month_val = today_date_obj.month
-    current_year_val = today_date_obj.year
-
-    historical_monthly_summary_temp = defaultdict(lambda: {
-        'profit_loss': 0.0, 'sales_events_count': 0,
-        'single_cards_sold': 0, 'sealed_products_sold': 0
-    })
-
-    for event in sales_events_raw:
-        sale_date_obj = event.get('sale_date')
-        if not isinstance(sale_date_obj, datetime.date):
-            try: sale_date_obj = datetime.date.fromisoformat(str(sale_date_obj))
-            except (ValueError, TypeError): continue
-
-        year_month_key = (sale_date_obj.year, sale_date_obj.month)
-
-        event_total_profit = event.get('total_profit_loss', 0.0) or 0.0
-        historical_monthly_summary_temp[year_month_key]['profit_loss'] += float(event_total_profit)
-        historical_monthly_summary_temp[year_month_key]['sales_events_count'] += 1
-
-        for item_detail in event.get('items', []):
-            quantity_sold_val = item_detail.get('quantity_sold', 0)
-            item_type_val = item_detail.get('item_type')
-            if item_type_val == 'single_card' and quantity_sold_val:
-                historical_monthly_summary_temp[year_month_key]['single_cards_sold'] += int(quantity_sold_val)
-            elif item_type_val == 'sealed_product' and quantity_sold_val:
-                historical_monthly_summary_temp[year_month_key]['sealed_products_sold'] += int(quantity_sold_val)
-
-        if sale_date_obj.month == current_month_val and sale_date_obj.year == current_year_val:
-            current_month_profit_loss += float(event_total_profit)
-            current_month_sale_events_count += 1
-            for item_detail in event.get('items', []):
-                quantity_sold_val = item_detail.get('quantity_sold', 0)
-                item_type_val = item_detail.get('item_type')
-                if item_type_val == 'single_card' and quantity_sold_val:
-                    current_month_single_cards_sold_quantity += int(quantity_sold_val)
-                elif item_type_val == 'sealed_product' and quantity_sold_val:
-                    current_month_sealed_sold_quantity += int(quantity_sold_val)
-
-    historical_monthly_sales_summary = []
-    for (year, month), data in historical_monthly_summary_temp.items():
-        historical_monthly_sales_summary.append({
-            'year': year, 'month': month,
-            'month_name': datetime.date(year, month, 1).strftime('%B %Y'),
-            'profit_loss': data['profit_loss'],
-            'sales_count': data['sales_events_count'],
-            'single_cards_sold': data['single_cards_sold'],
-            'sealed_products_sold': data['sealed_products_sold']
-        })
-    historical_monthly_sales_summary.sort(key=lambda x: (x['year'], x['month']), reverse=True)
-
-    sales_pl = sum(event.get('total_profit_loss', 0.0) or 0.0 for event in sales_events_raw)
-    
-    total_supplies_cost_deducted_in_sales_pl = sum(
-        event.get('total_supplies_cost_for_sale', 0.0) or 0.0
-        for event in sales_events_raw
-    )
-    app.logger.info(f"DEBUG: Total Shipping Supplies Cost Used in Sales (All Time): ${total_supplies_cost_deducted_in_sales_pl:,.2f}")
-
-
-
-    total_cogs = 0.0
-    total_gross_sales = 0.0
-    for event in sales_events_raw:
-        for item_detail in event.get('items', []):
-            quantity_sold = item_detail.get('quantity_sold', 0)
-            buy_price = item_detail.get('buy_price_per_item', 0.0)
-            sell_price = item_detail.get('sell_price_per_item', 0.0)
-            total_cogs += (buy_price * quantity_sold)
-            total_gross_sales += (sell_price * quantity_sold)
-
-    total_other_income = sum(entry['amount'] for entry in financial_entries if entry['entry_type'] == 'income')
-    total_other_expenses = sum(entry['amount'] for entry in financial_entries if entry['entry_type'] == 'expense') # Keep this for ledger display
-
-
-
-    net_business_pl = sales_pl + total_other_income - total_other_expenses + total_supplies_cost_deducted_in_sales_pl
-
-    processed_inventory_cards = []
-    total_inventory_market_value_cards = 0
-    total_buy_cost_of_inventory_cards = 0
-    total_single_cards_quantity = 0
-    for card_row in inventory_cards_data:
-        card = dict(card_row)
-        total_single_cards_quantity += card.get('quantity', 0)
-        item = {'type': 'single_card', 'original_id': card['id']}
-        item['display_name'] = card.get('name', 'N/A')
-        item['quantity'] = card.get('quantity', 0)
-        item['location'] = card.get('location', 'N/A')
-        item['buy_price'] = card.get('buy_price')
-        item['sell_price'] = card.get('sell_price')
-        item['image_uri'] = card.get('image_uri')
-        item['set_code'] = card.get('set_code')
-        item['collector_number'] = card.get('collector_number')
-        item['is_foil'] = bool(card.get('is_foil', 0))
-        item['rarity'] = card.get('rarity', 'N/A')
-        item['language'] = card.get('language', 'N/A')
-        item['condition'] = card.get('condition', 'N/A')
-        item['total_buy_cost'] = (item['quantity'] * item['buy_price']) if item.get('buy_price') is not None else 0
-        total_buy_cost_of_inventory_cards += item['total_buy_cost']
-        current_market_price = None
-        if item['is_foil'] and card.get('foil_market_price_usd') is not None: current_market_price = card['foil_market_price_usd']
-        elif not item['is_foil'] and card.get('market_price_usd') is not None: current_market_price = card['market_price_usd']
-        item['current_market_price'] = current_market_price
-        item_market_value = 0
-        if current_market_price is not None: item_market_value = item['quantity'] * current_market_price; total_inventory_market_value_cards += item_market_value
-        item['total_market_value'] = item_market_value; item['market_vs_buy_percentage_display'] = "N/A"
-        if current_market_price is not None and item.get('buy_price') is not None:
-            if item['buy_price'] > 0: item['market_vs_buy_percentage_display'] = ((current_market_price - item['buy_price']) / item['buy_price']) * 100
-            elif item['buy_price'] == 0 and current_market_price > 0: item['market_vs_buy_percentage_display'] = "Infinite"
-            elif item['buy_price'] == 0 and current_market_price == 0: item['market_vs_buy_percentage_display'] = 0.0
-        item['potential_pl_at_asking_price_display'] = "N/A (No asking price)"
-        if item.get('sell_price') is not None and item.get('buy_price') is not None: item['potential_pl_at_asking_price_display'] = (item['quantity'] * item['sell_price']) - item['total_buy_cost']
-        processed_inventory_cards.append(item)
-
-    processed_sealed_products = []
-    total_inventory_market_value_sealed = 0
-    total_buy_cost_of_inventory_sealed = 0
-    total_sealed_products_quantity = 0
-    for product_row in sealed_products_data:
-        product = dict(product_row)
-        total_sealed_products_quantity += product.get('quantity', 0)
-        item = {'type': 'sealed_product', 'original_id': product['id']}
-        item['display_name'] = product.get('product_name', 'N/A')
-        item['quantity'] = product.get('quantity', 0)
-        item['location'] = product.get('location', 'N/A')
-        item['buy_price'] = product.get('buy_price')
-        item['sell_price'] = product.get('sell_price')
-        item['image_uri'] = product.get('image_uri')
-        item['set_name'] = product.get('set_name')
-        item['product_type'] = product.get('product_type')
-        item['language'] = product.get('language')
-        item['is_collectors_item'] = bool(product.get('is_collectors_item', 0))
-        item['total_buy_cost'] = (item['quantity'] * item['buy_price']) if item.get('buy_price') is not None else 0
-        total_buy_cost_of_inventory_sealed += item['total_buy_cost']
-        item['current_market_price'] = product.get('manual_market_price')
-        item_market_value = 0
-        if item['current_market_price'] is not None: item_market_value = item['quantity'] * item['current_market_price']; total_inventory_market_value_sealed += item_market_value
-        item['total_market_value'] = item_market_value; item['market_vs_buy_percentage_display'] = "N/A (Manual Price)"; item['potential_pl_at_asking_price_display'] = "N/A (No asking price)"
-        if item.get('sell_price') is not None and item.get('buy_price') is not None: item['potential_pl_at_asking_price_display'] = (item['quantity'] * item['sell_price']) - item['total_buy_cost']
-        processed_sealed_products.append(item)
-
-    processed_shipping_supplies = []
-    total_shipping_supplies_quantity = 0
-    total_shipping_supplies_value = 0
-    for supply_row in shipping_supplies_data:
-        supply = dict(supply_row) # Convert DictRow to dict
-        total_shipping_supplies_quantity += supply.get('quantity_on_hand', 0)
-        total_shipping_supplies_value += (supply.get('quantity_on_hand', 0) * supply.get('cost_per_unit', 0))
-
-        # Convert date objects to string for JSON serialization
-        if isinstance(supply.get('purchase_date'), datetime.date):
-            supply['purchase_date'] = supply['purchase_date'].isoformat()
-        if isinstance(supply.get('date_added'), datetime.datetime):
-            supply['date_added'] = supply['date_added'].isoformat()
-        if isinstance(supply.get('last_updated'), datetime.datetime):
-            supply['last_updated'] = supply['last_updated'].isoformat()
-
-        processed_shipping_supplies.append(supply)
-
-    # 1. Combine all raw inventory items into one list for initial filtering
-    all_combined_inventory_items_for_filtering = []
-    for item in processed_inventory_cards:
-        item['internal_type'] = 'single_card'
-        all_combined_inventory_items_for_filtering.append(item)
-    for item in processed_sealed_products:
-        item['internal_type'] = 'sealed_product'
-        all_combined_inventory_items_for_filtering.append(item)
-    for item in processed_shipping_supplies:
-        item['internal_type'] = 'shipping_supply'
-        item['display_name'] = item.get('supply_name', 'N/A') # Ensure display_name for supplies here
-        all_combined_inventory_items_for_filtering.append(item)
-
-
-    # Start with the full combined list
-    filtered_inventory_items = all_combined_inventory_items_for_filtering
-
-
-    # 2. Apply query_filter_type first
-    if query_filter_type != 'all':
-        filtered_inventory_items = [
-            item for item in filtered_inventory_items
-            if item.get('internal_type') == query_filter_type
-        ]
-
-    # 3. Apply text search filter
-    if query_filter_text:
-        filtered_inventory_items = [item for item in filtered_inventory_items if
-            query_filter_text in str(item.get('display_name', '')).lower() or # Use display_name here
-            (item.get('internal_type') == 'single_card' and (query_filter_text in str(item.get('set_code', '')).lower() or query_filter_text in str(item.get('collector_number', '')).lower() or query_filter_text in str(item.get('rarity', '')).lower() or query_filter_text in str(item.get('language', '')).lower())) or
-            (item.get('internal_type') == 'sealed_product' and (query_filter_text in str(item.get('set_name', '')).lower() or query_filter_text in str(item.get('product_type', '')).lower() or query_filter_text in str(item.get('language', '')).lower())) or
-            (item.get('internal_type') == 'shipping_supply' and (query_filter_text in str(item.get('description', '')).lower() or query_filter_text in str(item.get('unit_of_measure', '')).lower())) or
-            query_filter_text in str(item.get('location', '')).lower()
-        ]
-
-    # 4. Apply location filter
-    if query_filter_location != 'all':
-        filtered_inventory_items = [
-            item for item in filtered_inventory_items
-            if item.get('location') == query_filter_location
-        ]
-
-    # 5. Apply set filter (This is the key filter for the user's current problem)
-    if query_filter_set != 'all':
-        filtered_inventory_items = [
-            item for item in filtered_inventory_items
-            if (
-                item.get('internal_type') == 'single_card' and
-                (str(item.get('set_code','')) == query_filter_set or str(item.get('set_name','')) == query_filter_set)
-            ) or (
-                item.get('internal_type') == 'sealed_product' and
-                str(item.get('set_name','')) == query_filter_set
-            )
-        ]
-
-    # 6. Apply type-specific filters (foil, rarity, condition, collector, language)
-    temp_items_after_type_specific_filters = []
-    for item_to_check in filtered_inventory_items:
-        keep = True
-        if item_to_check.get('internal_type') == 'single_card':
-            if query_filter_foil != 'all' and item_to_check.get('is_foil') != (query_filter_foil == 'yes'): keep = False
-            if query_filter_rarity != 'all' and item_to_check.get('rarity') != query_filter_rarity: keep = False
-            if query_filter_card_lang != 'all' and item_to_check.get('language') != query_filter_card_lang: keep = False
-            if query_filter_condition != 'all' and item_to_check.get('condition') != query_filter_condition: keep = False
-        elif item_to_check.get('internal_type') == 'sealed_product':
-            if query_filter_collector != 'all' and item_to_check.get('is_collectors_item') != (query_filter_collector == 'yes'): keep = False
-            if query_filter_sealed_lang != 'all' and item_to_check.get('language') != query_filter_sealed_lang: keep = False
-        elif item_to_check.get('internal_type') == 'shipping_supply':
-            if query_filter_foil != 'all' or query_filter_rarity != 'all' or query_filter_card_lang != 'all' or \
-               query_filter_condition != 'all' or query_filter_collector != 'all' or query_filter_sealed_lang != 'all':
-                keep = False
-
-        if keep:
-            temp_items_after_type_specific_filters.append(item_to_check)
-    filtered_inventory_items = temp_items_after_type_specific_filters
-
-
-    # Prepare for sorting, using 'internal_type' to guide column access
-    def get_sort_value(item_to_sort, key):
-        if item_to_sort.get('internal_type') == 'shipping_supply':
-            if key == 'display_name' or key == 'supply_name': return str(item_to_sort.get('supply_name', '')).lower()
-            if key == 'quantity': return item_to_sort.get('quantity_on_hand', 0)
-            if key == 'buy_price' or key == 'cost_per_unit': return item_to_sort.get('cost_per_unit', -float('inf'))
-            if key == 'location': return str(item_to_sort.get('location', '')).lower()
-            if key == 'purchase_date': return str(item_to_sort.get('purchase_date', ''))
-            return str(item_to_sort.get(key, '')).lower()
-        else: # single_card or sealed_product
-            val = item_to_sort.get(key)
-            if key == 'set_name_sort':
-                s_val = (str(item_to_sort.get('set_code','')) or str(item_to_sort.get('set_name', ''))) if item_to_sort.get('internal_type') == 'single_card' else str(item_to_sort.get('set_name', ''))
-                return s_val.lower()
-            if isinstance(val, bool): return int(val)
-            if isinstance(val, (int, float)): return val if val is not None else (-float('inf') if query_sort_direction == 'asc' else float('inf'))
-            return str(val if val is not None else '').lower()
-
-    try:
-        filtered_inventory_items.sort(key=lambda i_sort: (get_sort_value(i_sort, query_sort_key), get_sort_value(i_sort, 'display_name')), reverse=(query_sort_direction == 'desc'))
-    except TypeError as e:
-        print(f"Sorting TypeError for key '{query_sort_key}': {e}. Falling back.");
-        filtered_inventory_items.sort(key=lambda i_sort: get_sort_value(i_sort, 'display_name'), reverse=(query_sort_direction == 'desc'))
-
-    total_filtered_item_count = len(filtered_inventory_items)
-    total_pages = (total_filtered_item_count + ITEMS_PER_PAGE - 1) // ITEMS_PER_PAGE if total_filtered_item_count > 0 else 1
-    page = max(1, min(page, total_pages))
-    offset = (page - 1) * ITEMS_PER_PAGE
-    paginated_inventory_items_for_display = filtered_inventory_items[offset : offset + ITEMS_PER_PAGE]
-    inventory_items_json = json.dumps(paginated_inventory_items_for_display)
-
-    total_buy_cost_of_inventory = total_buy_cost_of_inventory_cards + total_buy_cost_of_inventory_sealed
-    total_inventory_market_value = total_inventory_market_value_cards + total_inventory_market_value_sealed        
-    all_locations_temp = set(item.get('location') for item in all_combined_inventory_items_for_filtering if item.get('location'))
-    all_locations = sorted(list(all_locations_temp))
-    all_sets_identifiers_temp = set((item.get('set_code') or item.get('set_name')) for item in all_combined_inventory_items_for_filtering if item.get('internal_type') in ['single_card', 'sealed_product'] and (item.get('set_code') or item.get('set_name')))
-    all_sets_identifiers = sorted(list(all_sets_identifiers_temp))
-    all_rarities_temp = set(item.get('rarity') for item in all_combined_inventory_items_for_filtering if item.get('internal_type') == 'single_card' and item.get('rarity'))
-    all_rarities = sorted(list(all_rarities_temp))
-    all_card_languages_temp = set(item.get('language') for item in all_combined_inventory_items_for_filtering if item.get('internal_type') == 'single_card' and item.get('language'))
-    all_card_languages = sorted(list(all_card_languages_temp))
-    all_sealed_languages_temp = set(item.get('language') for item in all_combined_inventory_items_for_filtering if item.get('internal_type') == 'sealed_product' and item.get('language'))
-    all_sealed_languages = sorted(list(all_sealed_languages_temp))
-    all_conditions_for_template = ['Mint', 'Near Mint', 'Lightly Played', 'Moderately Played', 'Heavily Played', 'Damaged']
-
-
-    num_unique_card_inventory_entries = len(processed_inventory_cards)
-
-    sale_inventory_options = []
-    temp_sorted_for_sale_options = sorted(all_combined_inventory_items_for_filtering, key=lambda x_sort: x_sort.get('display_name', x_sort.get('supply_name', '')).lower())
-    for item_s_opt in temp_sorted_for_sale_options:
-        display_text_val = f"{item_s_opt.get('display_name', item_s_opt.get('supply_name', 'N/A'))} "
-        if item_s_opt.get('internal_type') == 'single_card':
-            condition_str = f"C: {item_s_opt.get('condition','N/A')}, "
-            display_text_val += f"({item_s_opt.get('set_code','N/A').upper()}-{item_s_opt.get('collector_number','N/A')}) {'(Foil)' if item_s_opt.get('is_foil') else ''} (R: {item_s_opt.get('rarity','N/A')}, L: {item_s_opt.get('language','N/A')}, {condition_str}BP: {format_currency_with_commas(item_s_opt.get('buy_price'))}) - Qty: {item_s_opt['quantity']} - Loc: {item_s_opt.get('location', 'N/A')}"
-        elif item_s_opt.get('internal_type') == 'sealed_product':
-            display_text_val += f"({item_s_opt.get('set_name','N/A')} / {item_s_opt.get('product_type','N/A')}){' (Collector)' if item_s_opt.get('is_collectors_item') else ''} (L: {item_s_opt.get('language','N/A')}, BP: {format_currency_with_commas(item_s_opt.get('buy_price'))}) - Qty: {item_s_opt['quantity']} - Loc: {item_s_opt.get('location', 'N/A')}"
-        elif item_s_opt.get('internal_type') == 'shipping_supply':
-            display_text_val += f"({item_s_opt.get('description','N/A')}) (UOM: {item_s_opt.get('unit_of_measure','N/A')}, BP: {format_currency_with_commas(item_s_opt.get('cost_per_unit'))}) - Qty: {item_s_opt['quantity_on_hand']} - Loc: {item_s_opt.get('location', 'N/A')}"
-        sale_inventory_options.append({"id": f"{item_s_opt['internal_type']}-{item_s_opt['id'] if item_s_opt.get('id') else item_s_opt['original_id']}", "display": display_text_val, "type": item_s_opt['internal_type']})
-
-    sale_inventory_options_json = json.dumps(sale_inventory_options)
-
-    shipping_supply_options = []
-    temp_sorted_supplies = sorted(processed_shipping_supplies, key=lambda x_sort: x_sort.get('supply_name', '').lower())
-    for supply_opt in temp_sorted_supplies:
-        display_text_val = f"{supply_opt['supply_name']} ({supply_opt.get('description', 'N/A')}) - Qty: {supply_opt['quantity_on_hand']} {supply_opt['unit_of_measure']} @ {format_currency_with_commas(supply_opt.get('cost_per_unit'))} each"
-        shipping_supply_options.append({
-            "id": supply_opt['id'],
-            "display": display_text_val,
-            "cost_per_unit": supply_opt['cost_per_unit'],
-            "quantity_on_hand": supply_opt['quantity_on_hand']
-        })
-    shipping_supply_options_json = json.dumps(shipping_supply_options)
-
-    shipping_supply_presets_json = json.dumps(shipping_supply_presets)
-
+    tab_context = TAB_CONTEXT_PROVIDERS[active_tab]()
 
     return render_template('index.html',
-                           inventory_items_json=inventory_items_json,
-                           sales_history_json=json.dumps(sales_history_data_for_json),
-                           sale_inventory_options_json=sale_inventory_options_json,
-                           total_inventory_market_value=total_inventory_market_value,
-                           total_buy_cost_of_inventory=total_buy_cost_of_inventory,
-                           total_single_cards_quantity=total_single_cards_quantity,
-                           total_sealed_products_quantity=total_sealed_products_quantity,
-                           sales_pl=sales_pl,
-                           net_business_pl=net_business_pl,
-                           num_unique_card_inventory_entries=num_unique_card_inventory_entries,
-                           current_month_sales_count=current_month_sale_events_count,
-                           current_month_sealed_sold_quantity=current_month_sealed_sold_quantity,
-                           current_month_single_cards_sold_quantity=current_month_single_cards_sold_quantity,
-                           current_month_profit_loss=current_month_profit_loss,
-                           current_month_name=today_date_obj.strftime("%B"),
-                           historical_monthly_sales_summary=historical_monthly_sales_summary,
                            active_tab=active_tab,
                            current_date=datetime.date.today().isoformat(),
                            suggested_buy_price=suggested_buy_price,
                            from_pack_details=from_pack_details,
-                           current_page=page, total_pages=total_pages,
+                           current_page=page,
+                           items_per_page=ITEMS_PER_PAGE,
                            filter_text=query_filter_text,
                            filter_type=query_filter_type,
                            filter_location=query_filter_location,
@@ -457,18 +424,7 @@ def index():
                            filter_sealed_lang=query_filter_sealed_lang, # Corrected variable name
                            sort_key=query_sort_key,
                            sort_dir=query_sort_direction,
-                           all_locations=all_locations,
-                           all_sets_identifiers=all_sets_identifiers,
-                           all_rarities=all_rarities,
-                           all_card_languages=all_card_languages,
-                           all_sealed_languages=all_sealed_languages,
-                           all_conditions=all_conditions_for_template,
-                           financial_entries=financial_entries,
-                           total_cogs=total_cogs,
-                           total_gross_sales=total_gross_sales,
-                           shipping_supplies_display_json=json.dumps(processed_shipping_supplies),
-                           shipping_supply_options_json=shipping_supply_options_json,
-                           shipping_supply_presets_json=shipping_supply_presets_json
+                           **tab_context
                            )
 
 @app.route('/add_shipping_supply', methods=['POST'])
@@ -565,6 +521,12 @@ def delete_shipping_supply_preset_route(preset_id):
         return jsonify({"success": False, "message": "Failed to delete preset."}), 500
 
 
+@app.route('/take_valuation_snapshot', methods=['POST'])
+def take_valuation_snapshot_route():
+    success, message, _ = database.take_valuation_snapshot()
+    flash(message, 'success' if success else 'error')
+    return redirect(url_for('index', tab='dashboardTab'))
+
 @app.route('/initiate_open_sealed/<int:product_id>', methods=['POST'])
 def initiate_open_sealed_route(product_id):
     quantity_to_open_str = request.form.get('quantity_to_open')
@@ -954,83 +916,28 @@ def edit_sale_event_get_route(sale_event_id):
         sale_event_data['sale_date'] = sale_event_data['sale_date'].isoformat()
 
     # Prepare current items for JS pre-population
-    current_sale_items = []
-    for item in sale_event_data['items']:
-        current_sale_items.append({
-            'inventory_item_id_with_prefix': f"{item['item_type']}-{item['inventory_item_id']}",
-            'quantity_sold': item['quantity_sold'],
-            'sell_price_per_item': item['sell_price_per_item'],
-            'display_name': item['original_item_name'],
-            'display_details': item['original_item_details']
-        })
-    current_sale_items_json = json.dumps(current_sale_items)
+    current_sale_items = [models.SaleItem.from_row(item).to_form_dict() for item in sale_event_data['items']]
+    current_sale_items_json = app.json.dumps(current_sale_items)
 
     # Shipping supplies
     current_shipping_supplies_used = {}
     for supply in sale_event_data['shipping_supplies_used']:
         current_shipping_supplies_used[supply['supply_id']] = supply['quantity_used']
-    current_shipping_supplies_used_json = json.dumps(current_shipping_supplies_used)
-
-
-    # Need to pass all options for item lookup as well (cards, sealed, supplies)
-    inventory_cards_data = database.get_all_cards()
-    sealed_products_data = database.get_all_sealed_products()
-    shipping_supplies_data = database.get_all_shipping_supplies()
-
-    all_combined_inventory_items_for_filtering = []
-    for item in inventory_cards_data:
-        item_copy = dict(item)
-        item_copy['internal_type'] = 'single_card'
-        item_copy['display_name'] = item_copy.get('name', 'N/A') # Set display_name for cards
-        all_combined_inventory_items_for_filtering.append(item_copy)
-    for item in sealed_products_data:
-        item_copy = dict(item)
-        item_copy['internal_type'] = 'sealed_product'
-        item_copy['display_name'] = item_copy.get('product_name', 'N/A') # Set display_name for sealed products
-        all_combined_inventory_items_for_filtering.append(item_copy)
-    for item in shipping_supplies_data:
-        item_copy = dict(item)
-        item_copy['internal_type'] = 'shipping_supply'
-        item_copy['display_name'] = item_copy.get('supply_name', 'N/A') # Ensure display_name for supplies here
-        all_combined_inventory_items_for_filtering.append(item_copy)
-
-    sale_inventory_options = []
-    temp_sorted_for_sale_options = sorted(all_combined_inventory_items_for_filtering, key=lambda x_sort: x_sort.get('display_name', x_sort.get('supply_name', '')).lower())
-    for item_s_opt in temp_sorted_for_sale_options:
-        display_text_val = f"{item_s_opt.get('display_name', item_s_opt.get('supply_name', 'N/A'))} "
-        if item_s_opt.get('internal_type') == 'single_card':
-            condition_str = f"C: {item_s_opt.get('condition','N/A')}, "
-            display_text_val += f"({item_s_opt.get('set_code','N/A').upper()}-{item_s_opt.get('collector_number','N/A')}) {'(Foil)' if item_s_opt.get('is_foil') else ''} (R: {item_s_opt.get('rarity','N/A')}, L: {item_s_opt.get('language','N/A')}, {condition_str}BP: {format_currency_with_commas(item_s_opt.get('buy_price'))}) - Qty: {item_s_opt['quantity']} - Loc: {item_s_opt.get('location', 'N/A')}"
-        elif item_s_opt.get('internal_type') == 'sealed_product':
-            display_text_val += f"({item_s_opt.get('set_name','N/A')} / {item_s_opt.get('product_type','N/A')}){' (Collector)' if item_s_opt.get('is_collectors_item') else ''} (L: {item_s_opt.get('language','N/A')}, BP: {format_currency_with_commas(item_s_opt.get('buy_price'))}) - Qty: {item_s_opt['quantity']} - Loc: {item_s_opt.get('location', 'N/A')}"
-        elif item_s_opt.get('internal_type') == 'shipping_supply':
-            display_text_val += f"({item_s_opt.get('description','N/A')}) (UOM: {item_s_opt.get('unit_of_measure','N/A')}, BP: {format_currency_with_commas(item_s_opt.get('cost_per_unit'))}) - Qty: {item_s_opt['quantity_on_hand']} - Loc: {item_s_opt.get('location', 'N/A')}"
-        sale_inventory_options.append({"id": f"{item_s_opt['internal_type']}-{item_s_opt['id'] if item_s_opt.get('id') else item_s_opt['original_id']}", "display": display_text_val, "type": item_s_opt['internal_type']})
-
-    sale_inventory_options_json = json.dumps(sale_inventory_options)
-
-    shipping_supply_options = []
-    temp_sorted_supplies = sorted(shipping_supplies_data, key=lambda x_sort: x_sort.get('supply_name', '').lower())
-    for supply_opt in temp_sorted_supplies:
-        display_text_val = f"{supply_opt['supply_name']} ({supply_opt.get('description', 'N/A')}) - Qty: {supply_opt['quantity_on_hand']} {supply_opt['unit_of_measure']} @ {format_currency_with_commas(supply_opt.get('cost_per_unit'))} each"
-        shipping_supply_options.append({
-            "id": supply_opt['id'],
-            "display": display_text_val,
-            "cost_per_unit": supply_opt['cost_per_unit'],
-            "quantity_on_hand": supply_opt['quantity_on_hand']
-        })
-    shipping_supply_options_json = json.dumps(shipping_supply_options)
+    current_shipping_supplies_used_json = app.json.dumps(current_shipping_supplies_used)
+
+
+    # Inventory items are looked up through /api/sale_item_search; only supplies are listed in full.
+    shipping_supply_options_json = app.json.dumps(inventory_options.build_shipping_supply_options())
 
     # Need to also pass shipping_supply_presets to edit_sale.html for the presets dropdown
     shipping_supply_presets = database.get_all_shipping_supply_presets()
-    shipping_supply_presets_json = json.dumps(shipping_supply_presets)
+    shipping_supply_presets_json = app.json.dumps(shipping_supply_presets)
 
 
     return render_template('edit_sale.html',
                            sale_event=sale_event_data,
                            current_sale_items_json=current_sale_items_json,
                            current_shipping_supplies_used_json=current_shipping_supplies_used_json,
-                           sale_inventory_options_json=sale_inventory_options_json,
                            shipping_supply_options_json=shipping_supply_options_json,
                            shipping_supply_presets_json=shipping_supply_presets_json, # Pass presets here
                            current_date=datetime.date.today().isoformat()
@@ -1052,6 +959,7 @@ def edit_sale_event_post_route(sale_event_id):
 
         customer_shipping_charge_str = data.get('customer_shipping_charge', '0.0')
         platform_fee_str = data.get('platform_fee', '0.0')
+        platform = data.get('platform')
 
         if not sale_date_str or not isinstance(items_data, list) or not items_data:
             flash('Missing sale date or items data.', 'error')
@@ -1065,7 +973,8 @@ def edit_sale_event_post_route(sale_event_id):
             customer_shipping_charge_str,
             platform_fee_str,
             items_data,
-            shipping_supplies_data
+            shipping_supplies_data,
+            platform=platform
         )
 
         if success:
@@ -1080,293 +989,107 @@ def edit_sale_event_post_route(sale_event_id):
         return jsonify({"success": False, "message": f"An internal error occurred: {str(e)}"}), 500
 
 
+def _wants_json():
+    return request.accept_mimetypes.best == 'application/json' or request.headers.get('X-Requested-With') == 'XMLHttpRequest'
+
+def _import_error(message, status_code=400):
+    if _wants_json():
+        return jsonify({"success": False, "message": message}), status_code
+    flash(message, 'error')
+    return redirect(url_for('index', tab='addItemsTab'))
+
 @app.route('/import_csv', methods=['POST'])
 def import_csv_route():
+    """Validates the upload and starts a background import job (see import_jobs.py); returns immediately."""
     if 'csv_file' not in request.files:
-        flash('No CSV file part in the request.', 'error')
-        return redirect(url_for('index', tab='addItemsTab'))
+        return _import_error('No CSV file part in the request.')
     file = request.files['csv_file']
     if file.filename == '':
-        flash('No CSV file selected for uploading.', 'error')
-        return redirect(url_for('index', tab='addItemsTab'))
+        return _import_error('No CSV file selected for uploading.')
 
     default_buy_price_str = request.form.get('default_buy_price', '0.00')
     default_location = request.form.get('default_location', 'Imported Batch')
     default_asking_price_str = request.form.get('default_asking_price')
-    default_language_csv_form = request.form.get('default_language_csv', 'en').strip().lower()
-    default_condition_csv_form = request.form.get('default_condition_csv', 'Near Mint').strip()
-    assume_non_foil = 'assume_non_foil' in request.form
-
     try:
         default_buy_price = float(default_buy_price_str)
         default_asking_price = float(default_asking_price_str) if default_asking_price_str and default_asking_price_str.strip() != '' else None
     except (ValueError, TypeError):
-        flash('Invalid default price format.', 'error')
-        return redirect(url_for('index', tab='addItemsTab'))
-
+        return _import_error('Invalid default price format.')
     if not default_location.strip():
-        flash('Default location cannot be empty.', 'error')
-        return redirect(url_for('index', tab='addItemsTab'))
-
+        return _import_error('Default location cannot be empty.')
     if not file or not file.filename.endswith('.csv'):
-        flash('Invalid file type. Please upload a CSV file.', 'error')
-        return redirect(url_for('index', tab='addItemsTab'))
-
-    card_aggregator = defaultdict(lambda: {'quantity': 0, 'details': {}})
-    errors_list = []
-    skipped_count = 0
-
+        return _import_error('Invalid file type. Please upload a CSV file.')
+
+    options = {
+        'default_buy_price': default_buy_price,
+        'default_location': default_location,
+        'default_asking_price': default_asking_price,
+        'default_language': request.form.get('default_language_csv', 'en').strip().lower(),
+        'default_condition': request.form.get('default_condition_csv', 'Near Mint').strip(),
+        'assume_non_foil': 'assume_non_foil' in request.form,
+        'restart_import': 'restart_import' in request.form,
+    }
     try:
-        stream = io.StringIO(file.stream.read().decode("UTF8", errors='replace'), newline=None)
-        csv_reader = csv.DictReader(stream)
-
-        if not csv_reader.fieldnames:
-             flash('CSV file appears to be empty or has no headers.', 'error')
-             return redirect(url_for('index', tab='addItemsTab'))
-
-        # Define flexible column mappings for common variations
-        # Keys are internal names, values are lists of possible CSV headers (normalized)
-        flexible_headers = {
-            'card_name': ['product name', 'name'],
-            'quantity': ['total quantity', 'quantity'], # TCGplayer uses "Total Quantity"
-            'set_identifier': ['set code', 'set name', 'set'], # Order: prefer code, then name, then generic 'set'
-            'collector_number': ['number', 'card number', 'collector number'], # TCGplayer uses "Number"
-            'rarity': ['rarity'],
-            'language': ['language'],
-            'condition': ['condition'],
-            'printing': ['printing'], # For old files that might have this explicit column
-            'tcg_market_price': ['tcg market price', 'market price'] # TCGplayer specific
-        }
-
-        # Create a mapping from our internal flexible name to the actual column name found in the CSV
-        actual_csv_header_map = {}
-        normalized_incoming_headers = [hdr.lower().replace(' ', '_') for hdr in csv_reader.fieldnames if hdr]
-
-        for internal_name, possible_headers in flexible_headers.items():
-            for possible_hdr in possible_headers:
-                if possible_hdr in normalized_incoming_headers:
-                    actual_csv_header_map[internal_name] = possible_hdr
-                    break # Found the first best match for this internal_name
-        
-        # Check for essential columns based on *any* of their possible names
-        # 'card_name' or 'quantity' must be present under any of their flexible names
-        has_card_name_col = 'card_name' in actual_csv_header_map
-        has_quantity_col = 'quantity' in actual_csv_header_map
-
-        if not has_card_name_col or not has_quantity_col:
-             flash(f"CSV missing one or more required columns ('Name'/'Product Name' and 'Quantity'/'Total Quantity'). Found headers: {', '.join(normalized_incoming_headers)}", 'error')
-             return redirect(url_for('index', tab='addItemsTab'))
-
-
-        for row_num, row_raw in enumerate(csv_reader, start=1):
-            # Convert row_raw keys to normalized lowercase keys for easy access
-            row = {k.lower().replace(' ', '_'): v.strip() if isinstance(v, str) else v for k, v in row_raw.items()}
-
-            # Extract data using the determined actual_csv_header_map
-            card_name = row.get(actual_csv_header_map.get('card_name'))
-            quantity_str = row.get(actual_csv_header_map.get('quantity'))
-            
-            # Use the mapped header names to get values from the current row
-            set_identifier_from_csv = row.get(actual_csv_header_map.get('set_identifier'))
-            collector_number_from_csv = row.get(actual_csv_header_map.get('collector_number'))
-            rarity_from_csv = row.get(actual_csv_header_map.get('rarity'))
-            language_from_csv = row.get(actual_csv_header_map.get('language'))
-            condition_from_csv = row.get(actual_csv_header_map.get('condition'))
-            printing_from_csv = row.get(actual_csv_header_map.get('printing'))
-            tcg_market_price_from_csv = row.get(actual_csv_header_map.get('tcg_market_price'))
-
-
-            # --- Validation of per-row required fields ---
-            if not all([card_name, quantity_str]):
-                errors_list.append(f"Row {row_num}: Missing 'Name' or 'Quantity'. Skipping.")
-                skipped_count += 1
-                continue
-
+        job_id = import_jobs.submit_import(file, options)
+    except import_jobs.ImportQueueFull as e:
+        return _import_error(str(e), 429)
+    except import_jobs.ImportStateUnavailable as e:
+        print(f"Could not start CSV import: {e}")
+        return _import_error('Imports are temporarily unavailable (the job store could not be reached). Please try again shortly.', 503)
+    except OSError as e:
+        print(f"Could not spool CSV upload: {e}")
+        return _import_error('The uploaded file could not be stored for import. Please try again.', 500)
+
+    if _wants_json():
+        return jsonify({"success": True, "job_id": job_id,
+                        "status_url": url_for('import_job_status', job_id=job_id)}), 202
+    flash(f"Import of '{file.filename}' started in the background (job {job_id[:8]}). New cards appear in the inventory as they are processed.", 'success')
+    return redirect(url_for('index', tab='addItemsTab', import_job=job_id))
+
+@app.route('/import_jobs/<job_id>')
+def import_job_status(job_id):
+    """
+    An import job's state as JSON. The upload page polls this every few seconds (a request per poll
+    instead of a long-lived stream, so watching an import never holds a server thread). With
+    ?errors_from=N only the stored errors after the first N are included.
+    """
+    try:
+        job = import_jobs.get_job(job_id)
+    except import_jobs.ImportStateUnavailable as e:
+        print(f"Could not read import job {job_id}: {e}")
+        return jsonify({"success": False, "message": "Import progress is temporarily unavailable."}), 503
+    if job is None:
+        return jsonify({"success": False, "message": "Import job not found (it may have expired)."}), 404
+    errors_from = max(request.args.get('errors_from', 0, type=int) or 0, 0)
+    return jsonify(dict(job, errors=job['errors'][errors_from:]))
+
+@app.route('/export/<dataset>.<export_format>')
+def export_route(dataset, export_format):
+    """
+    Streams a CSV or JSONL export (see exports.py) as a chunked download.
+    Inventory datasets take the inventory tab's filter args; sales and ledger take start_date / end_date.
+    """
+    filters = _inventory_filters_from_args(request.args)
+    for date_arg in ('start_date', 'end_date'):
+        date_str = request.args.get(date_arg, '').strip()
+        if date_str:
             try:
-                quantity = int(quantity_str)
-                if quantity <= 0:
-                    errors_list.append(f"Row {row_num}: Quantity for '{card_name}' must be positive. Skipping.")
-                    skipped_count += 1
-                    continue
-            except (ValueError, TypeError):
-                errors_list.append(f"Row {row_num}: Invalid quantity '{quantity_str}' for '{card_name}'. Skipping.")
-                skipped_count += 1
-                continue
-            
-            # --- Determine foil status (more robust) ---
-            is_foil = False
-            # 1. Check 'Printing' column from older CSVs if available and says 'foil'
-            if printing_from_csv and 'foil' in str(printing_from_csv).lower():
-                is_foil = True
-            # 2. If 'assume_non_foil' is checked in the form, it overrides other detections for mass import
-            if assume_non_foil:
-                is_foil = False
-            # You could add more advanced detection here for TCGplayer's specifics if needed.
-
-            # --- Aggregate cards for stacking ---
-            # Use data from CSV, or form defaults if CSV fields are missing/empty
-            current_rarity_for_agg = rarity_from_csv.lower() if rarity_from_csv else 'unknown'
-            current_language_for_agg = language_from_csv.lower() if language_from_csv else default_language_csv_form
-            current_condition_for_agg = condition_from_csv.strip() if condition_from_csv else default_condition_csv_form
-
-
-            unique_key = (
-                card_name.lower(),
-                (set_identifier_from_csv.lower() if set_identifier_from_csv else ''), # Can be code or name
-                (collector_number_from_csv.lower() if collector_number_from_csv else ''),
-                is_foil,
-                default_location.lower(), # From form
-                default_buy_price,        # From form
-                current_condition_for_agg.lower(),
-                current_rarity_for_agg.lower(),
-                current_language_for_agg.lower()
-            )
-            
-            # Store data for this stack (quantity and other details for Scryfall lookup/DB insert)
-            card_aggregator[unique_key]['quantity'] += quantity
-            if not card_aggregator[unique_key]['details']:
-                 card_aggregator[unique_key]['details'] = {
-                     'name': card_name,
-                     'set_identifier': set_identifier_from_csv, # Raw identifier from CSV
-                     'collector_number': collector_number_from_csv,
-                     'rarity': current_rarity_for_agg, # Cleaned rarity
-                     'language': current_language_for_agg, # Cleaned language
-                     'condition': current_condition_for_agg, # Cleaned condition
-                     'is_foil': is_foil, # Foil status determined above
-                     'buy_price': default_buy_price, # From form
-                     'sell_price': default_asking_price, # From form
-                     'location': default_location, # From form
-                     'tcg_market_price_csv': float(tcg_market_price_csv) if tcg_market_price_csv else None
-                 }
-
-    except Exception as e:
-        flash(f'Critical error reading or processing CSV file: {e}', 'error')
-        import traceback; traceback.print_exc()
-        return redirect(url_for('index', tab='addItemsTab'))
-
-    imported_count = 0
-    failed_count = 0
-
-    # --- Process Aggregated Cards and Add to DB ---
-    for key, data in card_aggregator.items():
-        card_info = data['details']
-        total_quantity = data['quantity']
-
-        # --- Scryfall Lookup for comprehensive data (using cleaned data) ---
-        card_details = None
-        scryfall_card_name = card_info['name']
-        scryfall_set_id = card_info['set_identifier'] # Could be set code or set name
-        scryfall_collector_number = card_info['collector_number']
-        scryfall_language = card_info['language']
-
-        # Scryfall lookup logic (prioritized for best match)
-        # Priority 1: Set Identifier + Collector Number + Card Name (most specific)
-        if scryfall_set_id and scryfall_collector_number:
-            card_details = scryfall.get_card_details(
-                card_name=scryfall_card_name,
-                set_code=scryfall_set_id, # Scryfall can often resolve set names too
-                collector_number=scryfall_collector_number,
-                lang=scryfall_language
-            )
-
-        # Priority 2: Set Identifier + Card Name (no collector number)
-        if not card_details and scryfall_set_id and scryfall_card_name:
-            card_details = scryfall.get_card_details(
-                card_name=scryfall_card_name,
-                set_code=scryfall_set_id,
-                lang=scryfall_language
-            )
-        
-        # Priority 3: Card Name + Collector Number (no specific set identifier)
-        if not card_details and scryfall_card_name and scryfall_collector_number:
-            card_details = scryfall.get_card_details(
-                card_name=scryfall_card_name,
-                collector_number=scryfall_collector_number,
-                lang=scryfall_language
-            )
-
-        # Priority 4: Card Name only (least precise)
-        if not card_details and scryfall_card_name:
-            card_details = scryfall.get_card_details(
-                card_name=scryfall_card_name,
-                lang=scryfall_language
-            )
-
-
-        if card_details and all(k in card_details for k in ['name', 'collector_number', 'set_code']):
-            final_name = card_details['name']
-            final_set_code = card_details['set_code'].upper() # Always store set code as uppercase
-            final_collector_number = card_details['collector_number']
-            final_scryfall_uuid = card_details.get('id')
-
-            # Use Scryfall's rarity/language if available, otherwise use mapped CSV data
-            final_rarity = card_details.get('rarity', card_info['rarity']).lower() # Use cleaned rarity from card_info
-            final_language = card_details.get('language', card_info['language']).lower() # Use cleaned language from card_info
-            final_condition = card_info['condition'] # Use cleaned condition from card_info
-
-            # For image, prefer Scryfall's image_uri
-            final_image_uri = card_details.get('image_uri')
-
-            # Market prices from Scryfall (prefer Scryfall's current data)
-            final_market_price_usd = card_details.get('market_price_usd')
-            final_foil_market_price_usd = card_details.get('foil_market_price_usd')
-
-            # Re-evaluate is_foil based on Scryfall and previous logic
-            is_foil_final = card_info['is_foil'] # Start with what was determined from CSV/form
-            if not is_foil_final and card_details.get('foil_market_price_usd') is not None and card_details.get('market_price_usd') is None:
-                is_foil_final = True # If Scryfall only has foil price, it's likely foil, override non-foil assumption
-
-            card_id = database.add_card(
-                set_code=final_set_code,
-                collector_number=final_collector_number,
-                name=final_name,
-                quantity=total_quantity,
-                buy_price=card_info['buy_price'],
-                is_foil=is_foil_final,
-                market_price_usd=final_market_price_usd,
-                foil_market_price_usd=final_foil_market_price_usd,
-                image_uri=final_image_uri,
-                sell_price=card_info['sell_price'],
-                location=card_info['location'],
-                scryfall_id=final_scryfall_uuid,
-                rarity=final_rarity,
-                language=final_language,
-                condition=final_condition
-            )
-
-            if card_id:
-                imported_count += 1
-            else:
-                failed_count += 1
-                errors_list.append(f"DB error for '{card_info['name']}' (Set: {card_info.get('set_identifier')}).")
-        else:
-            failed_count += 1
-            errors_list.append(f"Scryfall lookup failed for '{card_info['name']}' (Set: {card_info.get('set_identifier') or 'N/A'}, CN: {card_info.get('collector_number') or 'N/A'}).")
-
-    summary_message = f"CSV Import Finished: {imported_count} unique card stacks processed."
-    if failed_count > 0: summary_message += f" {failed_count} failed."
-    if skipped_count > 0: summary_message += f" {skipped_count} rows skipped."
-
-    flash_category = 'success' if imported_count > 0 and not errors_list else ('warning' if imported_count > 0 and errors_list else 'error')
-    flash(summary_message, flash_category)
-
-    if errors_list:
-        [flash(f"Import Error: {err}", 'error') for err in errors_list[:10]]
-        if len(errors_list) > 10:
-            flash(f"...and {len(errors_list) - 10} more errors (see server console for full list).", 'error')
-        print("--- Detailed CSV Import Errors ---\n" + "\n".join(errors_list) + "\n---------------------------------")
-
-    return redirect(url_for('index', tab='addItemsTab'))
+                filters[date_arg] = datetime.datetime.strptime(date_str, '%Y-%m-%d').date()
+            except ValueError:
+                return jsonify({"success": False, "message": f"Invalid {date_arg}; use YYYY-MM-DD."}), 400
+    try:
+        chunks = exports.generate_export(dataset, export_format, filters)
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 404
+    filename = exports.export_filename(dataset, export_format, datetime.date.today())
+    return app.response_class(stream_with_context(chunks), mimetype=exports.EXPORT_FORMATS[export_format],
+                              headers={'Content-Disposition': f'attachment; filename="{filename}"',
+                                       'Cache-Control': 'no-store', 'X-Accel-Buffering': 'no'})
 
 
-# ... (rest of the app.py code) ...
-
-if __name__ == '__main__':
-    port = int(os.environ.get('PORT', 10000))
-    app.run(host='0.0.0.0', port=port)
-
 
 @app.route('/api/all_shipping_supply_presets', methods=['GET'])
+@versioned_by('shipping_supply_presets', 'shipping_preset_items', 'shipping_supplies_inventory')
 def api_all_shipping_supply_presets():
     try:
         presets = database.get_all_shipping_supply_presets()
@@ -1429,6 +1152,37 @@ def mass_edit_inventory_route():
         flash(f"An unexpected error occurred during mass edit: {str(e)}", 'error')
         return jsonify({"success": False, "message": f"An internal error occurred: {str(e)}"}), 500
 
+@app.route('/reprice', methods=['POST'])
+def reprice_route():
+    """
+    Runs repricing rules over the (filtered) inventory. JSON body: {"rules": rule set (see repricing.py),
+    "filters": inventory tab filters, "apply": false for a dry run}. Returns the diff summary and the biggest changes.
+    """
+    data = request.get_json(silent=True) or {}
+    filters = _inventory_filters_from_args({key: str(value) for key, value in (data.get('filters') or {}).items()})
+    apply = bool(data.get('apply'))
+    try:
+        priced_queries = repricing.compile_rule_set(data.get('rules'), filters['filter_type'])
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    result = database.reprice_inventory(priced_queries, filters, apply=apply)
+    if result is None:
+        return jsonify({"success": False, "message": "Database error while repricing; nothing was changed."}), 500
+    changed_count = sum(summary['changed'] for summary in result['summary'].values())
+    if apply:
+        flash(f"Repricing applied: {changed_count} asking prices updated.", 'success')
+    return jsonify(dict(result, success=True, changed_count=changed_count))
+
+def _sale_request_hash(data):
+    """SHA-256 of the sale request body (without its idempotency key), independent of key order and whitespace."""
+    body = {key: value for key, value in data.items() if key != 'idempotency_key'}
+    return hashlib.sha256(json.dumps(body, sort_keys=True, separators=(',', ':'), default=str).encode('utf-8')).hexdigest()
+
+def _idempotency_conflict_response(sale_event_id):
+    return jsonify({"success": False, "conflict": True, "sale_event_id": sale_event_id,
+                    "message": f"This submission's key was already used to record a different sale (ID: {sale_event_id}). "
+                               "Check Sales History; submit again to record this as a new sale."}), 409
+
 @app.route('/record_multi_item_sale', methods=['POST'])
 def record_multi_item_sale_route():
     try:
@@ -1444,20 +1198,43 @@ def record_multi_item_sale_route():
 
         customer_shipping_charge_str = data.get('customer_shipping_charge', '0.0')
         platform_fee_str = data.get('platform_fee', '0.0')
+        platform = data.get('platform')
+        # Sent once per submitted sale; a retry or double click repeats it (see database.record_multi_item_sale).
+        idempotency_key = (request.headers.get('Idempotency-Key') or data.get('idempotency_key') or '').strip() or None
+        if idempotency_key and len(idempotency_key) > database.SALE_IDEMPOTENCY_KEY_MAX_LENGTH:
+            return jsonify({"success": False, "message": "Idempotency key is too long."}), 400
 
         if not sale_date_str or not isinstance(items_data, list) or not items_data:
             flash('Missing sale date or items data.', 'error')
             return jsonify({"success": False, "message": "Missing sale date or items list is empty."}), 400
 
-        sale_event_id, message = database.record_multi_item_sale(
-            sale_date_str,
-            total_shipping_cost_str,
-            overall_notes,
-            items_data,
-            customer_shipping_charge_str,
-            platform_fee_str,
-            shipping_supplies_data
-        )
+        request_hash = None
+        if idempotency_key:
+            request_hash = _sale_request_hash(data)
+            # Cheap answer for a replay of a sale that already committed; no transaction, no flash.
+            existing = database.get_sale_idempotency_record(idempotency_key)
+            if existing and existing[0]:
+                existing_sale_event_id, existing_hash = existing
+                if existing_hash and existing_hash != request_hash:
+                    return _idempotency_conflict_response(existing_sale_event_id)
+                return jsonify({"success": True, "replayed": True, "sale_event_id": existing_sale_event_id,
+                                "message": f"Sale event (ID: {existing_sale_event_id}) was already recorded."})
+
+        try:
+            sale_event_id, message = database.record_multi_item_sale(
+                sale_date_str,
+                total_shipping_cost_str,
+                overall_notes,
+                items_data,
+                customer_shipping_charge_str,
+                platform_fee_str,
+                shipping_supplies_data,
+                platform=platform,
+                idempotency_key=idempotency_key,
+                request_hash=request_hash
+            )
+        except database.IdempotencyKeyConflict as e:
+            return _idempotency_conflict_response(e.sale_event_id)
 
         if sale_event_id:
             flash(f"Sale event (ID: {sale_event_id}) recorded. {message}", 'success')
@@ -1470,144 +1247,7 @@ def record_multi_item_sale_route():
         flash(f"An error occurred: {str(e)}", 'error')
         return jsonify({"success": False, "message": f"An internal error occurred: {str(e)}"}), 500
 
-@app.route('/edit_sale_event/<int:sale_event_id>', methods=['GET'])
-def edit_sale_event_get_route(sale_event_id):
-    sale_event_data = database.get_sale_event_by_id_with_details(sale_event_id)
-    if not sale_event_data:
-        flash("Sale event not found.", 'error')
-        return redirect(url_for('index', tab='salesHistoryTab'))
-
-    # Convert date objects to string for HTML form input
-    if isinstance(sale_event_data.get('sale_date'), datetime.date):
-        sale_event_data['sale_date'] = sale_event_data['sale_date'].isoformat()
-
-    # Prepare current items for JS pre-population
-    # Sale items
-    current_sale_items = []
-    for item in sale_event_data['items']:
-        current_sale_items.append({
-            'inventory_item_id_with_prefix': f"{item['item_type']}-{item['inventory_item_id']}",
-            'quantity_sold': item['quantity_sold'],
-            'sell_price_per_item': item['sell_price_per_item'],
-            'display_name': item['original_item_name'], # For display in frontend
-            'display_details': item['original_item_details'] # For display
-        })
-    current_sale_items_json = json.dumps(current_sale_items)
-
-    # Shipping supplies
-    current_shipping_supplies_used = {}
-    for supply in sale_event_data['shipping_supplies_used']:
-        current_shipping_supplies_used[supply['supply_id']] = supply['quantity_used']
-    current_shipping_supplies_used_json = json.dumps(current_shipping_supplies_used)
-
-
-    # Need to pass all options for item lookup as well (cards, sealed, supplies)
-    inventory_cards_data = database.get_all_cards()
-    sealed_products_data = database.get_all_sealed_products()
-    shipping_supplies_data = database.get_all_shipping_supplies() # This data contains datetime.date objects
-
-    all_combined_inventory_items_for_filtering = []
-    for item in inventory_cards_data:
-        item_copy = dict(item)
-        item_copy['internal_type'] = 'single_card' # Add a consistent type identifier for filtering
-        item_copy['display_name'] = item_copy.get('name', 'N/A')
-        all_combined_inventory_items_for_filtering.append(item_copy)
-    for item in sealed_products_data:
-        item_copy = dict(item)
-        item_copy['internal_type'] = 'sealed_product' # Add a consistent type identifier for filtering
-        item_copy['display_name'] = item_copy.get('product_name', 'N/A')
-        all_combined_inventory_items_for_filtering.append(item_copy)
-    for item in shipping_supplies_data:
-        item_copy = dict(item)
-        item_copy['internal_type'] = 'shipping_supply' # Add a consistent type identifier for filtering
-        item_copy['display_name'] = item_copy.get('supply_name', 'N/A')
-        all_combined_inventory_items_for_filtering.append(item_copy)
-
-    sale_inventory_options = []
-    temp_sorted_for_sale_options = sorted(all_combined_inventory_items_for_filtering, key=lambda x_sort: x_sort.get('display_name', x_sort.get('supply_name', '')).lower())
-    for item_s_opt in temp_sorted_for_sale_options:
-        display_text_val = f"{item_s_opt.get('display_name', item_s_opt.get('supply_name', 'N/A'))} "
-        if item_s_opt.get('internal_type') == 'single_card':
-            condition_str = f"C: {item_s_opt.get('condition','N/A')}, "
-            display_text_val += f"({item_s_opt.get('set_code','N/A').upper()}-{item_s_opt.get('collector_number','N/A')}) {'(Foil)' if item_s_opt.get('is_foil') else ''} (R: {item_s_opt.get('rarity','N/A')}, L: {item_s_opt.get('language','N/A')}, {condition_str}BP: {format_currency_with_commas(item_s_opt.get('buy_price'))}) - Qty: {item_s_opt['quantity']} - Loc: {item_s_opt.get('location', 'N/A')}"
-        elif item_s_opt.get('internal_type') == 'sealed_product':
-            display_text_val += f"({item_s_opt.get('set_name','N/A')} / {item_s_opt.get('product_type','N/A')}){' (Collector)' if item_s_opt.get('is_collectors_item') else ''} (L: {item_s_opt.get('language','N/A')}, BP: {format_currency_with_commas(item_s_opt.get('buy_price'))}) - Qty: {item_s_opt['quantity']} - Loc: {item_s_opt.get('location', 'N/A')}"
-        elif item_s_opt.get('internal_type') == 'shipping_supply':
-            display_text_val += f"({item_s_opt.get('description','N/A')}) (UOM: {item_s_opt.get('unit_of_measure','N/A')}, BP: {format_currency_with_commas(item_s_opt.get('cost_per_unit'))}) - Qty: {item_s_opt['quantity_on_hand']} - Loc: {item_s_opt.get('location', 'N/A')}"
-        sale_inventory_options.append({"id": f"{item_s_opt['internal_type']}-{item_s_opt['id'] if item_s_opt.get('id') else item_s_opt['original_id']}", "display": display_text_val, "type": item_s_opt['internal_type']})
-
-    sale_inventory_options_json = json.dumps(sale_inventory_options)
-
-    shipping_supply_options = []
-    temp_sorted_supplies = sorted(shipping_supplies_data, key=lambda x_sort: x_sort.get('supply_name', '').lower())
-    for supply_opt in temp_sorted_supplies:
-        display_text_val = f"{supply_opt['supply_name']} ({supply_opt.get('description', 'N/A')}) - Qty: {supply_opt['quantity_on_hand']} {supply_opt['unit_of_measure']} @ {format_currency_with_commas(supply_opt.get('cost_per_unit'))} each"
-        shipping_supply_options.append({
-            "id": supply_opt['id'],
-            "display": display_text_val,
-            "cost_per_unit": supply_opt['cost_per_unit'],
-            "quantity_on_hand": supply_opt['quantity_on_hand']
-        })
-    shipping_supply_options_json = json.dumps(shipping_supply_options)
-
-
-    return render_template('edit_sale.html',
-                           sale_event=sale_event_data,
-                           current_sale_items_json=current_sale_items_json,
-                           current_shipping_supplies_used_json=current_shipping_supplies_used_json,
-                           sale_inventory_options_json=sale_inventory_options_json, # For item search
-                           shipping_supply_options_json=shipping_supply_options_json, # For shipping supply search
-                           current_date=datetime.date.today().isoformat()
-                           )
-
-
-@app.route('/edit_sale_event/<int:sale_event_id>', methods=['POST'])
-def edit_sale_event_post_route(sale_event_id):
-    try:
-        data = request.get_json()
-        if not data:
-            return jsonify({"success": False, "message": "No data received."}), 400
-
-        sale_date_str = data.get('sale_date')
-        total_shipping_cost_str = data.get('total_shipping_cost', '0.0')
-        overall_notes = data.get('notes', '')
-        items_data = data.get('items')
-        shipping_supplies_data = data.get('shipping_supplies_used', [])
-
-        customer_shipping_charge_str = data.get('customer_shipping_charge', '0.0')
-        platform_fee_str = data.get('platform_fee', '0.0')
-
-        if not sale_date_str or not isinstance(items_data, list) or not items_data:
-            flash('Missing sale date or items data.', 'error')
-            return jsonify({"success": False, "message": "Missing sale date or items list is empty."}), 400
-
-        success, message = database.update_sale_event_details(
-            sale_event_id,
-            sale_date_str,
-            total_shipping_cost_str,
-            overall_notes,
-            customer_shipping_charge_str,
-            platform_fee_str,
-            items_data, # These are the *new* items
-            shipping_supplies_data # These are the *new* supplies
-        )
-
-        if success:
-            flash(f"Sale event (ID: {sale_event_id}) updated successfully. {message}", 'success')
-            return jsonify({"success": True, "message": f"Sale event (ID: {sale_event_id}) updated."})
-        else:
-            flash(f"Failed to update sale event. Reason: {message}", 'error')
-            return jsonify({"success": False, "message": f"Failed to update sale event. Reason: {message}"}), 400
-    except Exception as e:
-        print(f"Error in /edit_sale_event POST route: {e}")
-        flash(f"An error occurred: {str(e)}", 'error')
-        return jsonify({"success": False, "message": f"An internal error occurred: {str(e)}"}), 500
-
-
-
-
-import os
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 10000))
-    app.run(host='0.0.0.0', port=port)
\ No newline at end of file
+    app.run(host='0.0.0.0', port=port)
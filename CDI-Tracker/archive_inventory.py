@@ -0,0 +1,19 @@
+import os
+import sys
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+import database
+
+# Rows must have been sold out (and untouched) for this many days before they are archived.
+ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', 7))
+
+if __name__ == "__main__":
+    older_than_days = int(sys.argv[1]) if len(sys.argv) > 1 else ARCHIVE_AFTER_DAYS
+    print(f"Archiving inventory rows sold out for at least {older_than_days} day(s)...")
+    success, message, _ = database.archive_depleted_inventory(older_than_days=older_than_days)
+    print(message)
+    print("Script finished.")
+    sys.exit(0 if success else 1)
@@ -0,0 +1,98 @@
+import argparse
+import datetime
+import decimal
+import gzip
+import json
+import random
+import time
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+import json_provider
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Measures serialization CPU time and transfer size for an inventory-sized JSON payload:
+# stdlib json vs orjson, and identity vs gzip vs brotli. `--source db` uses the real
+# inventory (e.g. after seed_database.py); the default builds synthetic rows shaped like
+# /api/v1/inventory items so it runs without a database.
+
+
+def synthetic_rows(count, seed):
+    rng = random.Random(seed)
+    start = datetime.date(2020, 1, 1)
+    rows = []
+    for i in range(count):
+        buy_price = decimal.Decimal(rng.randint(5, 50000)) / 100
+        rows.append({
+            'type': 'single_card', 'internal_type': 'single_card', 'original_id': i + 1,
+            'display_name': f"Card {rng.randint(1, 30000)}", 'quantity': rng.randint(1, 12),
+            'location': f"Box {rng.randint(1, 40)}", 'buy_price': buy_price,
+            'sell_price': (buy_price * decimal.Decimal('1.3')).quantize(decimal.Decimal('0.01')),
+            'current_market_price': float(buy_price) * rng.uniform(0.5, 2.0),
+            'image_uri': f"https://cards.scryfall.io/normal/front/{rng.getrandbits(64):016x}.jpg",
+            'set_code': rng.choice(['mh3', 'otj', 'mkm', 'lci', 'woe', 'ltr']),
+            'collector_number': str(rng.randint(1, 400)), 'is_foil': rng.random() < 0.15,
+            'rarity': rng.choice(['common', 'uncommon', 'rare', 'mythic']), 'language': 'en',
+            'condition': 'Near Mint', 'purchase_date': start + datetime.timedelta(days=rng.randint(0, 1800)),
+        })
+    return rows
+
+def database_rows(count):
+    import database
+    rows, _ = database.get_inventory_page({}, 'display_name', 'asc', 1, count)
+    return rows
+
+
+def _best_of(repeat, func):
+    best, result = None, None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None or elapsed < best else best
+    return best, result
+
+def run(rows, repeat):
+    print(f"Payload: {len(rows)} rows, best of {repeat} runs\n")
+
+    stdlib_time, stdlib_body = _best_of(repeat, lambda: json.dumps(
+        {'items': rows}, default=json_provider._default, separators=(',', ':')).encode('utf-8'))
+    print(f"{'serializer':<22}{'time':>12}{'bytes':>14}")
+    print(f"{'json (stdlib)':<22}{stdlib_time * 1000:>10.1f}ms{len(stdlib_body):>14,}")
+    body = stdlib_body
+    if json_provider.orjson is not None:
+        orjson_time, body = _best_of(repeat, lambda: json_provider.orjson.dumps(
+            {'items': rows}, default=json_provider._default))
+        print(f"{'orjson':<22}{orjson_time * 1000:>10.1f}ms{len(body):>14,}"
+              f"   ({stdlib_time / orjson_time:.1f}x faster)")
+    else:
+        print("orjson                 not installed")
+
+    print(f"\n{'encoding':<22}{'time':>12}{'bytes':>14}{'ratio':>9}")
+    print(f"{'identity':<22}{'-':>12}{len(body):>14,}{'100%':>9}")
+    encoders = [(f"gzip -{level}", lambda level=level: gzip.compress(body, compresslevel=level)) for level in (1, 6, 9)]
+    if brotli is not None:
+        encoders += [(f"brotli q{quality}", lambda quality=quality: brotli.compress(body, quality=quality)) for quality in (4, 5, 11)]
+    for label, encode in encoders:
+        elapsed, compressed = _best_of(repeat, encode)
+        print(f"{label:<22}{elapsed * 1000:>10.1f}ms{len(compressed):>14,}{len(compressed) / len(body):>9.1%}")
+    if brotli is None:
+        print("brotli                 not installed")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark JSON serialization and compression of inventory payloads.")
+    parser.add_argument('--source', choices=['synthetic', 'db'], default='synthetic', help="Where rows come from (default: synthetic)")
+    parser.add_argument('--rows', type=int, default=50000, help="Number of rows (default: 50000)")
+    parser.add_argument('--repeat', type=int, default=5, help="Runs per measurement; the fastest is reported (default: 5)")
+    parser.add_argument('--seed', type=int, default=42, help="Random seed for synthetic rows (default: 42)")
+    args = parser.parse_args()
+
+    rows = database_rows(args.rows) if args.source == 'db' else synthetic_rows(args.rows, args.seed)
+    run(rows, args.repeat)
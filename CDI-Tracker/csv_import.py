@@ -0,0 +1,287 @@
+import csv
+import hashlib
+import io
+import json
+import os
+from collections import OrderedDict
+
+import database
+import scryfall
+
+# --- CSV collection import ---
+# Streams a TCGplayer-style (or simple Name/Quantity) CSV from disk: rows are decoded and parsed
+# incrementally, identical rows are stacked within a chunk of IMPORT_CHUNK_ROWS rows, and each
+# chunk is resolved against Scryfall and written with database.add_cards_batch() before the next
+# one is read. Memory stays flat however large the file is; a card that appears in several chunks
+# still ends up in one stack because add_card merges identical cards. Runs inside an import job
+# (see import_jobs.py); progress goes through the `report` callback, so nothing here depends on Flask.
+# Every chunk is checkpointed in import_batches in the same transaction as its cards (see
+# database.add_cards_batch), keyed by the file's SHA-256 and the import options. Uploading the same
+# file with the same options after a crash or a run with failures skips the committed chunks and
+# retries only the failed stacks, so nothing is added twice.
+
+IMPORT_CHUNK_ROWS = int(os.environ.get('IMPORT_CHUNK_ROWS', 2000))
+LOOKUP_CACHE_SIZE = 5000  # Scryfall answers remembered across chunks of one import.
+
+# Internal name -> accepted CSV headers, first match wins. Headers are compared after
+# lower-casing and replacing spaces with underscores ("Total Quantity" -> "total_quantity").
+FLEXIBLE_HEADERS = {
+    'card_name': ['product name', 'name'],
+    'quantity': ['total quantity', 'quantity'],  # TCGplayer uses "Total Quantity"
+    'set_identifier': ['set code', 'set name', 'set'],  # Order: prefer code, then name, then generic 'set'
+    'collector_number': ['number', 'card number', 'collector number'],  # TCGplayer uses "Number"
+    'rarity': ['rarity'],
+    'language': ['language'],
+    'condition': ['condition'],
+    'printing': ['printing'],  # For old files that might have this explicit column
+}
+
+# A stack is keyed by (name, set, collector number, is_foil, condition, rarity, language), all
+# lower-cased; location and prices come from the form and are the same for every row. The value
+# is a short list [quantity, name, set_identifier, collector_number, condition] keeping the
+# first row's original spelling for the Scryfall lookup.
+STACK_QUANTITY, STACK_NAME, STACK_SET, STACK_COLLECTOR_NUMBER, STACK_CONDITION = range(5)
+KEY_IS_FOIL, KEY_RARITY, KEY_LANGUAGE = 3, 5, 6
+
+
+class CsvImportError(Exception):
+    """The file can't be imported at all (empty, or required columns missing)."""
+
+
+def _normalize_header(header):
+    return header.lower().replace(' ', '_')
+
+def map_headers(fieldnames):
+    """Returns {internal_name: column index} for the columns present in the header row."""
+    normalized_incoming_headers = [_normalize_header(hdr or '') for hdr in fieldnames]
+    column_indexes = {}
+    for internal_name, possible_headers in FLEXIBLE_HEADERS.items():
+        for possible_hdr in possible_headers:
+            if _normalize_header(possible_hdr) in normalized_incoming_headers:
+                column_indexes[internal_name] = normalized_incoming_headers.index(_normalize_header(possible_hdr))
+                break
+    if 'card_name' not in column_indexes or 'quantity' not in column_indexes:
+        raise CsvImportError(f"CSV missing one or more required columns ('Name'/'Product Name' and 'Quantity'/'Total Quantity'). Found headers: {', '.join(h for h in normalized_incoming_headers if h)}")
+    return column_indexes
+
+
+def iter_chunks(text_stream, options, chunk_rows=IMPORT_CHUNK_ROWS):
+    """
+    Parses rows from `text_stream` and yields one aggregated chunk per `chunk_rows` rows.
+
+    :param text_stream: Text file object positioned at the header row.
+    :param options: Import form defaults (see import_jobs.submit_import).
+    :return: Generator of (stacks, errors, skipped_count, rows_read) tuples; `rows_read` is cumulative.
+    """
+    csv_reader = csv.reader(text_stream)
+    header = next(csv_reader, None)
+    if not header:
+        raise CsvImportError('CSV file appears to be empty or has no headers.')
+    columns = map_headers(header)
+
+    def cell(row, internal_name):
+        index = columns.get(internal_name)
+        if index is None or index >= len(row):
+            return None
+        return row[index].strip() or None
+
+    stacks, errors, skipped_count, rows_read = {}, [], 0, 0
+    for row in csv_reader:
+        rows_read += 1
+        if not row:
+            rows_read -= 1  # Blank line, not a data row.
+            continue
+        card_name = cell(row, 'card_name')
+        quantity_str = cell(row, 'quantity')
+        if not (card_name and quantity_str):
+            errors.append(f"Row {rows_read}: Missing 'Name' or 'Quantity'. Skipping.")
+            skipped_count += 1
+        else:
+            try:
+                quantity = int(quantity_str)
+            except ValueError:
+                quantity = None
+                errors.append(f"Row {rows_read}: Invalid quantity '{quantity_str}' for '{card_name}'. Skipping.")
+                skipped_count += 1
+            if quantity is not None and quantity <= 0:
+                errors.append(f"Row {rows_read}: Quantity for '{card_name}' must be positive. Skipping.")
+                skipped_count += 1
+            elif quantity is not None:
+                set_identifier = cell(row, 'set_identifier')
+                collector_number = cell(row, 'collector_number')
+                rarity = cell(row, 'rarity')
+                language = cell(row, 'language')
+                condition = cell(row, 'condition') or options['default_condition']
+                printing = cell(row, 'printing')
+                # 'Printing' column from older CSVs; 'Assume Non-Foil' on the form overrides it.
+                is_foil = bool(printing and 'foil' in printing.lower()) and not options['assume_non_foil']
+                key = (card_name.lower(), (set_identifier or '').lower(), (collector_number or '').lower(), is_foil,
+                       condition.lower(), rarity.lower() if rarity else 'unknown',
+                       language.lower() if language else options['default_language'])
+                stack = stacks.get(key)
+                if stack is None:
+                    stacks[key] = [quantity, card_name, set_identifier, collector_number, condition]
+                else:
+                    stack[STACK_QUANTITY] += quantity
+
+        if rows_read % chunk_rows == 0:
+            yield stacks, errors, skipped_count, rows_read
+            stacks, errors, skipped_count = {}, [], 0
+    if stacks or errors or skipped_count:
+        yield stacks, errors, skipped_count, rows_read
+
+
+def lookup_card_details(name, set_id, collector_number, language):
+    """Scryfall lookup for one stack, from most to least specific. Returns card details or None."""
+    card_details = None
+    # Priority 1: Set Identifier + Collector Number + Card Name (most specific)
+    if set_id and collector_number:
+        card_details = scryfall.get_card_details(card_name=name, set_code=set_id, collector_number=collector_number, lang=language)
+    # Priority 2: Set Identifier + Card Name (no collector number)
+    if not card_details and set_id and name:
+        card_details = scryfall.get_card_details(card_name=name, set_code=set_id, lang=language)
+    # Priority 3: Card Name + Collector Number (no specific set identifier)
+    if not card_details and name and collector_number:
+        card_details = scryfall.get_card_details(card_name=name, collector_number=collector_number, lang=language)
+    # Priority 4: Card Name only (least precise)
+    if not card_details and name:
+        card_details = scryfall.get_card_details(card_name=name, lang=language)
+    return card_details
+
+class LookupCache:
+    """Bounded LRU of Scryfall lookups, so a card repeated across chunks is fetched once per import."""
+
+    def __init__(self, size=LOOKUP_CACHE_SIZE):
+        self.size = size
+        self.entries = OrderedDict()
+
+    def lookup(self, name, set_id, collector_number, language):
+        key = (name.lower(), (set_id or '').lower(), (collector_number or '').lower(), language)
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        card_details = lookup_card_details(name, set_id, collector_number, language)
+        self.entries[key] = card_details
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+        return card_details
+
+
+def _card_for_stack(key, stack, card_details, options):
+    """add_card keyword arguments for a resolved stack."""
+    # Scryfall's only-foil-price hint overrides a non-foil assumption.
+    is_foil_final = key[KEY_IS_FOIL]
+    if not is_foil_final and card_details.get('foil_market_price_usd') is not None and card_details.get('market_price_usd') is None:
+        is_foil_final = True
+    return {
+        'set_code': card_details['set_code'].upper(),  # Always store set code as uppercase
+        'collector_number': card_details['collector_number'],
+        'name': card_details['name'],
+        'quantity': stack[STACK_QUANTITY],
+        'buy_price': options['default_buy_price'],
+        'is_foil': is_foil_final,
+        'market_price_usd': card_details.get('market_price_usd'),
+        'foil_market_price_usd': card_details.get('foil_market_price_usd'),
+        'image_uri': card_details.get('image_uri'),
+        'sell_price': options['default_asking_price'],
+        'location': options['default_location'],
+        'scryfall_id': card_details.get('id'),
+        'rarity': card_details.get('rarity', key[KEY_RARITY]).lower(),
+        'language': card_details.get('language', key[KEY_LANGUAGE]).lower(),
+        'condition': stack[STACK_CONDITION],
+    }
+
+def import_chunk(stacks, options, lookup_cache, checkpoint):
+    """
+    Resolves a chunk's stacks on Scryfall and writes them, with the chunk's checkpoint, in one transaction.
+
+    :param checkpoint: Dict with import_key, chunk_index, content_hash, import_id and rows_through.
+    :return: (imported_count, error_messages).
+    """
+    cards, card_stacks, labels, errors, failed_stacks = [], [], [], [], []
+    for key, stack in stacks.items():
+        card_details = lookup_cache.lookup(stack[STACK_NAME], stack[STACK_SET], stack[STACK_COLLECTOR_NUMBER], key[KEY_LANGUAGE])
+        if not (card_details and all(k in card_details for k in ['name', 'collector_number', 'set_code'])):
+            errors.append(f"Scryfall lookup failed for '{stack[STACK_NAME]}' (Set: {stack[STACK_SET] or 'N/A'}, CN: {stack[STACK_COLLECTOR_NUMBER] or 'N/A'}).")
+            failed_stacks.append(list(key))
+            continue
+        cards.append(_card_for_stack(key, stack, card_details, options))
+        card_stacks.append(list(key))
+        labels.append(f"'{stack[STACK_NAME]}' (Set: {stack[STACK_SET]})")
+
+    card_ids = database.add_cards_batch(cards, dict(checkpoint, failed_stacks=failed_stacks, card_stacks=card_stacks))
+    errors += [f"DB error for {label}." for label, card_id in zip(labels, card_ids) if not card_id]
+    return sum(1 for card_id in card_ids if card_id), errors
+
+
+def file_sha256(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as binary_file:
+        for block in iter(lambda: binary_file.read(1024 * 1024), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+def import_key_for(content_hash, options, chunk_rows=IMPORT_CHUNK_ROWS):
+    """Checkpoint key: the same file imported with the same options and chunk size resumes the same run."""
+    key_options = {name: value for name, value in options.items() if name != 'restart_import'}
+    key_source = json.dumps([content_hash, key_options, chunk_rows], sort_keys=True)
+    return hashlib.sha256(key_source.encode('utf-8')).hexdigest()
+
+
+def open_csv(path):
+    """Returns (binary_file, text_stream) for an uploaded CSV; BOMs are stripped and bad bytes replaced."""
+    binary_file = open(path, 'rb')
+    return binary_file, io.TextIOWrapper(binary_file, encoding='utf-8-sig', errors='replace', newline='')
+
+def run_import(path, options, report, import_id=None):
+    """
+    Runs a whole import from the CSV file at `path`, resuming an earlier run of the same file if there is one.
+
+    :param options: Import form defaults; a true `restart_import` discards the earlier run's checkpoints first.
+    :param report: Callable taking keyword progress fields (bytes_read, bytes_total, rows_read,
+                   stacks_done, imported, failed, skipped, resumed, content_hash) and an optional `new_errors` list.
+    :param import_id: Recorded on the checkpoints (the import job id).
+    :return: Dict with the final counts and a human-readable `summary`.
+    """
+    content_hash = file_sha256(path)
+    import_key = import_key_for(content_hash, options)
+    if options.get('restart_import'):
+        database.clear_import_checkpoints(import_key)
+    checkpoints = database.get_import_checkpoints(import_key)
+    if checkpoints is None:
+        raise CsvImportError('Could not read the checkpoints of earlier runs of this file; import not started so nothing is added twice. Please try again.')
+
+    counts = {'bytes_read': 0, 'bytes_total': os.path.getsize(path), 'rows_read': 0, 'stacks_done': 0,
+              'imported': 0, 'failed': 0, 'skipped': 0, 'resumed': 0, 'content_hash': content_hash}
+    lookup_cache = LookupCache()
+    binary_file, text_stream = open_csv(path)
+    with text_stream:
+        for chunk_index, (stacks, row_errors, skipped_count, rows_read) in enumerate(iter_chunks(text_stream, options)):
+            chunk_stacks_total = len(stacks)
+            if chunk_index in checkpoints:
+                # Committed by an earlier run: only its failed stacks are still to do.
+                retry = {tuple(key) for key in checkpoints[chunk_index]}
+                stacks = {key: stack for key, stack in stacks.items() if key in retry}
+                counts['resumed'] += chunk_stacks_total - len(stacks)
+            imported_count, stack_errors = 0, []
+            if stacks or chunk_index not in checkpoints:
+                checkpoint = {'import_key': import_key, 'chunk_index': chunk_index, 'content_hash': content_hash,
+                              'import_id': import_id, 'rows_through': rows_read}
+                imported_count, stack_errors = import_chunk(stacks, options, lookup_cache, checkpoint)
+            counts['bytes_read'] = binary_file.tell()
+            counts['rows_read'] = rows_read
+            counts['stacks_done'] += chunk_stacks_total
+            counts['imported'] += imported_count
+            counts['failed'] += len(stacks) - imported_count
+            counts['skipped'] += skipped_count
+            report(new_errors=row_errors + stack_errors, **counts)
+
+    if counts['failed'] == 0:
+        database.clear_import_checkpoints(import_key)
+    counts['bytes_read'] = counts['bytes_total']
+    summary = f"CSV Import Finished: {counts['imported']} card stacks processed from {counts['rows_read']} rows."
+    if counts['resumed'] > 0: summary += f" Resumed an earlier run of this file: {counts['resumed']} stacks were already imported and skipped."
+    if counts['failed'] > 0: summary += f" {counts['failed']} failed; upload the same file again to retry just those."
+    if counts['skipped'] > 0: summary += f" {counts['skipped']} rows skipped."
+    report(**counts)
+    return dict(counts, summary=summary)
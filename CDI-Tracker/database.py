@@ -2,9 +2,15 @@ import psycopg2
 import psycopg2.extras
 import datetime
 import os
+import threading
+import time
+import uuid
 from dotenv import load_dotenv
 load_dotenv()
 
+import db_metrics
+import metrics_cache
+
 # --- PostgreSQL Connection Details ---
 # It is recommended to use environment variables for security.
 DB_USER = os.environ.get('DB_USER', 'your_postgres_user')
@@ -13,16 +19,234 @@ DB_HOST = os.environ.get('DB_HOST', 'localhost')
 DB_PORT = os.environ.get('DB_PORT', '5432')
 DB_NAME = os.environ.get('DB_NAME', 'cdi_tracker')
 
+# --- Table Version Counters ---
+# Statement-level triggers bump a per-table counter in table_versions on every write, giving the
+# JSON endpoints a cheap ETag source (see get_table_versions / app.versioned_by).
+VERSIONED_TABLES = ['cards', 'sealed_products', 'shipping_supplies_inventory', 'shipping_supply_presets',
+                    'shipping_preset_items', 'sale_events', 'sale_items', 'sale_event_shipping_supplies',
+                    'financial_entries', 'price_history', 'valuation_snapshots', 'price_movers']
+
+# --- Inventory Cold Archive ---
+# Sold-out rows are moved from the hot inventory tables into these archive tables so the
+# hot tables (and their indexes) stay proportional to live stock. Ids are preserved.
+ARCHIVE_TABLES = {
+    'cards': 'cards_archive',
+    'sealed_products': 'sealed_products_archive',
+    'shipping_supplies_inventory': 'shipping_supplies_inventory_archive',
+}
+ARCHIVE_COLUMNS = {
+    'cards': ['id', 'set_code', 'collector_number', 'name', 'quantity', 'buy_price', 'is_foil',
+              'market_price_usd', 'foil_market_price_usd', 'image_uri', 'sell_price', 'location',
+              'rarity', 'language', 'condition', 'date_added', 'last_updated', 'scryfall_id'],
+    'sealed_products': ['id', 'product_name', 'set_name', 'product_type', 'language', 'is_collectors_item',
+                        'quantity', 'buy_price', 'manual_market_price', 'sell_price', 'image_uri', 'location',
+                        'date_added', 'last_updated'],
+    'shipping_supplies_inventory': ['id', 'supply_name', 'description', 'unit_of_measure', 'purchase_date',
+                                    'quantity_on_hand', 'cost_per_unit', 'location', 'date_added', 'last_updated'],
+}
+QUANTITY_COLUMNS = {
+    'cards': 'quantity',
+    'sealed_products': 'quantity',
+    'shipping_supplies_inventory': 'quantity_on_hand',
+}
+# Each hot table's UNIQUE key; a revived row that clashes on it is merged into the hot row.
+UNIQUE_KEY_COLUMNS = {
+    'cards': ['set_code', 'collector_number', 'is_foil', 'location', 'rarity', 'language', 'buy_price', 'condition'],
+    'sealed_products': ['product_name', 'set_name', 'product_type', 'language', 'location', 'is_collectors_item', 'buy_price'],
+    'shipping_supplies_inventory': ['supply_name', 'description', 'unit_of_measure', 'cost_per_unit', 'location'],
+}
+
+# --- Sales Partitioning ---
+# sale_events and sale_items are range-partitioned by sale year (sale_events_y2024, sale_items_y2024, ...)
+# so date-bounded queries (the dashboard's month and year, a report's date range, an export) only
+# read the partitions they cover, however many years of history are kept. sale_items carries its
+# event's sale_date for this, and both tables are keyed by (id, sale_date). A DEFAULT partition
+# catches dates without a year partition. init_db creates this layout for a new database;
+# partition_sales.py converts an existing one (see partition_sales_tables).
+SALES_PARTITIONED_TABLES = ('sale_events', 'sale_items')
+SALES_TABLE_COLUMNS = {
+    'sale_events': '''
+        id INTEGER NOT NULL DEFAULT nextval('sale_events_id_seq'),
+        sale_date DATE NOT NULL,
+        total_shipping_cost REAL DEFAULT 0.0, -- Your postage cost + supplies cost for the sale
+        notes TEXT,
+        total_profit_loss REAL,
+        date_recorded TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        customer_shipping_charge REAL DEFAULT 0.0, -- What customer paid for shipping
+        platform_fee REAL DEFAULT 0.0,           -- Platform fees for the sale
+        platform TEXT,                           -- Where it sold, e.g. eBay, TCGplayer
+        total_supplies_cost_for_sale REAL DEFAULT 0.0, -- Cost of shipping supplies used for this specific sale
+        PRIMARY KEY (id, sale_date)''',
+    'sale_items': '''
+        id INTEGER NOT NULL DEFAULT nextval('sale_items_id_seq'),
+        sale_event_id INTEGER NOT NULL,
+        sale_date DATE NOT NULL, -- The event's sale_date, so items are partitioned (and pruned) with their event
+        inventory_item_id INTEGER,
+        item_type TEXT NOT NULL,
+        original_item_name TEXT,
+        original_item_details TEXT,
+        quantity_sold INTEGER NOT NULL,
+        sell_price_per_item REAL NOT NULL,
+        buy_price_per_item REAL NOT NULL,
+        item_profit_loss REAL NOT NULL,
+        PRIMARY KEY (id, sale_date),
+        -- Deferred: editing a sale re-inserts its items under the new date before the event itself moves.
+        FOREIGN KEY (sale_event_id, sale_date) REFERENCES sale_events (id, sale_date) DEFERRABLE INITIALLY DEFERRED''',
+}
+SALES_COPY_COLUMNS = {
+    'sale_events': ['id', 'sale_date', 'total_shipping_cost', 'notes', 'total_profit_loss', 'date_recorded',
+                    'customer_shipping_charge', 'platform_fee', 'platform', 'total_supplies_cost_for_sale'],
+    'sale_items': ['id', 'sale_event_id', 'inventory_item_id', 'item_type', 'original_item_name', 'original_item_details',
+                   'quantity_sold', 'sell_price_per_item', 'buy_price_per_item', 'item_profit_loss'],
+}
+
+# --- Sale Item Search ---
+# Each inventory table carries a generated, lower-cased search_text column covering the fields the
+# sale form's item search matches on, with a pg_trgm GIN index over in-stock rows so
+# `search_text LIKE '%term%'` stays an index lookup at 100k+ rows.
+SEARCH_TEXT_EXPRESSIONS = {
+    'cards': """LOWER(name || ' ' || COALESCE(set_code, '') || ' ' || COALESCE(set_code, '') || '-' || COALESCE(collector_number, '')
+                || ' ' || COALESCE(rarity, '') || ' ' || COALESCE(language, '') || ' ' || COALESCE(condition, '')
+                || ' ' || COALESCE(location, '') || CASE WHEN is_foil = 1 THEN ' foil' ELSE '' END)""",
+    'sealed_products': """LOWER(product_name || ' ' || COALESCE(set_name, '') || ' ' || COALESCE(product_type, '')
+                          || ' ' || COALESCE(language, '') || ' ' || COALESCE(location, '')
+                          || CASE WHEN is_collectors_item = 1 THEN ' collector' ELSE '' END)""",
+    'shipping_supplies_inventory': """LOWER(supply_name || ' ' || COALESCE(description, '') || ' ' || COALESCE(unit_of_measure, '')
+                                      || ' ' || COALESCE(location, ''))""",
+}
+SEARCH_NAME_COLUMNS = {
+    'cards': 'name',
+    'sealed_products': 'product_name',
+    'shipping_supplies_inventory': 'supply_name',
+}
+SEARCH_ITEM_TYPES = {
+    'cards': 'single_card',
+    'sealed_products': 'sealed_product',
+    'shipping_supplies_inventory': 'shipping_supply',
+}
+
+# --- Per-process connection pool ---
+# Every function here opens a connection with get_db_connection() and ends with conn.close().
+# close() hands the connection back to a small per-process pool instead of disconnecting, so a
+# request reuses a warm connection instead of paying a TLS handshake per query. The pool belongs
+# to the process that created it: a forked gunicorn worker starts empty and never touches its
+# parent's sockets (see gunicorn.conf.py). DB_POOL_SIZE=0 turns pooling off.
+# A connection idle for more than DB_POOL_VALIDATE_AFTER_SECONDS is checked with SELECT 1 before it
+# is handed out, so a database restart or failover costs one discarded connection, not a failed
+# request. TCP keepalives let the OS notice a dead peer on connections that sit in a transaction.
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+DB_POOL_MAX_IDLE_SECONDS = int(os.environ.get('DB_POOL_MAX_IDLE_SECONDS', 300))  # Older idle connections may have been dropped server-side.
+DB_POOL_VALIDATE_AFTER_SECONDS = float(os.environ.get('DB_POOL_VALIDATE_AFTER_SECONDS', 5))
+DB_KEEPALIVE_OPTIONS = {'keepalives': 1, 'keepalives_idle': 30, 'keepalives_interval': 10, 'keepalives_count': 3}
+
+_pool_lock = threading.Lock()
+_pool = []  # (connection, returned_at), most recently returned last
+_pool_pid = os.getpid()
+_inherited_connections = []  # A parent's pooled connections, kept referenced so garbage collection doesn't close the parent's sockets.
+
+
+class InstrumentedConnection(psycopg2.extensions.connection):
+    """Connection whose cursors (whatever cursor_factory is requested) report timings to db_metrics."""
+
+    owner_pid = None
+    in_pool = False
+
+    def cursor(self, *args, **kwargs):
+        base_cursor_class = kwargs.get('cursor_factory') or self.cursor_factory or psycopg2.extensions.cursor
+        kwargs['cursor_factory'] = db_metrics.instrumented_cursor_class(base_cursor_class)
+        return super().cursor(*args, **kwargs)
+
+    def close(self):
+        if self.in_pool:
+            return  # Already handed back; a second close() must not pool it twice.
+        if not _return_to_pool(self):
+            super().close()
+
+    def disconnect(self):
+        self.in_pool = False
+        super().close()
+
+
+def _claim_pool_for_this_process():
+    """Called with _pool_lock held. Forgets (without closing) connections inherited across a fork."""
+    global _pool_pid
+    if _pool_pid != os.getpid():
+        _inherited_connections.extend(conn for conn, _ in _pool)
+        _pool.clear()
+        _pool_pid = os.getpid()
+
+def _connection_alive(conn):
+    """Round-trips SELECT 1 on a pooled connection; False if the server has gone away."""
+    try:
+        # The plain cursor keeps the check out of the request's db_metrics query counts.
+        with psycopg2.extensions.connection.cursor(conn) as cursor:
+            cursor.execute("SELECT 1")
+            cursor.fetchone()
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+def _take_from_pool():
+    while True:
+        with _pool_lock:
+            _claim_pool_for_this_process()
+            if not _pool:
+                return None
+            conn, returned_at = _pool.pop()
+            conn.in_pool = False
+        idle_seconds = time.monotonic() - returned_at
+        if (conn.closed or idle_seconds > DB_POOL_MAX_IDLE_SECONDS
+                or (idle_seconds > DB_POOL_VALIDATE_AFTER_SECONDS and not _connection_alive(conn))):
+            conn.disconnect()
+            continue
+        return conn
+
+def _return_to_pool(conn):
+    """Puts `conn` back in the pool with no open transaction. Returns False if it should be closed instead."""
+    if DB_POOL_SIZE <= 0 or conn.closed or conn.owner_pid != os.getpid():
+        return False
+    try:
+        if conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            conn.rollback()  # Read-only functions close without committing.
+        if conn.autocommit:
+            conn.autocommit = False
+    except psycopg2.Error:
+        return False
+    with _pool_lock:
+        _claim_pool_for_this_process()
+        if len(_pool) >= DB_POOL_SIZE:
+            return False
+        conn.in_pool = True
+        _pool.append((conn, time.monotonic()))
+    return True
+
+def close_pool():
+    """Disconnects every pooled connection. gunicorn calls this in the master before forking workers."""
+    with _pool_lock:
+        _claim_pool_for_this_process()
+        pooled = [conn for conn, _ in _pool]
+        _pool.clear()
+    for conn in pooled:
+        conn.disconnect()
+
 def get_db_connection():
-    """Establishes a connection to the PostgreSQL database."""
-    conn = psycopg2.connect(
-        dbname=DB_NAME,
-        user=DB_USER,
-        password=DB_PASSWORD,
-        host=DB_HOST,
-        port=DB_PORT,
-        sslmode='require'
-    )
+    """Returns a pooled connection to the PostgreSQL database, connecting if none is idle. Call close() to give it back."""
+    started = time.perf_counter()
+    conn = _take_from_pool()
+    if conn is None:
+        conn = psycopg2.connect(
+            dbname=DB_NAME,
+            user=DB_USER,
+            password=DB_PASSWORD,
+            host=DB_HOST,
+            port=DB_PORT,
+            sslmode='require',
+            connection_factory=InstrumentedConnection,
+            **DB_KEEPALIVE_OPTIONS
+        )
+        conn.owner_pid = os.getpid()
+    db_metrics.record_connection(time.perf_counter() - started)
     return conn
 
 def init_db():
@@ -110,41 +334,9 @@ def init_db():
     ''')
     print("Sealed_products table creation attempted.")
 
-    print("Attempting to create sale_events table...")
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS sale_events (
-        id SERIAL PRIMARY KEY,
-        sale_date DATE NOT NULL,
-        total_shipping_cost REAL DEFAULT 0.0, -- Your postage cost + supplies cost for the sale
-        notes TEXT,
-        total_profit_loss REAL,
-        date_recorded TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        customer_shipping_charge REAL DEFAULT 0.0, -- What customer paid for shipping
-        platform_fee REAL DEFAULT 0.0,           -- Platform fees for the sale
-        total_supplies_cost_for_sale REAL DEFAULT 0.0 -- NEW: Cost of shipping supplies used for this specific sale
-    )
-
-    ''')
-    print("Sale_events table creation attempted.")
-
-
-    print("Attempting to create sale_items table...")
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS sale_items (
-            id SERIAL PRIMARY KEY,
-            sale_event_id INTEGER NOT NULL,
-            inventory_item_id INTEGER,
-            item_type TEXT NOT NULL,
-            original_item_name TEXT,
-            original_item_details TEXT,
-            quantity_sold INTEGER NOT NULL,
-            sell_price_per_item REAL NOT NULL,
-            buy_price_per_item REAL NOT NULL,
-            item_profit_loss REAL NOT NULL,
-            FOREIGN KEY (sale_event_id) REFERENCES sale_events (id)
-        )
-    ''')
-    print("Sale_items table creation attempted.")
+    print("Attempting to create sale_events and sale_items tables...")
+    _create_sales_tables_with_cursor(cursor)
+    print("Sale_events and sale_items table creation attempted.")
 
     print("Attempting to create financial_entries table...")
     cursor.execute('''
@@ -190,9 +382,10 @@ def init_db():
             quantity_used INTEGER NOT NULL,
             cost_per_unit_snapshot REAL NOT NULL, -- Snapshot cost at time of sale
             supply_name_snapshot TEXT,
-            supply_description_snapshot TEXT,
-            FOREIGN KEY (sale_event_id) REFERENCES sale_events (id) ON DELETE CASCADE,
-            FOREIGN KEY (supply_id) REFERENCES shipping_supplies_inventory (id) ON DELETE RESTRICT
+            supply_description_snapshot TEXT
+            -- sale_event_id is unconstrained: sale_events is keyed by (id, sale_date), and the sale functions
+            -- delete an event's supply rows themselves. supply_id is unconstrained (like sale_items.inventory_item_id)
+            -- so depleted batches can be archived.
         );
     ''')
     print("sale_event_shipping_supplies table creation attempted.")
@@ -288,21 +481,234 @@ def init_db():
     _check_and_add_column(cursor, 'sale_events', 'total_supplies_cost_for_sale', 'REAL DEFAULT 0.0')
     _check_and_add_column(cursor, 'sale_events', 'customer_shipping_charge', 'REAL DEFAULT 0.0')
     _check_and_add_column(cursor, 'sale_events', 'platform_fee', 'REAL DEFAULT 0.0')
+    _check_and_add_column(cursor, 'sale_events', 'platform', 'TEXT')
+    _check_and_add_column(cursor, 'sale_items', 'sale_date', 'DATE')
     print("All column checks attempted.")
 
+    # Databases not yet converted by partition_sales.py: fill sale_items.sale_date from the event.
+    cursor.execute('''UPDATE sale_items si SET sale_date = se.sale_date FROM sale_events se
+                      WHERE si.sale_event_id = se.id AND si.sale_date IS NULL''')
+    today = datetime.date.today()
+    _ensure_sale_partitions_with_cursor(cursor, [today.year, today.year + 1])
+
     # NEW: Check and add columns for shipping_supplies_inventory if needed (e.g., if schema evolves)
     _check_and_add_column(cursor, 'shipping_supplies_inventory', 'description', 'TEXT')
     _check_and_add_column(cursor, 'shipping_supplies_inventory', 'unit_of_measure', 'TEXT DEFAULT \'unit\'')
     _check_and_add_column(cursor, 'shipping_supplies_inventory', 'location', 'TEXT')
 
+    # Archived supply batches leave shipping_supplies_inventory, so drop the old RESTRICT reference.
+    cursor.execute("ALTER TABLE sale_event_shipping_supplies DROP CONSTRAINT IF EXISTS sale_event_shipping_supplies_supply_id_fkey;")
+
+    print("Attempting to create inventory archive tables...")
+    for table_name, archive_table in ARCHIVE_TABLES.items():
+        # LIKE copies the current columns and NOT NULLs but no unique constraints or serial defaults;
+        # archived rows keep the id they had in the hot table.
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {archive_table} (LIKE {table_name})")
+        _check_and_add_column(cursor, archive_table, 'archived_at', 'TIMESTAMP DEFAULT CURRENT_TIMESTAMP')
+        # Set when a revived row's stock was merged into a hot row that took its unique key.
+        _check_and_add_column(cursor, archive_table, 'merged_into', 'INTEGER')
+        cursor.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {archive_table}_id_idx ON {archive_table} (id)")
+    cursor.execute('''CREATE INDEX IF NOT EXISTS cards_archive_unique_key_idx ON cards_archive
+                      (set_code, collector_number, is_foil, location, rarity, language, buy_price, condition)''')
+    cursor.execute('''CREATE INDEX IF NOT EXISTS sealed_products_archive_unique_key_idx ON sealed_products_archive
+                      (product_name, set_name, product_type, language, location, is_collectors_item, buy_price)''')
+    cursor.execute('''CREATE INDEX IF NOT EXISTS shipping_supplies_inventory_archive_unique_key_idx ON shipping_supplies_inventory_archive
+                      (supply_name, description, unit_of_measure, cost_per_unit, location)''')
+    print("Inventory archive tables creation attempted.")
+
+    # Added after the archive tables so LIKE doesn't copy search_text into them.
+    for table_name, expression in SEARCH_TEXT_EXPRESSIONS.items():
+        _check_and_add_column(cursor, table_name, 'search_text', f"TEXT GENERATED ALWAYS AS ({expression}) STORED")
+
+    print("Attempting to create table_versions table and triggers...")
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS table_versions (
+            table_name TEXT PRIMARY KEY,
+            version BIGINT NOT NULL DEFAULT 0,
+            last_changed TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    # One row update per write statement (not per row); concurrent writers to the same table
+    # serialize on that row until commit, which is fine at this app's write volume.
+    cursor.execute('''
+        CREATE OR REPLACE FUNCTION bump_table_version() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO table_versions (table_name, version, last_changed) VALUES (TG_TABLE_NAME, 1, CURRENT_TIMESTAMP)
+            ON CONFLICT (table_name) DO UPDATE SET version = table_versions.version + 1, last_changed = CURRENT_TIMESTAMP;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    ''')
+    for table_name in VERSIONED_TABLES:
+        cursor.execute(f"DROP TRIGGER IF EXISTS {table_name}_version_bump ON {table_name}")
+        cursor.execute(f'''CREATE TRIGGER {table_name}_version_bump
+                           AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {table_name}
+                           FOR EACH STATEMENT EXECUTE PROCEDURE bump_table_version()''')
+    print("table_versions table and triggers creation attempted.")
+
+    print("Attempting to add row_version columns and triggers...")
+    # row_version is the id of the transaction that last wrote the row, assigned by the database, so
+    # inventory_index.py can re-read exactly the rows committed since its last read (see
+    # get_inventory_index_changes) whatever clock filled in last_updated.
+    cursor.execute('''
+        CREATE OR REPLACE FUNCTION set_row_version() RETURNS trigger AS $$
+        BEGIN
+            NEW.row_version := txid_current();
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql
+    ''')
+    for table_name in ARCHIVE_TABLES:
+        _check_and_add_column(cursor, table_name, 'row_version', 'BIGINT')
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {table_name}_row_version_idx ON {table_name} (row_version)")
+        cursor.execute(f"DROP TRIGGER IF EXISTS {table_name}_row_version ON {table_name}")
+        cursor.execute(f'''CREATE TRIGGER {table_name}_row_version
+                           BEFORE INSERT OR UPDATE ON {table_name}
+                           FOR EACH ROW EXECUTE PROCEDURE set_row_version()''')
+    print("row_version columns and triggers creation attempted.")
+
+    print("Attempting to create import_batches table...")
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS import_batches (
+            import_key TEXT NOT NULL,
+            chunk_index INTEGER NOT NULL,
+            content_hash TEXT NOT NULL,
+            import_id TEXT,
+            rows_through INTEGER NOT NULL,
+            failed_stacks JSONB NOT NULL DEFAULT '[]',
+            completed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (import_key, chunk_index)
+        )
+    ''')
+    print("import_batches table creation attempted.")
+
+    print("Attempting to create import_jobs table...")
+    # State of background CSV imports when there is no Redis (see import_jobs.py), shared by every worker.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS import_jobs (
+            id TEXT PRIMARY KEY,
+            state JSONB NOT NULL,
+            updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS import_jobs_updated_idx ON import_jobs (updated_at)")
+    print("import_jobs table creation attempted.")
+
+    print("Attempting to create price_history table...")
+    # One row per printing per day on which its price changed. The primary key doubles as the index
+    # for a printing's date range; price_history_date_idx serves "every printing on/around a date".
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS price_history (
+            set_code TEXT NOT NULL,
+            collector_number TEXT NOT NULL,
+            language TEXT NOT NULL,
+            price_date DATE NOT NULL,
+            market_price_usd REAL,
+            foil_market_price_usd REAL,
+            PRIMARY KEY (set_code, collector_number, language, price_date)
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS price_history_date_idx ON price_history (price_date)")
+    print("price_history table creation attempted.")
+
+    print("Attempting to create price_movers table...")
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS price_movers (
+            detected_on DATE NOT NULL,
+            set_code TEXT NOT NULL,
+            collector_number TEXT NOT NULL,
+            language TEXT NOT NULL,
+            is_foil INTEGER NOT NULL,
+            name TEXT,
+            previous_price_date DATE NOT NULL,
+            previous_price REAL NOT NULL,
+            current_price REAL NOT NULL,
+            price_change REAL NOT NULL,
+            percent_change REAL,
+            quantity_on_hand INTEGER NOT NULL,
+            value_change REAL NOT NULL,
+            PRIMARY KEY (detected_on, set_code, collector_number, language, is_foil)
+        )
+    ''')
+    # Reports are read as "the biggest moves of day X by impact on our stock".
+    cursor.execute('''CREATE INDEX IF NOT EXISTS price_movers_impact_idx
+                      ON price_movers (detected_on, (ABS(value_change)) DESC)''')
+    print("price_movers table creation attempted.")
+
+    print("Attempting to create valuation_snapshots table...")
+    # One row per day per breakdown value (dimension 'total' has a single '' value).
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS valuation_snapshots (
+            snapshot_date DATE NOT NULL,
+            dimension TEXT NOT NULL,
+            dimension_value TEXT NOT NULL,
+            item_count INTEGER NOT NULL,
+            total_quantity INTEGER NOT NULL,
+            total_buy_cost DOUBLE PRECISION NOT NULL,
+            total_market_value DOUBLE PRECISION NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (snapshot_date, dimension, dimension_value)
+        )
+    ''')
+    cursor.execute('''CREATE INDEX IF NOT EXISTS valuation_snapshots_series_idx
+                      ON valuation_snapshots (dimension, dimension_value, snapshot_date)''')
+    print("valuation_snapshots table creation attempted.")
+
+    print("Attempting to create sale_idempotency_keys table...")
+    # A separate table because a unique index on the partitioned sale_events would have to include sale_date.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sale_idempotency_keys (
+            idempotency_key TEXT PRIMARY KEY,
+            sale_event_id INTEGER,
+            request_hash TEXT,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    _check_and_add_column(cursor, 'sale_idempotency_keys', 'request_hash', 'TEXT')
+    cursor.execute("CREATE INDEX IF NOT EXISTS sale_idempotency_keys_created_idx ON sale_idempotency_keys (created_at)")
+    print("sale_idempotency_keys table creation attempted.")
+
 
     print("Attempting to commit final changes...")
     conn.commit()
     print("Changes committed.")
+
+    # Separate transaction: CREATE EXTENSION can need privileges the app user lacks. Without
+    # these indexes search_sale_items still works, it just scans the inventory tables.
+    try:
+        print("Attempting to create trigram search indexes...")
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        for table_name in SEARCH_TEXT_EXPRESSIONS:
+            cursor.execute(f'''CREATE INDEX IF NOT EXISTS {table_name}_search_text_trgm_idx ON {table_name}
+                              USING gin (search_text gin_trgm_ops) WHERE {QUANTITY_COLUMNS[table_name]} > 0''')
+        conn.commit()
+        print("Trigram search indexes created.")
+    except psycopg2.Error as e:
+        print(f"Could not create trigram search indexes (sale item search will use sequential scans): {e}")
+        conn.rollback()
     cursor.close()
     conn.close()
     print("Database initialization script finished.")
 
+def get_table_versions(table_names):
+    """
+    Returns the change counters for the given tables as a tuple (0 for tables never written).
+    Returns None if table_versions doesn't exist yet (init_db not re-run) or on a database error.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    versions = None
+    try:
+        cursor.execute("SELECT table_name, version FROM table_versions WHERE table_name = ANY(%s)", (list(table_names),))
+        found = dict(cursor.fetchall())
+        versions = tuple(found.get(table_name, 0) for table_name in table_names)
+    except psycopg2.Error as e:
+        print(f"DB error in get_table_versions: {e}")
+    finally:
+        cursor.close()
+        conn.close()
+    return versions
+
 def _check_and_add_column(cursor, table_name, column_name, column_type):
     """Checks if a column exists and adds it if not (PostgreSQL version)."""
     try:
@@ -319,6 +725,204 @@ def _check_and_add_column(cursor, table_name, column_name, column_type):
             cursor.connection.rollback()
 
 
+def _sales_tables_partitioned_with_cursor(cursor):
+    cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('sale_events')")
+    row = cursor.fetchone()
+    return row is not None and row[0] == 'p'
+
+def _create_sales_tables_with_cursor(cursor):
+    """Creates sale_events and sale_items partitioned by sale year (tables that exist are left as they are), plus their indexes."""
+    for table_name in SALES_PARTITIONED_TABLES:
+        cursor.execute(f"CREATE SEQUENCE IF NOT EXISTS {table_name}_id_seq")
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {table_name} ({SALES_TABLE_COLUMNS[table_name]}) PARTITION BY RANGE (sale_date)")
+        cursor.execute(f"ALTER SEQUENCE {table_name}_id_seq OWNED BY {table_name}.id")
+    if _sales_tables_partitioned_with_cursor(cursor):
+        for table_name in SALES_PARTITIONED_TABLES:
+            cursor.execute(f"CREATE TABLE IF NOT EXISTS {table_name}_default PARTITION OF {table_name} DEFAULT")
+    # Newest-first paging walks the newest partition's index first and stops at the page size.
+    cursor.execute("CREATE INDEX IF NOT EXISTS sale_events_date_idx ON sale_events (sale_date, id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS sale_items_event_idx ON sale_items (sale_event_id)")
+
+def _ensure_sale_partitions_with_cursor(cursor, years):
+    """
+    Creates the yearly sale_events / sale_items partitions missing for `years`; a no-op until the tables are
+    partitioned. A year whose sales already went to the DEFAULT partition stays there (still correct, just not pruned).
+    """
+    if not _sales_tables_partitioned_with_cursor(cursor):
+        return
+    for year in sorted(set(years)):
+        for table_name in SALES_PARTITIONED_TABLES:
+            partition_name = f"{table_name}_y{int(year)}"
+            cursor.execute("SELECT to_regclass(%s)", (partition_name,))
+            if cursor.fetchone()[0] is not None:
+                continue
+            cursor.execute("SAVEPOINT sale_partition")
+            try:
+                cursor.execute(f"CREATE TABLE {partition_name} PARTITION OF {table_name} "
+                               f"FOR VALUES FROM ('{int(year)}-01-01') TO ('{int(year) + 1}-01-01')")
+                cursor.execute("RELEASE SAVEPOINT sale_partition")
+            except psycopg2.Error as e:
+                print(f"Could not create partition {partition_name}: {e}")
+                cursor.execute("ROLLBACK TO SAVEPOINT sale_partition")
+
+def partition_sales_tables():
+    """
+    Converts unpartitioned sale_events / sale_items to the yearly partitioned layout in one transaction,
+    copying every row (ids kept, sale_items.sale_date taken from its event). Does nothing if already converted.
+    Returns a tuple: (success_boolean, message_string)
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        if _sales_tables_partitioned_with_cursor(cursor):
+            return True, "Sales tables are already partitioned."
+        cursor.execute("LOCK TABLE sale_events, sale_items IN ACCESS EXCLUSIVE MODE")
+        cursor.execute("ALTER TABLE sale_event_shipping_supplies DROP CONSTRAINT IF EXISTS sale_event_shipping_supplies_sale_event_id_fkey")
+        for table_name in SALES_PARTITIONED_TABLES:
+            cursor.execute(f"ALTER TABLE {table_name} RENAME TO {table_name}_unpartitioned")
+            cursor.execute(f"ALTER INDEX IF EXISTS {table_name}_pkey RENAME TO {table_name}_unpartitioned_pkey")
+            # Keeps the id sequence (and so new ids) when the old table is dropped.
+            cursor.execute(f"ALTER SEQUENCE {table_name}_id_seq OWNED BY NONE")
+        cursor.execute("DROP INDEX IF EXISTS sale_events_date_idx, sale_items_event_idx")
+        _create_sales_tables_with_cursor(cursor)
+
+        cursor.execute("SELECT DISTINCT EXTRACT(YEAR FROM sale_date)::int FROM sale_events_unpartitioned")
+        today = datetime.date.today()
+        years = {row[0] for row in cursor.fetchall()} | {today.year, today.year + 1}
+        _ensure_sale_partitions_with_cursor(cursor, years)
+
+        event_columns = ", ".join(SALES_COPY_COLUMNS['sale_events'])
+        cursor.execute(f"INSERT INTO sale_events ({event_columns}) SELECT {event_columns} FROM sale_events_unpartitioned")
+        events_copied = cursor.rowcount
+        item_columns = ", ".join(SALES_COPY_COLUMNS['sale_items'])
+        cursor.execute(f"""INSERT INTO sale_items ({item_columns}, sale_date)
+                           SELECT {', '.join(f'si.{column}' for column in SALES_COPY_COLUMNS['sale_items'])}, se.sale_date
+                           FROM sale_items_unpartitioned si JOIN sale_events_unpartitioned se ON se.id = si.sale_event_id""")
+        items_copied = cursor.rowcount
+        cursor.execute("DROP TABLE sale_items_unpartitioned, sale_events_unpartitioned")
+        for table_name in SALES_PARTITIONED_TABLES:
+            cursor.execute(f'''CREATE TRIGGER {table_name}_version_bump
+                               AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {table_name}
+                               FOR EACH STATEMENT EXECUTE PROCEDURE bump_table_version()''')
+        conn.commit()
+        metrics_cache.invalidate('sales')
+        return True, f"Partitioned sales by year: {events_copied} sale event(s) and {items_copied} sale item(s) in {len(years)} yearly partition(s)."
+    except psycopg2.Error as e:
+        print(f"DB error in partition_sales_tables: {e}")
+        conn.rollback()
+        return False, f"Database error: {e}"
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def archive_depleted_inventory(older_than_days=7):
+    """
+    Moves sold-out rows out of cards, sealed_products and shipping_supplies_inventory into
+    their archive tables, keeping each row's id so sale history references still resolve.
+    Only rows untouched for `older_than_days` are moved, so a quick restock doesn't bounce a
+    row back and forth. Supply batches still used by a shipping preset stay in the hot table.
+    Returns a tuple: (success_boolean, message_string, {table_name: rows_archived})
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    archived_counts = {}
+    try:
+        for table_name, archive_table in ARCHIVE_TABLES.items():
+            columns = ", ".join(ARCHIVE_COLUMNS[table_name])
+            preset_guard = ""
+            if table_name == 'shipping_supplies_inventory':
+                # Deleting a supply cascades into shipping_preset_items, so keep preset members hot.
+                preset_guard = " AND NOT EXISTS (SELECT 1 FROM shipping_preset_items spi WHERE spi.supply_id = shipping_supplies_inventory.id)"
+            cursor.execute(f"""
+                WITH moved AS (
+                    DELETE FROM {table_name}
+                    WHERE {QUANTITY_COLUMNS[table_name]} <= 0
+                      AND COALESCE(last_updated, date_added) < CURRENT_TIMESTAMP - (%s * INTERVAL '1 day'){preset_guard}
+                    RETURNING {columns}
+                )
+                INSERT INTO {archive_table} ({columns}, archived_at)
+                SELECT {columns}, CURRENT_TIMESTAMP FROM moved
+            """, (older_than_days,))
+            archived_counts[table_name] = cursor.rowcount
+        conn.commit()
+        metrics_cache.invalidate('inventory')
+        message = "Archived " + ", ".join(f"{count} from {table}" for table, count in archived_counts.items()) + "."
+        print(f"SUCCESS: {message}")
+        return True, message, archived_counts
+    except psycopg2.Error as e:
+        print(f"DB Error in archive_depleted_inventory: {e}")
+        if conn: conn.rollback()
+        return False, f"Database error during archive: {e}", {}
+    finally:
+        if cursor: cursor.close()
+        if conn: conn.close()
+
+def _revive_archived_row_with_cursor(cursor, table_name, where_sql, where_values):
+    """
+    Moves an archived row matching `where_sql` back into its hot table with its original id.
+    If a hot row with the same unique key was added since it was archived, the archived quantity is
+    merged into that row instead, and the archived row stays behind with `merged_into` pointing at it
+    so later lookups by the old id (restocks from sale edits/deletes) still find where the stock went.
+    Operates within the caller's transaction.
+    Returns the hot row's id (which differs from the archived id after a merge), or None if nothing matched.
+    """
+    archive_table = ARCHIVE_TABLES[table_name]
+    columns = ", ".join(ARCHIVE_COLUMNS[table_name])
+    quantity_column = QUANTITY_COLUMNS[table_name]
+    key_columns = UNIQUE_KEY_COLUMNS[table_name]
+    # Prefer a row that still holds its own stock over one already merged away.
+    cursor.execute(f"""
+        SELECT id, merged_into FROM {archive_table} WHERE {where_sql}
+        ORDER BY merged_into IS NOT NULL LIMIT 1 FOR UPDATE
+    """, where_values)
+    row = cursor.fetchone()
+    if not row:
+        return None
+    archived_id, merged_into = row[0], row[1]
+    seen_ids = {archived_id}
+    while merged_into is not None and merged_into not in seen_ids:
+        cursor.execute(f"SELECT id FROM {table_name} WHERE id = %s", (merged_into,))
+        hot_row = cursor.fetchone()
+        if hot_row:
+            return hot_row[0]
+        # The row it was merged into has been archived too; follow it there.
+        cursor.execute(f"SELECT id, merged_into FROM {archive_table} WHERE id = %s FOR UPDATE", (merged_into,))
+        target = cursor.fetchone()
+        if not target:
+            break  # Merge target was deleted outright; bring this row back on its own.
+        archived_id, merged_into = target[0], target[1]
+        seen_ids.add(archived_id)
+
+    cursor.execute(f"""
+        INSERT INTO {table_name} ({columns})
+        SELECT {columns} FROM {archive_table} WHERE id = %s
+        ON CONFLICT ({", ".join(key_columns)}) DO NOTHING
+        RETURNING id
+    """, (archived_id,))
+    revived = cursor.fetchone()
+    if revived:
+        cursor.execute(f"DELETE FROM {archive_table} WHERE id = %s", (archived_id,))
+        print(f"DB (cursor op): Revived archived {table_name} ID {revived[0]}")
+        return revived[0]
+
+    key_match = " AND ".join(f"hot.{column} = archived.{column}" for column in key_columns)
+    cursor.execute(f"""
+        UPDATE {table_name} AS hot
+        SET {quantity_column} = hot.{quantity_column} + archived.{quantity_column}, last_updated = CURRENT_TIMESTAMP
+        FROM {archive_table} AS archived
+        WHERE archived.id = %s AND {key_match}
+        RETURNING hot.id
+    """, (archived_id,))
+    merged = cursor.fetchone()
+    if not merged:
+        return None
+    cursor.execute(f"UPDATE {archive_table} SET merged_into = %s, {quantity_column} = 0 WHERE id = %s",
+                   (merged[0], archived_id))
+    print(f"DB (cursor op): Merged archived {table_name} ID {archived_id} into ID {merged[0]}")
+    return merged[0]
+
+
 def get_item_by_id(item_type, item_id):
     conn = get_db_connection()
     cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
@@ -342,6 +946,50 @@ def get_item_by_id(item_type, item_id):
         conn.close()
     return item
 
+def _add_card_with_cursor(cursor, set_code, collector_number, name, quantity, buy_price, is_foil, market_price_usd, foil_market_price_usd, image_uri, sell_price, location, scryfall_id, rarity, language, condition, timestamp):
+    """
+    Inserts a card or adds `quantity` to the identical stack (reviving a sold-out archived stack if needed).
+    Operates within the caller's transaction. Returns the card id.
+    """
+    is_foil_db_val = 1 if is_foil else 0
+    match_sql = """set_code = %s AND collector_number = %s AND is_foil = %s AND location = %s
+           AND rarity = %s AND language = %s AND buy_price = %s AND condition = %s"""
+    match_values = (set_code, collector_number, is_foil_db_val, location, rarity, language, buy_price, condition)
+    cursor.execute(f"SELECT id, quantity FROM cards WHERE {match_sql}", match_values)
+    existing_card = cursor.fetchone()
+    if not existing_card and _revive_archived_row_with_cursor(cursor, 'cards', match_sql, match_values):
+        cursor.execute(f"SELECT id, quantity FROM cards WHERE {match_sql}", match_values)
+        existing_card = cursor.fetchone()
+
+    if existing_card:
+        # Card exists, so update its quantity
+        new_quantity = existing_card['quantity'] + quantity
+        cursor.execute(
+            """UPDATE cards
+               SET quantity = %s, last_updated = %s,
+                   market_price_usd = %s, foil_market_price_usd = %s, image_uri = %s,
+                   sell_price = %s, name = %s, scryfall_id = %s
+               WHERE id = %s""",
+            (new_quantity, timestamp, market_price_usd, foil_market_price_usd, image_uri,
+             sell_price, name, scryfall_id, existing_card['id'])
+        )
+        print(f"SUCCESS (Updated): Added {quantity} x {name} ({set_code.upper()}) [{condition}] to existing stack.")
+        return existing_card['id']
+
+    # Card does not exist, so insert a new row
+    cursor.execute(
+        """INSERT INTO cards (set_code, collector_number, name, quantity, buy_price, is_foil,
+                             market_price_usd, foil_market_price_usd, image_uri, sell_price,
+                             location, date_added, last_updated, scryfall_id, rarity, language, condition)
+           VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+           RETURNING id""",
+        (set_code, collector_number, name, quantity, buy_price, is_foil_db_val,
+         market_price_usd, foil_market_price_usd, image_uri, sell_price,
+         location, timestamp, timestamp, scryfall_id, rarity, language, condition)
+    )
+    print(f"SUCCESS (Inserted): Added {quantity} x {name} ({set_code.upper()}) [{condition}] to inventory.")
+    return cursor.fetchone()['id']
+
 def add_card(set_code, collector_number, name, quantity, buy_price, is_foil, market_price_usd, foil_market_price_usd, image_uri, sell_price, location, scryfall_id, rarity, language, condition):
     """
     Adds a new card to the inventory or updates the quantity if an identical card is found.
@@ -349,62 +997,418 @@ def add_card(set_code, collector_number, name, quantity, buy_price, is_foil, mar
     """
     conn = get_db_connection()
     cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    try:
+        card_id = _add_card_with_cursor(cursor, set_code, collector_number, name, quantity, buy_price, is_foil,
+                                        market_price_usd, foil_market_price_usd, image_uri, sell_price, location,
+                                        scryfall_id, rarity, language, condition, datetime.datetime.now())
+        _record_price_history_with_cursor(cursor, [card_id])
+        conn.commit()
+        metrics_cache.invalidate('inventory')
+        return card_id
+
+    except psycopg2.Error as e:
+        print(f"DB Error in add_card for {name}: {e}")
+        if conn:
+            conn.rollback()
+        return None
+    finally:
+        if cursor:
+            cursor.close()
+        if conn:
+            conn.close()
+
+def add_cards_batch(cards, checkpoint=None):
+    """
+    Adds many cards in one transaction, with the same stacking rules as add_card.
+    Each card runs under its own savepoint, so one bad row doesn't lose the rest of the batch.
+
+    :param cards: List of dicts with add_card's keyword arguments.
+    :param checkpoint: Optional import_batches row to commit together with the cards: a dict with
+                       import_key, chunk_index, content_hash, import_id, rows_through, failed_stacks
+                       and card_stacks (the stack key of each card, in the same order as `cards`).
+                       Stacks of cards that fail here are added to failed_stacks.
+    :return: List of card ids (None where that card failed), in input order. All None if the commit fails.
+    """
+    if not cards and checkpoint is None:
+        return []
+    conn = get_db_connection()
+    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
     timestamp = datetime.datetime.now()
-    is_foil_db_val = 1 if is_foil else 0
-    card_id = None
+    card_ids = []
+    try:
+        for card in cards:
+            cursor.execute("SAVEPOINT add_card_batch_row")
+            try:
+                card_ids.append(_add_card_with_cursor(cursor, timestamp=timestamp, **card))
+                cursor.execute("RELEASE SAVEPOINT add_card_batch_row")
+            except psycopg2.Error as e:
+                print(f"DB Error in add_cards_batch for {card.get('name')}: {e}")
+                cursor.execute("ROLLBACK TO SAVEPOINT add_card_batch_row")
+                card_ids.append(None)
+        added_ids = [card_id for card_id in card_ids if card_id]
+        if added_ids:
+            _record_price_history_with_cursor(cursor, added_ids)
+        if checkpoint is not None:
+            failed_stacks = list(checkpoint['failed_stacks'])
+            failed_stacks += [stack for stack, card_id in zip(checkpoint['card_stacks'], card_ids) if not card_id]
+            _save_import_checkpoint_with_cursor(cursor, checkpoint['import_key'], checkpoint['chunk_index'],
+                                                checkpoint['content_hash'], checkpoint['import_id'],
+                                                checkpoint['rows_through'], failed_stacks)
+        conn.commit()
+        metrics_cache.invalidate('inventory')
+    except psycopg2.Error as e:
+        print(f"DB Error in add_cards_batch: {e}")
+        conn.rollback()
+        card_ids = [None] * len(cards)
+    finally:
+        cursor.close()
+        conn.close()
+    return card_ids
+
+
+# --- Import Checkpoints ---
+# One import_batches row per committed chunk of a CSV import, written in the same transaction as
+# the chunk's cards. import_key identifies the file contents plus the import options, so uploading
+# the same file again resumes: chunks with a row are skipped, except for the stacks listed in their
+# failed_stacks, which are retried. A run that ends with nothing failed clears its rows, so a later
+# upload of the same file is a new import again.
+
+def _save_import_checkpoint_with_cursor(cursor, import_key, chunk_index, content_hash, import_id, rows_through, failed_stacks):
+    """Records (or updates, for a retried chunk) one committed chunk. Operates within the caller's transaction."""
+    cursor.execute(
+        """INSERT INTO import_batches (import_key, chunk_index, content_hash, import_id, rows_through, failed_stacks, completed_at)
+           VALUES (%s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP)
+           ON CONFLICT (import_key, chunk_index) DO UPDATE
+           SET import_id = EXCLUDED.import_id, rows_through = EXCLUDED.rows_through,
+               failed_stacks = EXCLUDED.failed_stacks, completed_at = EXCLUDED.completed_at""",
+        (import_key, chunk_index, content_hash, import_id, rows_through, psycopg2.extras.Json(failed_stacks))
+    )
+
+def get_import_checkpoints(import_key):
+    """
+    Returns the committed chunks of an earlier run of this import.
+
+    :return: Dict {chunk_index: list of failed stack keys (each a list)}; empty if there was no earlier run,
+             None on a database error (the caller can't tell what was already imported).
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    try:
+        cursor.execute("SELECT chunk_index, failed_stacks FROM import_batches WHERE import_key = %s", (import_key,))
+        return {row['chunk_index']: row['failed_stacks'] for row in cursor.fetchall()}
+    except psycopg2.Error as e:
+        print(f"DB Error in get_import_checkpoints: {e}")
+        conn.rollback()
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+def clear_import_checkpoints(import_key):
+    """Forgets every committed chunk of an import. Returns the number of rows removed (None on error)."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("DELETE FROM import_batches WHERE import_key = %s", (import_key,))
+        deleted_count = cursor.rowcount
+        conn.commit()
+        return deleted_count
+    except psycopg2.Error as e:
+        print(f"DB Error in clear_import_checkpoints: {e}")
+        conn.rollback()
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+def save_import_job(job):
+    """Stores an import job's state dict (see import_jobs.py) under job['id']. Returns True on success."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute('''INSERT INTO import_jobs (id, state, updated_at) VALUES (%s, %s, CURRENT_TIMESTAMP)
+                          ON CONFLICT (id) DO UPDATE SET state = EXCLUDED.state, updated_at = EXCLUDED.updated_at''',
+                       (job['id'], psycopg2.extras.Json(job)))
+        conn.commit()
+        return True
+    except psycopg2.Error as e:
+        print(f"DB Error in save_import_job: {e}")
+        conn.rollback()
+        return False
+    finally:
+        cursor.close()
+        conn.close()
+
+def get_import_job(job_id):
+    """
+    Returns an import job's state.
+
+    :return: Tuple (state_dict, seconds since it was last saved or touched, by the database clock),
+             or None if the job is unknown (or on a database error).
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT state, EXTRACT(EPOCH FROM CURRENT_TIMESTAMP - updated_at)::float8 FROM import_jobs WHERE id = %s",
+                       (job_id,))
+        row = cursor.fetchone()
+        return tuple(row) if row else None
+    except psycopg2.Error as e:
+        print(f"DB Error in get_import_job: {e}")
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+def touch_import_job(job_id):
+    """Marks an import job as still alive (its heartbeat) without changing its state."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("UPDATE import_jobs SET updated_at = CURRENT_TIMESTAMP WHERE id = %s", (job_id,))
+        conn.commit()
+    except psycopg2.Error as e:
+        print(f"DB Error in touch_import_job: {e}")
+        conn.rollback()
+    finally:
+        cursor.close()
+        conn.close()
+
+def prune_import_jobs(older_than_seconds):
+    """Deletes import jobs not updated for `older_than_seconds`. Returns the number removed (None on error)."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("DELETE FROM import_jobs WHERE updated_at < CURRENT_TIMESTAMP - (%s * INTERVAL '1 second')",
+                       (older_than_seconds,))
+        deleted_count = cursor.rowcount
+        conn.commit()
+        return deleted_count
+    except psycopg2.Error as e:
+        print(f"DB Error in prune_import_jobs: {e}")
+        conn.rollback()
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+# --- Price History ---
+# Every write of card prices (adding cards, a single refresh, the bulk refresh) also records the
+# printing's prices in price_history, in the same transaction. A printing is (set code, collector
+# number, language), normalized as in PRICE_HISTORY_KEY_SQL; a point is only added when the prices
+# differ from the printing's latest point, and a second change on the same day replaces that day's point.
+
+PRICE_HISTORY_KEY_SQL = "LOWER(set_code), COALESCE(collector_number, ''), LOWER(COALESCE(language, ''))"
+
+def _record_price_history_with_cursor(cursor, card_ids=None):
+    """
+    Records today's prices for the printings of `card_ids` (every card when None) in one statement.
+    Printings without any price are skipped. Operates within the caller's transaction.
+
+    :return: Number of price points added or replaced.
+    """
+    card_filter, params = ("WHERE id = ANY(%s)", (list(card_ids),)) if card_ids is not None else ("", ())
+    cursor.execute(f"""
+        INSERT INTO price_history (set_code, collector_number, language, price_date, market_price_usd, foil_market_price_usd)
+        SELECT priced.set_code, priced.collector_number, priced.language, CURRENT_DATE,
+               priced.market_price_usd, priced.foil_market_price_usd
+        FROM (
+            -- Stacks of one printing can hold different prices until all are refreshed; the latest write wins.
+            SELECT DISTINCT ON (1, 2, 3) {PRICE_HISTORY_KEY_SQL}, market_price_usd, foil_market_price_usd
+            FROM cards {card_filter}
+            ORDER BY 1, 2, 3, last_updated DESC NULLS LAST
+        ) AS priced (set_code, collector_number, language, market_price_usd, foil_market_price_usd)
+        LEFT JOIN LATERAL (
+            SELECT h.market_price_usd, h.foil_market_price_usd FROM price_history h
+            WHERE h.set_code = priced.set_code AND h.collector_number = priced.collector_number
+              AND h.language = priced.language
+            ORDER BY h.price_date DESC LIMIT 1
+        ) latest ON TRUE
+        WHERE (priced.market_price_usd IS NOT NULL OR priced.foil_market_price_usd IS NOT NULL)
+          AND (latest.market_price_usd IS DISTINCT FROM priced.market_price_usd
+               OR latest.foil_market_price_usd IS DISTINCT FROM priced.foil_market_price_usd)
+        ON CONFLICT (set_code, collector_number, language, price_date) DO UPDATE
+        SET market_price_usd = EXCLUDED.market_price_usd, foil_market_price_usd = EXCLUDED.foil_market_price_usd
+    """, params)
+    return cursor.rowcount
+
+# A refreshed printing is a "mover" when its price moved at least this much since its previous
+# price_history point, as a percentage or in dollars per copy.
+PRICE_MOVER_MIN_PERCENT = float(os.environ.get('PRICE_MOVER_MIN_PERCENT', 20))
+PRICE_MOVER_MIN_CHANGE = float(os.environ.get('PRICE_MOVER_MIN_CHANGE', 1.00))
+
+def _record_price_movers_with_cursor(cursor, card_ids, min_percent=PRICE_MOVER_MIN_PERCENT, min_change=PRICE_MOVER_MIN_CHANGE):
+    """
+    Stores today's price_movers rows for the printings of `card_ids` in one statement: each held
+    printing/finish whose price point recorded today differs from its previous point by at least
+    `min_percent` % or `min_change` dollars, with the change weighted by the copies in stock.
+    Operates within the caller's transaction, after _record_price_history_with_cursor.
+
+    :return: Number of movers stored.
+    """
+    cursor.execute(f"""
+        WITH refreshed (set_code, collector_number, language) AS (
+            SELECT DISTINCT {PRICE_HISTORY_KEY_SQL} FROM cards WHERE id = ANY(%(card_ids)s)
+        ), holdings AS (
+            SELECT {PRICE_HISTORY_KEY_SQL}, is_foil, MIN(name), SUM(quantity)
+            FROM cards
+            WHERE quantity > 0 AND ({PRICE_HISTORY_KEY_SQL}) IN (SELECT * FROM refreshed)
+            GROUP BY 1, 2, 3, 4
+        ), moves AS (
+            SELECT held.*, previous.price_date AS previous_price_date,
+                   CASE WHEN held.is_foil = 1 THEN previous.foil_market_price_usd ELSE previous.market_price_usd END AS previous_price,
+                   CASE WHEN held.is_foil = 1 THEN today.foil_market_price_usd ELSE today.market_price_usd END AS current_price
+            FROM holdings AS held (set_code, collector_number, language, is_foil, name, quantity_on_hand)
+            JOIN price_history today
+              ON today.set_code = held.set_code AND today.collector_number = held.collector_number
+             AND today.language = held.language AND today.price_date = CURRENT_DATE
+            JOIN LATERAL (
+                SELECT p.price_date, p.market_price_usd, p.foil_market_price_usd FROM price_history p
+                WHERE p.set_code = held.set_code AND p.collector_number = held.collector_number
+                  AND p.language = held.language AND p.price_date < CURRENT_DATE
+                ORDER BY p.price_date DESC LIMIT 1
+            ) previous ON TRUE
+        )
+        INSERT INTO price_movers (detected_on, set_code, collector_number, language, is_foil, name, previous_price_date,
+                                  previous_price, current_price, price_change, percent_change, quantity_on_hand, value_change)
+        SELECT CURRENT_DATE, set_code, collector_number, language, is_foil, name, previous_price_date,
+               previous_price, current_price, current_price - previous_price,
+               CASE WHEN previous_price > 0 THEN (current_price - previous_price) / previous_price * 100 END,
+               quantity_on_hand, (current_price - previous_price) * quantity_on_hand
+        FROM moves
+        WHERE previous_price IS NOT NULL AND current_price IS NOT NULL AND current_price <> previous_price
+          AND (ABS(current_price - previous_price) >= %(min_change)s
+               OR previous_price = 0
+               OR ABS(current_price - previous_price) / previous_price * 100 >= %(min_percent)s)
+        ON CONFLICT (detected_on, set_code, collector_number, language, is_foil) DO UPDATE
+        SET name = EXCLUDED.name, previous_price_date = EXCLUDED.previous_price_date,
+            previous_price = EXCLUDED.previous_price, current_price = EXCLUDED.current_price,
+            price_change = EXCLUDED.price_change, percent_change = EXCLUDED.percent_change,
+            quantity_on_hand = EXCLUDED.quantity_on_hand, value_change = EXCLUDED.value_change
+    """, {'card_ids': list(card_ids), 'min_change': min_change, 'min_percent': min_percent})
+    return cursor.rowcount
+
+def update_card_prices_bulk(prices):
+    """
+    Writes refreshed market data for many cards in one transaction: UPDATE ... FROM (VALUES ...)
+    statements of 1000 rows each (rows whose data didn't change are left alone, so their
+    last_updated stays put), then one price_history write and one price_movers pass for the
+    printings that changed.
+
+    :param prices: List of (card_id, market_price_usd, foil_market_price_usd, image_uri) tuples.
+                   A None image_uri keeps the stored image.
+    :return: Tuple (cards_updated, price_points_recorded, price_movers_found), or None on a database error.
+    """
+    if not prices:
+        return 0, 0, 0
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    timestamp = datetime.datetime.now()
+    try:
+        updated_ids = psycopg2.extras.execute_values(cursor, """
+            UPDATE cards SET market_price_usd = v.market_price_usd, foil_market_price_usd = v.foil_market_price_usd,
+                             image_uri = COALESCE(v.image_uri, cards.image_uri), last_updated = v.last_updated
+            FROM (VALUES %s) AS v (id, market_price_usd, foil_market_price_usd, image_uri, last_updated)
+            WHERE cards.id = v.id
+              AND (cards.market_price_usd IS DISTINCT FROM v.market_price_usd
+                   OR cards.foil_market_price_usd IS DISTINCT FROM v.foil_market_price_usd
+                   OR cards.image_uri IS DISTINCT FROM COALESCE(v.image_uri, cards.image_uri))
+            RETURNING cards.id
+        """, [tuple(price) + (timestamp,) for price in prices], template="(%s, %s::real, %s::real, %s::text, %s::timestamp)",
+           page_size=1000, fetch=True)
+        updated_ids = [row[0] for row in updated_ids]
+        points_recorded = _record_price_history_with_cursor(cursor, updated_ids) if updated_ids else 0
+        movers_found = _record_price_movers_with_cursor(cursor, updated_ids) if points_recorded else 0
+        conn.commit()
+        if updated_ids:
+            metrics_cache.invalidate('inventory')
+        return len(updated_ids), points_recorded, movers_found
+    except psycopg2.Error as e:
+        print(f"DB error in update_card_prices_bulk: {e}")
+        conn.rollback()
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+def get_price_movers(detected_on=None, limit=100):
+    """
+    Reads one day's price movers report, biggest impact on stock value first.
+
+    :param detected_on: Report date (datetime.date or 'YYYY-MM-DD'); None for the most recent report.
+    :return: List of price_movers row dicts (empty when there is no report), or None on a database error.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    try:
+        cursor.execute(
+            """SELECT * FROM price_movers
+               WHERE detected_on = COALESCE(%s::date, (SELECT MAX(detected_on) FROM price_movers))
+               ORDER BY ABS(value_change) DESC LIMIT %s""",
+            (detected_on, limit)
+        )
+        return cursor.fetchall()
+    except psycopg2.Error as e:
+        print(f"DB error in get_price_movers: {e}")
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+def get_price_history(set_code, collector_number, language=None, start_date=None, end_date=None):
+    """
+    Returns the recorded price points of one printing, oldest first (an index range read).
+
+    :param start_date: Optional first date (datetime.date or 'YYYY-MM-DD'); end_date likewise, inclusive.
+    :return: List of dicts with price_date, market_price_usd and foil_market_price_usd (empty on error).
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    try:
+        cursor.execute(
+            """SELECT price_date, market_price_usd, foil_market_price_usd FROM price_history
+               WHERE set_code = LOWER(%s) AND collector_number = COALESCE(%s, '') AND language = LOWER(COALESCE(%s, ''))
+                 AND price_date >= COALESCE(%s::date, '-infinity') AND price_date <= COALESCE(%s::date, 'infinity')
+               ORDER BY price_date""",
+            (set_code, collector_number, language, start_date, end_date)
+        )
+        return cursor.fetchall()
+    except psycopg2.Error as e:
+        print(f"DB error in get_price_history for {set_code}-{collector_number}: {e}")
+        return []
+    finally:
+        cursor.close()
+        conn.close()
+
+def get_card_market_value_as_of(as_of_date):
+    """
+    Values the cards in stock now at the prices they had on `as_of_date` (each printing's latest point
+    on or before it). Cards whose printing has no point by then count as 0.
 
+    :return: Float market value, or None on a database error.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
     try:
-        # Check if an identical card already exists
         cursor.execute(
-            """SELECT id, quantity FROM cards
-               WHERE set_code = %s AND collector_number = %s AND is_foil = %s AND location = %s
-               AND rarity = %s AND language = %s AND buy_price = %s AND condition = %s""",
-            (set_code, collector_number, is_foil_db_val, location, rarity, language, buy_price, condition)
+            f"""SELECT COALESCE(SUM(c.quantity * CASE WHEN c.is_foil = 1 THEN p.foil_market_price_usd ELSE p.market_price_usd END), 0)
+                FROM (SELECT quantity, is_foil, {PRICE_HISTORY_KEY_SQL} FROM cards WHERE quantity > 0)
+                     AS c (quantity, is_foil, set_code, collector_number, language)
+                JOIN LATERAL (
+                    SELECT h.market_price_usd, h.foil_market_price_usd FROM price_history h
+                    WHERE h.set_code = c.set_code AND h.collector_number = c.collector_number
+                      AND h.language = c.language AND h.price_date <= %s
+                    ORDER BY h.price_date DESC LIMIT 1
+                ) p ON TRUE""",
+            (as_of_date,)
         )
-        existing_card = cursor.fetchone()
-
-        if existing_card:
-            # Card exists, so update its quantity
-            new_quantity = existing_card['quantity'] + quantity
-            cursor.execute(
-                """UPDATE cards
-                   SET quantity = %s, last_updated = %s,
-                       market_price_usd = %s, foil_market_price_usd = %s, image_uri = %s,
-                       sell_price = %s, name = %s, scryfall_id = %s
-                   WHERE id = %s""",
-                (new_quantity, timestamp, market_price_usd, foil_market_price_usd, image_uri,
-                 sell_price, name, scryfall_id, existing_card['id'])
-            )
-            card_id = existing_card['id']
-            print(f"SUCCESS (Updated): Added {quantity} x {name} ({set_code.upper()}) [{condition}] to existing stack.")
-        else:
-            # Card does not exist, so insert a new row
-            cursor.execute(
-                """INSERT INTO cards (set_code, collector_number, name, quantity, buy_price, is_foil,
-                                     market_price_usd, foil_market_price_usd, image_uri, sell_price,
-                                     location, date_added, last_updated, scryfall_id, rarity, language, condition)
-                   VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                   RETURNING id""",
-                (set_code, collector_number, name, quantity, buy_price, is_foil_db_val,
-                 market_price_usd, foil_market_price_usd, image_uri, sell_price,
-                 location, timestamp, timestamp, scryfall_id, rarity, language, condition)
-            )
-            card_id = cursor.fetchone()['id']
-            print(f"SUCCESS (Inserted): Added {quantity} x {name} ({set_code.upper()}) [{condition}] to inventory.")
-
-        conn.commit()
-        return card_id
-
+        return float(cursor.fetchone()[0])
     except psycopg2.Error as e:
-        print(f"DB Error in add_card for {name}: {e}")
-        if conn:
-            conn.rollback()
+        print(f"DB error in get_card_market_value_as_of for {as_of_date}: {e}")
         return None
     finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            conn.close()
+        cursor.close()
+        conn.close()
 
 
 def add_shipping_supply_batch(supply_name, description, unit_of_measure, purchase_date_str, quantity, total_purchase_amount, location):
@@ -425,13 +1429,14 @@ def add_shipping_supply_batch(supply_name, description, unit_of_measure, purchas
         calculated_cost_per_unit = round(float(total_purchase_amount) / quantity, 2) if quantity > 0 else 0.0
 
         # Check if an identical batch already exists (now using calculated_cost_per_unit and WITHOUT purchase_date)
-        cursor.execute(
-            """SELECT id, quantity_on_hand FROM shipping_supplies_inventory
-               WHERE supply_name = %s AND description = %s AND unit_of_measure = %s
-               AND cost_per_unit = %s AND location = %s""",
-            (supply_name, description, unit_of_measure, calculated_cost_per_unit, location)
-        )
+        match_sql = """supply_name = %s AND description = %s AND unit_of_measure = %s
+               AND cost_per_unit = %s AND location = %s"""
+        match_values = (supply_name, description, unit_of_measure, calculated_cost_per_unit, location)
+        cursor.execute(f"SELECT id, quantity_on_hand FROM shipping_supplies_inventory WHERE {match_sql}", match_values)
         existing_batch = cursor.fetchone()
+        if not existing_batch and _revive_archived_row_with_cursor(cursor, 'shipping_supplies_inventory', match_sql, match_values):
+            cursor.execute(f"SELECT id, quantity_on_hand FROM shipping_supplies_inventory WHERE {match_sql}", match_values)
+            existing_batch = cursor.fetchone()
 
         if existing_batch:
             # Batch exists, so update its quantity
@@ -473,6 +1478,7 @@ def add_shipping_supply_batch(supply_name, description, unit_of_measure, purchas
 
 
         conn.commit()
+        metrics_cache.invalidate('inventory')
         return supply_batch_id
 
     except psycopg2.IntegrityError as ie:
@@ -601,7 +1607,7 @@ def get_all_shipping_supplies():
     cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
     supplies = []
     try:
-        cursor.execute("SELECT * FROM shipping_supplies_inventory WHERE quantity_on_hand > 0 ORDER BY supply_name, description, purchase_date ASC")
+        cursor.execute(ALL_SHIPPING_SUPPLIES_SQL)
         supplies = cursor.fetchall()
     except psycopg2.Error as e:
         print(f"DB error in get_all_shipping_supplies: {e}")
@@ -633,6 +1639,7 @@ def delete_shipping_supply(supply_id):
     try:
         cursor.execute("DELETE FROM shipping_supplies_inventory WHERE id = %s", (supply_id,))
         conn.commit()
+        metrics_cache.invalidate('inventory')
         deleted = cursor.rowcount > 0
     except psycopg2.Error as e:
         print(f"DB error in delete_shipping_supply for ID {supply_id}: {e}")
@@ -678,6 +1685,7 @@ def update_shipping_supply_fields(supply_id, data_to_update_from_app):
     try:
         cursor.execute(sql_query_string, final_sql_values_tuple)
         conn.commit()
+        metrics_cache.invalidate('inventory')
         updated_rows = cursor.rowcount
         return (True, "Shipping supply batch updated successfully.") if updated_rows > 0 else (False, "Shipping supply batch not found or data identical.")
     except psycopg2.IntegrityError as e:
@@ -692,6 +1700,74 @@ def update_shipping_supply_fields(supply_id, data_to_update_from_app):
         cursor.close()
         conn.close()
 
+def _inventory_where_clauses(table_name, filters):
+    """
+    Builds the WHERE clauses for one inventory table from the inventory tab filters.
+    Shared by mass_update_inventory_items and the paginated inventory API so both select the same rows.
+
+    :param table_name: 'cards', 'sealed_products' or 'shipping_supplies_inventory'.
+    :param filters: Dict with any of filter_text, filter_location, filter_set, filter_foil, filter_rarity,
+                    filter_card_lang, filter_condition, filter_collector, filter_sealed_lang ('all' = no filter).
+    :return: Tuple (list_of_sql_clauses, list_of_values)
+    """
+    where_clauses = []
+    where_values = []
+
+    if filters.get('filter_text'):
+        search_term = f"%{filters['filter_text'].lower()}%"
+        if table_name == 'cards':
+            where_clauses.append("(LOWER(name) LIKE %s OR LOWER(set_code) LIKE %s OR LOWER(location) LIKE %s OR LOWER(collector_number) LIKE %s OR LOWER(rarity) LIKE %s OR LOWER(language) LIKE %s)")
+            where_values.extend([search_term, search_term, search_term, search_term, search_term, search_term])
+        elif table_name == 'sealed_products':
+            where_clauses.append("(LOWER(product_name) LIKE %s OR LOWER(set_name) LIKE %s OR LOWER(location) LIKE %s OR LOWER(product_type) LIKE %s OR LOWER(language) LIKE %s)")
+            where_values.extend([search_term, search_term, search_term, search_term, search_term])
+        elif table_name == 'shipping_supplies_inventory':
+            where_clauses.append("(LOWER(supply_name) LIKE %s OR LOWER(description) LIKE %s OR LOWER(location) LIKE %s OR LOWER(unit_of_measure) LIKE %s)")
+            where_values.extend([search_term, search_term, search_term, search_term])
+
+    if filters.get('filter_location') and filters['filter_location'] != 'all':
+        where_clauses.append("LOWER(location) = LOWER(%s)")
+        where_values.append(filters['filter_location'])
+
+    # Type-specific filters (only apply if the table matches the filter context)
+    if table_name == 'cards':
+        if filters.get('filter_set') and filters['filter_set'] != 'all':
+            where_clauses.append("LOWER(set_code) = LOWER(%s)")
+            where_values.append(filters['filter_set'])
+        if filters.get('filter_foil', 'all') != 'all':
+            where_clauses.append("is_foil = %s")
+            where_values.append(1 if filters['filter_foil'] == 'yes' else 0)
+        if filters.get('filter_rarity') and filters['filter_rarity'] != 'all':
+            where_clauses.append("LOWER(rarity) = LOWER(%s)")
+            where_values.append(filters['filter_rarity'])
+        if filters.get('filter_card_lang') and filters['filter_card_lang'] != 'all':
+            where_clauses.append("LOWER(language) = LOWER(%s)")
+            where_values.append(filters['filter_card_lang'])
+        if filters.get('filter_condition') and filters['filter_condition'] != 'all':
+            where_clauses.append("LOWER(condition) = LOWER(%s)")
+            where_values.append(filters['filter_condition'])
+
+    if table_name == 'sealed_products':
+        if filters.get('filter_set') and filters['filter_set'] != 'all':
+            where_clauses.append("LOWER(set_name) = LOWER(%s)")
+            where_values.append(filters['filter_set'])
+        if filters.get('filter_collector', 'all') != 'all':
+            where_clauses.append("is_collectors_item = %s")
+            where_values.append(1 if filters['filter_collector'] == 'yes' else 0)
+        if filters.get('filter_sealed_lang') and filters['filter_sealed_lang'] != 'all':
+            where_clauses.append("LOWER(language) = LOWER(%s)")
+            where_values.append(filters['filter_sealed_lang'])
+
+    # No specific filter for shipping supplies beyond general text and location, as per current design.
+
+    # Only items that are still in stock
+    if table_name in ['cards', 'sealed_products']:
+        where_clauses.append("quantity > 0")
+    elif table_name == 'shipping_supplies_inventory':
+        where_clauses.append("quantity_on_hand > 0")
+
+    return where_clauses, where_values
+
 def mass_update_inventory_items(filters, update_data):
     """
     Performs a mass update on inventory items (cards, sealed products, or shipping supplies)
@@ -727,68 +1803,10 @@ def mass_update_inventory_items(filters, update_data):
 
     try:
         for table_name in tables_to_update:
-            where_clauses = []
-            where_values = []
             set_clauses = []
             set_values = []
 
-            # --- Construct WHERE clauses based on filters ---
-            if filters.get('filter_text'):
-                search_term = f"%{filters['filter_text']}%"
-                if table_name == 'cards':
-                    where_clauses.append("(LOWER(name) LIKE %s OR LOWER(set_code) LIKE %s OR LOWER(location) LIKE %s OR LOWER(collector_number) LIKE %s OR LOWER(rarity) LIKE %s OR LOWER(language) LIKE %s)")
-                    where_values.extend([search_term, search_term, search_term, search_term, search_term, search_term])
-                elif table_name == 'sealed_products':
-                    where_clauses.append("(LOWER(product_name) LIKE %s OR LOWER(set_name) LIKE %s OR LOWER(location) LIKE %s OR LOWER(product_type) LIKE %s OR LOWER(language) LIKE %s)")
-                    where_values.extend([search_term, search_term, search_term, search_term, search_term])
-                elif table_name == 'shipping_supplies_inventory':
-                    where_clauses.append("(LOWER(supply_name) LIKE %s OR LOWER(description) LIKE %s OR LOWER(location) LIKE %s OR LOWER(unit_of_measure) LIKE %s)")
-                    where_values.extend([search_term, search_term, search_term, search_term])
-
-            if filters.get('filter_location') and filters['filter_location'] != 'all':
-                if table_name in ['cards', 'sealed_products', 'shipping_supplies_inventory']:
-                    where_clauses.append("LOWER(location) = LOWER(%s)")
-                    where_values.append(filters['filter_location'])
-
-            # Type-specific filters (only apply if the table matches the filter context)
-            if table_name == 'cards':
-                if filters.get('filter_set') and filters['filter_set'] != 'all':
-                    # CORRECTED LINE: Only reference set_code for the 'cards' table
-                    where_clauses.append("LOWER(set_code) = LOWER(%s)")
-                    where_values.append(filters['filter_set'])
-                if filters.get('filter_foil') != 'all':
-                    is_foil_val = 1 if filters['filter_foil'] == 'yes' else 0
-                    where_clauses.append("is_foil = %s")
-                    where_values.append(is_foil_val)
-                if filters.get('filter_rarity') and filters['filter_rarity'] != 'all':
-                    where_clauses.append("LOWER(rarity) = LOWER(%s)")
-                    where_values.append(filters['filter_rarity'])
-                if filters.get('filter_card_lang') and filters['filter_card_lang'] != 'all':
-                    where_clauses.append("LOWER(language) = LOWER(%s)")
-                    where_values.append(filters['filter_card_lang'])
-                if filters.get('filter_condition') and filters['filter_condition'] != 'all':
-                    where_clauses.append("LOWER(condition) = LOWER(%s)")
-                    where_values.append(filters['filter_condition'])
-            
-            if table_name == 'sealed_products':
-                if filters.get('filter_set') and filters['filter_set'] != 'all':
-                    where_clauses.append("LOWER(set_name) = LOWER(%s)")
-                    where_values.append(filters['filter_set'])
-                if filters.get('filter_collector') != 'all':
-                    is_collector_val = 1 if filters['filter_collector'] == 'yes' else 0
-                    where_clauses.append("is_collectors_item = %s")
-                    where_values.append(is_collector_val)
-                if filters.get('filter_sealed_lang') and filters['filter_sealed_lang'] != 'all':
-                    where_clauses.append("LOWER(language) = LOWER(%s)")
-                    where_values.append(filters['filter_sealed_lang'])
-
-            # No specific filter for shipping supplies beyond general text and location, as per current design.
-
-            # Ensure we only update items that have a quantity > 0
-            if table_name in ['cards', 'sealed_products']:
-                 where_clauses.append("quantity > 0")
-            elif table_name == 'shipping_supplies_inventory':
-                 where_clauses.append("quantity_on_hand > 0")
+            where_clauses, where_values = _inventory_where_clauses(table_name, filters)
 
             # --- Construct SET clauses based on update_data ---
             for field, value in update_data.items():
@@ -843,6 +1861,7 @@ def mass_update_inventory_items(filters, update_data):
             messages.append(f"Updated {rows_affected} items in {table_name} table.")
 
         conn.commit()
+        metrics_cache.invalidate('inventory')
         return True, "Mass update completed. " + " ".join(messages), updated_count
 
     except psycopg2.Error as e:
@@ -861,6 +1880,431 @@ def mass_update_inventory_items(filters, update_data):
         if conn:
             conn.close()
 
+def reprice_inventory(priced_queries, filters=None, apply=False, sample_limit=100):
+    """
+    Runs compiled repricing rules (repricing.compile_rule_set) as a dry run or for real. Both read
+    the same REPEATABLE READ snapshot for the diff; applying then sets sell_price with one
+    UPDATE ... FROM (rule query) per table, touching only rows whose price changes.
+
+    :param priced_queries: Dict {table_name: (sql, params)} from repricing.compile_rule_set.
+    :param filters: Optional inventory tab filters limiting the run (see _inventory_where_clauses).
+    :param apply: False for a dry run (nothing is written).
+    :param sample_limit: Number of changed rows returned, biggest change in asking value first.
+    :return: Dict with 'applied', 'summary' ({table_name: {changed, raised, lowered, newly_priced,
+             asking_value_before, asking_value_after}}) and 'changes' (list of row dicts), or None on a database error.
+    """
+    filters = filters or {}
+    conn = get_db_connection()
+    cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    result = {'applied': False, 'summary': {}, 'changes': []}
+    try:
+        cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+        timestamp = datetime.datetime.now()
+        for table_name, (sql, params) in priced_queries.items():
+            scope_clauses, scope_values = _inventory_where_clauses(table_name, filters)
+            changed_sql = (f"SELECT * FROM ({sql.replace('{scope}', ''.join(f' AND {clause}' for clause in scope_clauses))}) priced "
+                           "WHERE new_price IS NOT NULL AND old_price IS DISTINCT FROM new_price")
+            changed_params = list(params) + scope_values
+            cursor.execute(f"""SELECT COUNT(*) AS changed,
+                                      COUNT(*) FILTER (WHERE new_price > old_price) AS raised,
+                                      COUNT(*) FILTER (WHERE new_price < old_price) AS lowered,
+                                      COUNT(*) FILTER (WHERE old_price IS NULL) AS newly_priced,
+                                      COALESCE(SUM(quantity * old_price::float8), 0) AS asking_value_before,
+                                      COALESCE(SUM(quantity * new_price::float8), 0) AS asking_value_after
+                               FROM ({changed_sql}) changed""", changed_params)
+            result['summary'][table_name] = cursor.fetchone()
+            cursor.execute(f"""SELECT * FROM ({changed_sql}) changed
+                               ORDER BY ABS(quantity * (new_price - COALESCE(old_price, 0))) DESC LIMIT %s""",
+                           changed_params + [sample_limit])
+            result['changes'] += cursor.fetchall()
+            if apply and result['summary'][table_name]['changed']:
+                cursor.execute(f"""UPDATE {table_name} SET sell_price = changed.new_price, last_updated = %s
+                                   FROM ({changed_sql}) changed WHERE {table_name}.id = changed.id""",
+                               [timestamp] + changed_params)
+        result['changes'].sort(key=lambda row: abs(row['quantity'] * (row['new_price'] - (row['old_price'] or 0))), reverse=True)
+        del result['changes'][sample_limit:]
+        if apply:
+            conn.commit()
+            result['applied'] = True
+            metrics_cache.invalidate('inventory')
+        else:
+            conn.rollback()
+        return result
+    except psycopg2.Error as e:
+        print(f"DB error in reprice_inventory: {e}")
+        conn.rollback()
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+# Normalized columns shared by every branch of the inventory UNION ALL, so one ORDER BY / LIMIT covers all types.
+_INVENTORY_UNION_SELECTS = {
+    'cards': """SELECT 'single_card' AS item_type, id, name AS display_name, quantity, location, buy_price, sell_price, image_uri,
+                       set_code, collector_number, is_foil, rarity, language, condition,
+                       NULL::text AS set_name, NULL::text AS product_type, NULL::integer AS is_collectors_item,
+                       CASE WHEN is_foil = 1 THEN foil_market_price_usd ELSE market_price_usd END AS current_market_price,
+                       NULL::text AS description, NULL::text AS unit_of_measure, NULL::date AS purchase_date
+                FROM cards""",
+    'sealed_products': """SELECT 'sealed_product', id, product_name, quantity, location, buy_price, sell_price, image_uri,
+                       NULL::text, NULL::text, NULL::integer, NULL::text, language, NULL::text,
+                       set_name, product_type, is_collectors_item, manual_market_price,
+                       NULL::text, NULL::text, NULL::date
+                FROM sealed_products""",
+    'shipping_supplies_inventory': """SELECT 'shipping_supply', id, supply_name, quantity_on_hand, location, cost_per_unit, NULL::real, NULL::text,
+                       NULL::text, NULL::text, NULL::integer, NULL::text, NULL::text, NULL::text,
+                       NULL::text, NULL::text, NULL::integer, NULL::real,
+                       description, unit_of_measure, purchase_date
+                FROM shipping_supplies_inventory""",
+}
+
+# Whitelisted ORDER BY expressions for the inventory sort keys offered in the UI.
+INVENTORY_SORT_EXPRESSIONS = {
+    'display_name': "LOWER(display_name)",
+    'supply_name': "LOWER(display_name)",
+    'set_name_sort': "LOWER(COALESCE(set_code, set_name, ''))",
+    'location': "LOWER(COALESCE(location, ''))",
+    'quantity': "quantity",
+    'buy_price': "buy_price",
+    'cost_per_unit': "buy_price",
+    'current_market_price': "current_market_price",
+    'rarity': "LOWER(COALESCE(rarity, ''))",
+    'language': "LOWER(COALESCE(language, ''))",
+    'condition': "LOWER(COALESCE(condition, ''))",
+    'collector_number': "LOWER(COALESCE(collector_number, ''))",
+    'product_type': "LOWER(COALESCE(product_type, ''))",
+    'purchase_date': "purchase_date",
+}
+
+def _inventory_union_query(filters):
+    """
+    Builds the filtered UNION ALL over cards, sealed products and shipping supplies.
+    Supplies are left out when a card/sealed-only filter is active, matching the inventory tab.
+    :return: Tuple (sql, values)
+    """
+    item_type = filters.get('filter_type', 'all')
+    type_tables = {'single_card': 'cards', 'sealed_product': 'sealed_products', 'shipping_supply': 'shipping_supplies_inventory'}
+    tables = list(_INVENTORY_UNION_SELECTS) if item_type == 'all' else [type_tables.get(item_type)]
+
+    item_specific_filter_keys = ['filter_set', 'filter_foil', 'filter_rarity', 'filter_card_lang',
+                                 'filter_condition', 'filter_collector', 'filter_sealed_lang']
+    if any(filters.get(key, 'all') not in (None, '', 'all') for key in item_specific_filter_keys):
+        tables = [t for t in tables if t != 'shipping_supplies_inventory']
+
+    branches = []
+    values = []
+    for table_name in tables:
+        if table_name is None:
+            continue
+        where_clauses, where_values = _inventory_where_clauses(table_name, filters)
+        branches.append(f"{_INVENTORY_UNION_SELECTS[table_name]} WHERE {' AND '.join(where_clauses)}")
+        values.extend(where_values)
+    if not branches:
+        branches.append(f"{_INVENTORY_UNION_SELECTS['cards']} WHERE FALSE")
+    return " UNION ALL ".join(branches), values
+
+def get_inventory_page(filters, sort_key='display_name', sort_dir='asc', page=1, per_page=50):
+    """
+    Returns one page of the combined inventory, filtered, sorted and paginated in SQL.
+
+    :param filters: Inventory tab filters (filter_type, filter_text, filter_location, ...).
+    :return: Tuple (list_of_row_dicts, total_count)
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    rows = []
+    total_count = 0
+    union_sql, values = _inventory_union_query(filters)
+    sort_expression = INVENTORY_SORT_EXPRESSIONS.get(sort_key, INVENTORY_SORT_EXPRESSIONS['display_name'])
+    direction = 'DESC' if sort_dir == 'desc' else 'ASC'
+    offset = (max(page, 1) - 1) * per_page
+    try:
+        cursor.execute(f"""SELECT inv.*, COUNT(*) OVER() AS total_count FROM ({union_sql}) inv
+                           ORDER BY {sort_expression} {direction} NULLS FIRST, LOWER(display_name) {direction}, item_type, id
+                           LIMIT %s OFFSET %s""", values + [per_page, offset])
+        rows = [dict(row) for row in cursor.fetchall()]
+        if rows:
+            total_count = rows[0]['total_count']
+        elif offset > 0:
+            # Page past the end: still report the real total so the caller can clamp.
+            cursor.execute(f"SELECT COUNT(*) FROM ({union_sql}) inv", values)
+            total_count = cursor.fetchone()[0]
+        for row in rows:
+            row.pop('total_count', None)
+    except psycopg2.Error as e:
+        print(f"DB error in get_inventory_page: {e}")
+    finally:
+        cursor.close()
+        conn.close()
+    return rows, total_count
+
+def get_inventory_index_changes(changed_since):
+    """
+    Feeds inventory_index.py: in-stock rows with the get_inventory_page columns, only those whose
+    row_version is at least `changed_since` when that is set, and per table the ids currently in stock
+    (to drop sold-out/deleted/archived rows). Read in one REPEATABLE READ transaction so rows and id
+    lists agree.
+
+    The returned marker is the oldest transaction id still running when the read's snapshot was taken.
+    Every write this read could not see belongs to a transaction at or after it, so passing it back as
+    `changed_since` picks up all of them (and re-reads some rows already seen, which is harmless).
+
+    :param changed_since: Marker from an earlier call, or None to read everything.
+    :return: Tuple (list_of_row_dicts, {table_name: list_of_in_stock_ids}, marker), or None on a database error.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    rows, in_stock_ids = [], {}
+    try:
+        cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+        # The first query fixes the transaction's snapshot, so the marker describes what the rest reads.
+        cursor.execute("SELECT txid_snapshot_xmin(txid_current_snapshot())")
+        marker = cursor.fetchone()[0]
+        # One UNION ALL, so every branch gets the column names of the cards branch.
+        branches, values = [], []
+        for table_name, union_select in _INVENTORY_UNION_SELECTS.items():
+            where_sql = f"WHERE {QUANTITY_COLUMNS[table_name]} > 0"
+            if changed_since is not None:
+                where_sql += " AND row_version >= %s"
+                values.append(changed_since)
+            branches.append(f"{union_select} {where_sql}")
+        cursor.execute(" UNION ALL ".join(branches), values)
+        rows = [dict(row) for row in cursor.fetchall()]
+        for table_name in _INVENTORY_UNION_SELECTS:
+            cursor.execute(f"SELECT COALESCE(array_agg(id), '{{}}') FROM {table_name} WHERE {QUANTITY_COLUMNS[table_name]} > 0")
+            in_stock_ids[table_name] = cursor.fetchone()[0]
+    except psycopg2.Error as e:
+        print(f"DB error in get_inventory_index_changes: {e}")
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+    return rows, in_stock_ids, marker
+
+def get_inventory_filter_options():
+    """Distinct values for the inventory filter dropdowns, computed from in-stock items (None on a database error)."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    options = {'locations': [], 'sets': [], 'rarities': [], 'card_languages': [], 'sealed_languages': []}
+    queries = {
+        'locations': """SELECT location FROM cards WHERE quantity > 0
+                        UNION SELECT location FROM sealed_products WHERE quantity > 0
+                        UNION SELECT location FROM shipping_supplies_inventory WHERE quantity_on_hand > 0""",
+        'sets': """SELECT set_code FROM cards WHERE quantity > 0
+                   UNION SELECT set_name FROM sealed_products WHERE quantity > 0""",
+        'rarities': "SELECT DISTINCT rarity FROM cards WHERE quantity > 0",
+        'card_languages': "SELECT DISTINCT language FROM cards WHERE quantity > 0",
+        'sealed_languages': "SELECT DISTINCT language FROM sealed_products WHERE quantity > 0",
+    }
+    try:
+        for option_key, sql in queries.items():
+            cursor.execute(sql)
+            options[option_key] = sorted(row[0] for row in cursor.fetchall() if row[0])
+    except psycopg2.Error as e:
+        print(f"DB error in get_inventory_filter_options: {e}")
+        options = None
+    finally:
+        cursor.close()
+        conn.close()
+    return options
+
+def get_shipping_supplies_page(filters, page=1, per_page=50):
+    """
+    Returns one page of in-stock shipping supply batches (text/location filters only), ordered like get_all_shipping_supplies.
+    :return: Tuple (list_of_row_dicts, total_count)
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    rows = []
+    total_count = 0
+    where_clauses, where_values = _inventory_where_clauses('shipping_supplies_inventory', filters)
+    offset = (max(page, 1) - 1) * per_page
+    try:
+        cursor.execute(f"""SELECT *, COUNT(*) OVER() AS total_count FROM shipping_supplies_inventory
+                           WHERE {' AND '.join(where_clauses)}
+                           ORDER BY supply_name, description, purchase_date ASC, id
+                           LIMIT %s OFFSET %s""", where_values + [per_page, offset])
+        rows = [dict(row) for row in cursor.fetchall()]
+        if rows:
+            total_count = rows[0]['total_count']
+        for row in rows:
+            row.pop('total_count', None)
+            row.pop('search_text', None)
+    except psycopg2.Error as e:
+        print(f"DB error in get_shipping_supplies_page: {e}")
+    finally:
+        cursor.close()
+        conn.close()
+    return rows, total_count
+
+
+def search_sale_items(query_text, limit=20):
+    """
+    Finds in-stock cards, sealed products and supply batches for the sale form's item search.
+    Every whitespace-separated term must appear in the row's search_text (name, set, collector
+    number, rarity, language, condition, location, ...). Rows whose name starts with the first
+    term rank first, then rows are ordered by name.
+
+    :param query_text: Raw text typed by the user.
+    :param limit: Maximum number of rows returned across all three tables.
+    :return: List of (item_type, row_dict) tuples, best match first.
+    """
+    terms = [term for term in (query_text or '').lower().split() if term]
+    if not terms:
+        return []
+    escaped_terms = [term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') for term in terms]
+
+    conn = get_db_connection()
+    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    matches = []
+    try:
+        for table_name, item_type in SEARCH_ITEM_TYPES.items():
+            name_column = SEARCH_NAME_COLUMNS[table_name]
+            where_sql = " AND ".join(["search_text LIKE %s"] * len(escaped_terms))
+            cursor.execute(f"""
+                SELECT *, LOWER({name_column}) LIKE %s AS name_prefix_match FROM {table_name}
+                WHERE {QUANTITY_COLUMNS[table_name]} > 0 AND {where_sql}
+                ORDER BY name_prefix_match DESC, LOWER({name_column}), id
+                LIMIT %s
+            """, [escaped_terms[0] + '%'] + [f"%{term}%" for term in escaped_terms] + [limit])
+            for row in cursor.fetchall():
+                row = dict(row)
+                row.pop('search_text', None)
+                prefix_match = row.pop('name_prefix_match')
+                matches.append((not prefix_match, (row[name_column] or '').lower(), item_type, row))
+    except psycopg2.Error as e:
+        print(f"DB error in search_sale_items: {e}")
+    finally:
+        cursor.close()
+        conn.close()
+    matches.sort(key=lambda match: match[:3] + (match[3]['id'],))
+    return [(item_type, row) for _, _, item_type, row in matches[:limit]]
+
+# --- Streaming Readers ---
+# Bulk readers go through a named (server-side) cursor: PostgreSQL keeps the result set and the
+# client fetches `itersize` rows per round trip (DB_STREAM_ITERSIZE by default), so memory stays flat
+# for any table size. Rows come as 'tuple' (plain tuples, cheapest), 'namedtuple' (attribute
+# access, what templates use) or 'dict' (DictRow, for code written against the get_all_* lists).
+# The connection is held until the generator is exhausted or closed.
+STREAM_ITERSIZE = int(os.environ.get('DB_STREAM_ITERSIZE', 2000))
+ROW_CURSOR_FACTORIES = {
+    'tuple': psycopg2.extensions.cursor,
+    'namedtuple': psycopg2.extras.NamedTupleCursor,
+    'dict': psycopg2.extras.DictCursor,
+}
+
+ALL_CARDS_SQL = "SELECT * FROM cards WHERE quantity > 0 ORDER BY name, set_code, collector_number, location, buy_price, rarity, language, condition"
+ALL_SEALED_PRODUCTS_SQL = "SELECT * FROM sealed_products WHERE quantity > 0 ORDER BY product_name, set_name, location, buy_price"
+ALL_SHIPPING_SUPPLIES_SQL = "SELECT * FROM shipping_supplies_inventory WHERE quantity_on_hand > 0 ORDER BY supply_name, description, purchase_date ASC"
+ALL_FINANCIAL_ENTRIES_SQL = "SELECT * FROM financial_entries ORDER BY entry_date DESC, id DESC"
+
+EXPORT_COLUMNS = {
+    'cards': ARCHIVE_COLUMNS['cards'],
+    'sealed_products': ARCHIVE_COLUMNS['sealed_products'],
+    'shipping_supplies': ARCHIVE_COLUMNS['shipping_supplies_inventory'],
+    'sales': ['sale_event_id', 'sale_date', 'platform', 'customer_shipping_charge', 'total_shipping_cost', 'platform_fee',
+              'total_supplies_cost_for_sale', 'total_profit_loss', 'sale_notes', 'sale_item_id', 'item_type',
+              'inventory_item_id', 'original_item_name', 'original_item_details', 'quantity_sold',
+              'sell_price_per_item', 'buy_price_per_item', 'item_profit_loss'],
+    'ledger': ['id', 'entry_date', 'description', 'category', 'entry_type', 'amount', 'notes', 'date_recorded'],
+}
+EXPORT_INVENTORY_TABLES = {
+    'cards': 'cards',
+    'sealed_products': 'sealed_products',
+    'shipping_supplies': 'shipping_supplies_inventory',
+}
+
+def stream_rows(sql, params=(), itersize=STREAM_ITERSIZE, row_format='dict'):
+    """
+    Runs a SELECT on a named server-side cursor and yields its rows as they are fetched.
+
+    :param itersize: Rows fetched per round trip.
+    :param row_format: 'tuple', 'namedtuple' or 'dict' (see ROW_CURSOR_FACTORIES).
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor(name=f"stream_{uuid.uuid4().hex}", cursor_factory=ROW_CURSOR_FACTORIES[row_format])
+    cursor.itersize = itersize
+    try:
+        cursor.execute(sql, params)
+        for row in cursor:
+            yield row
+    except psycopg2.Error as e:
+        print(f"DB error in stream_rows: {e}")
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+
+def stream_rows_or_stop(rows):
+    """
+    Yields from a stream_rows() generator, ending quietly if the query fails, the way the list readers
+    return []. For page rendering, where a DB error should leave the section empty rather than fail the page.
+    """
+    try:
+        yield from rows
+    except psycopg2.Error:
+        return  # Already logged by stream_rows.
+
+def iter_cards(itersize=STREAM_ITERSIZE, row_format='namedtuple'):
+    """Streaming get_all_cards(): in-stock cards in the same order."""
+    return stream_rows(ALL_CARDS_SQL, itersize=itersize, row_format=row_format)
+
+def iter_sealed_products(itersize=STREAM_ITERSIZE, row_format='namedtuple'):
+    """Streaming get_all_sealed_products(): in-stock sealed products in the same order."""
+    return stream_rows(ALL_SEALED_PRODUCTS_SQL, itersize=itersize, row_format=row_format)
+
+def iter_shipping_supplies(itersize=STREAM_ITERSIZE, row_format='namedtuple'):
+    """Streaming get_all_shipping_supplies(): in-stock supply batches in the same order."""
+    return stream_rows(ALL_SHIPPING_SUPPLIES_SQL, itersize=itersize, row_format=row_format)
+
+def iter_financial_entries(itersize=STREAM_ITERSIZE, row_format='namedtuple'):
+    """Streaming get_all_financial_entries(): every ledger entry, newest first."""
+    return stream_rows(ALL_FINANCIAL_ENTRIES_SQL, itersize=itersize, row_format=row_format)
+
+def _export_query(dataset, filters):
+    if dataset in EXPORT_INVENTORY_TABLES:
+        table_name = EXPORT_INVENTORY_TABLES[dataset]
+        where_clauses, where_values = _inventory_where_clauses(table_name, filters)
+        where_sql = f"WHERE {' AND '.join(where_clauses)}" if where_clauses else ""
+        return f"SELECT {', '.join(EXPORT_COLUMNS[dataset])} FROM {table_name} {where_sql} ORDER BY id", where_values
+
+    date_column = 'se.sale_date' if dataset == 'sales' else 'entry_date'
+    where_clauses, where_values = [], []
+    item_clauses, item_values = [], []
+    if filters.get('start_date'):
+        where_clauses.append(f"{date_column} >= %s")
+        where_values.append(filters['start_date'])
+        item_clauses.append(" AND si.sale_date >= %s")
+        item_values.append(filters['start_date'])
+    if filters.get('end_date'):
+        where_clauses.append(f"{date_column} <= %s")
+        where_values.append(filters['end_date'])
+        item_clauses.append(" AND si.sale_date <= %s")
+        item_values.append(filters['end_date'])
+    where_sql = f"WHERE {' AND '.join(where_clauses)}" if where_clauses else ""
+    if dataset == 'sales':
+        # One row per sold item; sales without items still get one row with empty item columns.
+        return f"""SELECT se.id AS sale_event_id, se.sale_date, se.platform, se.customer_shipping_charge, se.total_shipping_cost,
+                          se.platform_fee, se.total_supplies_cost_for_sale, se.total_profit_loss, se.notes AS sale_notes,
+                          si.id AS sale_item_id, si.item_type, si.inventory_item_id, si.original_item_name,
+                          si.original_item_details, si.quantity_sold, si.sell_price_per_item, si.buy_price_per_item,
+                          si.item_profit_loss
+                   FROM sale_events se
+                   LEFT JOIN sale_items si ON si.sale_event_id = se.id AND si.sale_date = se.sale_date{''.join(item_clauses)}
+                   {where_sql} ORDER BY se.sale_date, se.id, si.id""", item_values + where_values
+    return f"SELECT {', '.join(EXPORT_COLUMNS['ledger'])} FROM financial_entries {where_sql} ORDER BY entry_date, id", where_values
+
+def iter_export_rows(dataset, filters):
+    """
+    Streams the rows of one export dataset.
+
+    :param dataset: A key of EXPORT_COLUMNS.
+    :param filters: Inventory tab filters for the inventory datasets (only in-stock rows, as on the tab);
+                    start_date / end_date ('YYYY-MM-DD') for 'sales' and 'ledger'.
+    :return: Generator of tuples in the order of the dataset's EXPORT_COLUMNS.
+    """
+    sql, params = _export_query(dataset, filters)
+    return stream_rows(sql, params, row_format='tuple')
 
 def delete_sale_event(sale_event_id):
     """
@@ -877,7 +2321,7 @@ def delete_sale_event(sale_event_id):
         # Start a transaction (implicitly handled by psycopg2, committed or rolled back explicitly)
 
         # Check if the sale event itself exists before proceeding with detailed operations
-        cursor.execute("SELECT id FROM sale_events WHERE id = %s FOR UPDATE", (sale_event_id,)) # Use FOR UPDATE to lock row
+        cursor.execute("SELECT id, sale_date FROM sale_events WHERE id = %s FOR UPDATE", (sale_event_id,)) # Use FOR UPDATE to lock row
         event_exists = cursor.fetchone()
 
         if not event_exists:
@@ -890,8 +2334,8 @@ def delete_sale_event(sale_event_id):
         cursor.execute("""
             SELECT inventory_item_id, item_type, quantity_sold, original_item_name
             FROM sale_items
-            WHERE sale_event_id = %s
-        """, (sale_event_id,))
+            WHERE sale_event_id = %s AND sale_date = %s
+        """, (sale_event_id, event_exists['sale_date']))
         items_sold = cursor.fetchall()
 
         # 2. Get all *shipping supplies* used in this sale event
@@ -928,9 +2372,13 @@ def delete_sale_event(sale_event_id):
             supply_name_for_msg = supply['supply_name_snapshot']
             supply_desc_for_msg = supply['supply_description_snapshot']
 
-            # Retrieve current quantity and lock the row
+            # Retrieve current quantity and lock the row (reviving the batch if it was archived)
             cursor.execute("SELECT quantity_on_hand FROM shipping_supplies_inventory WHERE id = %s FOR UPDATE", (supply_id,))
             current_supply_qty_row = cursor.fetchone()
+            if not current_supply_qty_row:
+                supply_id = _revive_archived_row_with_cursor(cursor, 'shipping_supplies_inventory', "id = %s", (supply_id,)) or supply_id
+                cursor.execute("SELECT quantity_on_hand FROM shipping_supplies_inventory WHERE id = %s FOR UPDATE", (supply_id,))
+                current_supply_qty_row = cursor.fetchone()
             if not current_supply_qty_row:
                 conn.rollback()
                 return False, f"Failed to restock shipping supply '{supply_name_for_msg}' (ID: {supply_id}): Supply not found in inventory. Sale event not deleted."
@@ -947,15 +2395,16 @@ def delete_sale_event(sale_event_id):
         cursor.execute("DELETE FROM sale_event_shipping_supplies WHERE sale_event_id = %s", (sale_event_id,))
 
         # 6. Delete the sale items records for this event
-        cursor.execute("DELETE FROM sale_items WHERE sale_event_id = %s", (sale_event_id,))
+        cursor.execute("DELETE FROM sale_items WHERE sale_event_id = %s AND sale_date = %s", (sale_event_id, event_exists['sale_date']))
 
         # 7. Delete the sale event record
-        cursor.execute("DELETE FROM sale_events WHERE id = %s", (sale_event_id,))
+        cursor.execute("DELETE FROM sale_events WHERE id = %s AND sale_date = %s", (sale_event_id, event_exists['sale_date']))
         if cursor.rowcount == 0:
             conn.rollback()
             return False, f"Sale event ID {sale_event_id} could not be deleted (was it already deleted?)."
 
         conn.commit() # Commit all changes if everything succeeded
+        metrics_cache.invalidate('inventory', 'sales')
         final_message = f"Sale event ID {sale_event_id} deleted. " + " ".join(restocking_messages)
         return True, final_message
 
@@ -990,7 +2439,7 @@ def get_sale_event_by_id_with_details(sale_event_id):
     try:
         # Fetch main sale event details
         cursor.execute('''SELECT id, sale_date, total_shipping_cost, notes, total_profit_loss, date_recorded,
-                                 customer_shipping_charge, platform_fee, total_supplies_cost_for_sale
+                                 customer_shipping_charge, platform_fee, platform, total_supplies_cost_for_sale
                          FROM sale_events WHERE id = %s''', (sale_event_id,))
         sale_event = cursor.fetchone()
 
@@ -1000,7 +2449,8 @@ def get_sale_event_by_id_with_details(sale_event_id):
             # Fetch associated inventory items
             cursor.execute('''SELECT id, inventory_item_id, item_type, original_item_name, original_item_details,
                                      quantity_sold, sell_price_per_item, buy_price_per_item, item_profit_loss
-                              FROM sale_items WHERE sale_event_id = %s ORDER BY id ASC''', (sale_event_id,))
+                              FROM sale_items WHERE sale_event_id = %s AND sale_date = %s ORDER BY id ASC''',
+                           (sale_event_id, sale_event['sale_date']))
             sale_event['items'] = [dict(item) for item in cursor.fetchall()]
 
             # Fetch associated shipping supplies
@@ -1016,10 +2466,11 @@ def get_sale_event_by_id_with_details(sale_event_id):
         if conn: conn.close()
     return sale_event
 
-def _reverse_and_reapply_inventory_impacts(cursor, sale_event_id, old_items, new_items, old_supplies, new_supplies):
+def _reverse_and_reapply_inventory_impacts(cursor, sale_event_id, old_items, new_items, old_supplies, new_supplies, sale_date):
     """
     Helper to reverse the inventory impact of old items/supplies and apply the impact of new ones.
     This function operates within an existing transaction (using the passed cursor).
+    New sale_items rows are recorded under `sale_date`, the event's (possibly changed) date.
     Returns (success_boolean, message, total_items_profit_loss, total_new_shipping_supplies_cost).
     """
     messages = []
@@ -1035,8 +2486,13 @@ def _reverse_and_reapply_inventory_impacts(cursor, sale_event_id, old_items, new
 
     # 2. Reverse old shipping supply impacts (add back to stock)
     for old_supply in old_supplies:
-        cursor.execute("SELECT quantity_on_hand FROM shipping_supplies_inventory WHERE id = %s FOR UPDATE", (old_supply['supply_id'],))
+        supply_id = old_supply['supply_id']
+        cursor.execute("SELECT quantity_on_hand FROM shipping_supplies_inventory WHERE id = %s FOR UPDATE", (supply_id,))
         current_qty_row = cursor.fetchone()
+        if not current_qty_row:
+            supply_id = _revive_archived_row_with_cursor(cursor, 'shipping_supplies_inventory', "id = %s", (supply_id,)) or supply_id
+            cursor.execute("SELECT quantity_on_hand FROM shipping_supplies_inventory WHERE id = %s FOR UPDATE", (supply_id,))
+            current_qty_row = cursor.fetchone()
         if not current_qty_row:
             # If an old supply batch was deleted from inventory, we can't restock it. Log and proceed.
             messages.append(f"Warning: Old shipping supply ID {old_supply['supply_id']} ('{old_supply['supply_name_snapshot']}') not found for restock. Skipping.")
@@ -1045,7 +2501,7 @@ def _reverse_and_reapply_inventory_impacts(cursor, sale_event_id, old_items, new
         new_qty = current_qty_row['quantity_on_hand'] + old_supply['quantity_used']
         cursor.execute(
             "UPDATE shipping_supplies_inventory SET quantity_on_hand = %s, last_updated = %s WHERE id = %s",
-            (new_qty, datetime.datetime.now(), old_supply['supply_id'])
+            (new_qty, datetime.datetime.now(), supply_id)
         )
         messages.append(f"Restocked {old_supply['quantity_used']} of '{old_supply['supply_name_snapshot']}'.")
 
@@ -1107,9 +2563,9 @@ def _reverse_and_reapply_inventory_impacts(cursor, sale_event_id, old_items, new
             lang_str_sealed = (original_item_db_row.get('language') if original_item_db_row.get('language') is not None else 'N/A')
             original_item_details_snapshot = f"{original_item_db_row['set_name']} - {original_item_db_row['product_type']} {'(Collector)' if original_item_db_row['is_collectors_item'] else ''} (L: {lang_str_sealed.upper()})"
 
-        cursor.execute('''INSERT INTO sale_items (sale_event_id, inventory_item_id, item_type, original_item_name, original_item_details, quantity_sold, sell_price_per_item, buy_price_per_item, item_profit_loss)
-                          VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)''',
-                       (sale_event_id, inventory_item_id_int, item_type, original_item_name_snapshot, original_item_details_snapshot, quantity_sold, sell_price_per_item, buy_price_per_item, item_profit_loss))
+        cursor.execute('''INSERT INTO sale_items (sale_event_id, sale_date, inventory_item_id, item_type, original_item_name, original_item_details, quantity_sold, sell_price_per_item, buy_price_per_item, item_profit_loss)
+                          VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)''',
+                       (sale_event_id, sale_date, inventory_item_id_int, item_type, original_item_name_snapshot, original_item_details_snapshot, quantity_sold, sell_price_per_item, buy_price_per_item, item_profit_loss))
 
         success_deduct, msg_deduct = _update_inventory_item_quantity_with_cursor(cursor, item_type, inventory_item_id_int, -quantity_sold)
         if not success_deduct:
@@ -1154,7 +2610,7 @@ def _reverse_and_reapply_inventory_impacts(cursor, sale_event_id, old_items, new
 
 def update_sale_event_details(sale_event_id, sale_date_str, total_shipping_cost_str, overall_notes,
                                  customer_shipping_charge_str, platform_fee_str,
-                                 new_items_data, new_shipping_supplies_data):
+                                 new_items_data, new_shipping_supplies_data, platform=None):
     """
     Updates an existing sale event's details, reversing old inventory impacts
     and applying new ones based on the updated items and supplies.
@@ -1174,13 +2630,16 @@ def update_sale_event_details(sale_event_id, sale_date_str, total_shipping_cost_
         our_postage_cost = float(total_shipping_cost_str if total_shipping_cost_str and total_shipping_cost_str.strip() != '' else 0.0)
         customer_shipping_charge = float(customer_shipping_charge_str if customer_shipping_charge_str and customer_shipping_charge_str.strip() != '' else 0.0)
         platform_fee = float(platform_fee_str if platform_fee_str and platform_fee_str.strip() != '' else 0.0)
+        platform = (platform or '').strip() or None
 
         # Reverse old impacts and apply new ones within a single transaction
+        _ensure_sale_partitions_with_cursor(cursor, [sale_date_obj.year])
         success_reapply, messages_list, total_items_profit_loss, total_new_shipping_supplies_cost = \
             _reverse_and_reapply_inventory_impacts(
                 cursor, sale_event_id,
                 old_sale_event['items'], new_items_data,
-                old_sale_event['shipping_supplies_used'], new_shipping_supplies_data
+                old_sale_event['shipping_supplies_used'], new_shipping_supplies_data,
+                sale_date_obj
             )
 
         if not success_reapply:
@@ -1204,16 +2663,18 @@ def update_sale_event_details(sale_event_id, sale_date_str, total_shipping_cost_
                 notes = %s,
                 customer_shipping_charge = %s,
                 platform_fee = %s,
+                platform = %s,
                 total_profit_loss = %s,
                 total_supplies_cost_for_sale = %s,
                 date_recorded = %s -- Update last modified timestamp
             WHERE id = %s
         ''', (sale_date_obj, our_postage_cost, overall_notes,
-              customer_shipping_charge, platform_fee,
+              customer_shipping_charge, platform_fee, platform,
               final_event_profit_loss, total_new_shipping_supplies_cost,
               datetime.datetime.now(), sale_event_id))
 
         conn.commit()
+        metrics_cache.invalidate('inventory', 'sales')
         return True, "Sale event updated successfully. " + " ".join(messages_list)
 
     except psycopg2.Error as e:
@@ -1236,7 +2697,7 @@ def get_all_cards():
     cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
     cards = []
     try:
-        cursor.execute("SELECT * FROM cards WHERE quantity > 0 ORDER BY name, set_code, collector_number, location, buy_price, rarity, language, condition")
+        cursor.execute(ALL_CARDS_SQL)
         cards = cursor.fetchall()
     except psycopg2.Error as e:
         print(f"DB error in get_all_cards: {e}")
@@ -1276,6 +2737,7 @@ def update_card_quantity(card_id, quantity_change):
         cursor.execute("UPDATE cards SET quantity = %s, last_updated = %s WHERE id = %s",
                        (new_quantity, datetime.datetime.now(), card_id))
         conn.commit()
+        metrics_cache.invalidate('inventory')
         return True, f"Card quantity updated to {new_quantity}."
     except psycopg2.Error as e:
         print(f"DB error in update_card_quantity for ID {card_id}: {e}")
@@ -1293,6 +2755,7 @@ def delete_card(card_id):
     try:
         cursor.execute("DELETE FROM cards WHERE id = %s", (card_id,))
         conn.commit()
+        metrics_cache.invalidate('inventory')
         deleted = cursor.rowcount > 0
     except psycopg2.Error as e:
         print(f"DB error in delete_card for ID {card_id}: {e}")
@@ -1309,11 +2772,15 @@ def update_card_prices_and_image(card_id, market_price_usd, foil_market_price_us
     try:
         cursor.execute(''' UPDATE cards SET market_price_usd = %s, foil_market_price_usd = %s, image_uri = %s, last_updated = %s WHERE id = %s ''',
                        (market_price_usd, foil_market_price_usd, image_uri, datetime.datetime.now(), card_id))
-        conn.commit()
         updated = cursor.rowcount > 0
+        if updated:
+            _record_price_history_with_cursor(cursor, [card_id])
+        conn.commit()
+        metrics_cache.invalidate('inventory')
     except psycopg2.Error as e:
         print(f"DB error in update_card_prices_and_image for ID {card_id}: {e}")
         if conn: conn.rollback()
+        updated = False
     finally:
         cursor.close()
         conn.close()
@@ -1350,6 +2817,7 @@ def update_card_fields(card_id, data_to_update):
     try:
         cursor.execute(sql, final_sql_values)
         conn.commit()
+        metrics_cache.invalidate('inventory')
         updated_rows = cursor.rowcount
         return (True, "Card updated successfully.") if updated_rows > 0 else (False, "Card not found or no data changed.")
     except psycopg2.IntegrityError as e:
@@ -1378,10 +2846,14 @@ def add_sealed_product(product_name, set_name, product_type, language, is_collec
         return None
 
     try:
+        match_sql = '''product_name = %s AND set_name = %s AND product_type = %s AND language = %s AND location = %s AND is_collectors_item = %s AND buy_price = %s'''
+        match_values = (product_name, set_name, product_type, language, location, is_collectors_int, current_buy_price)
         with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as check_cursor:
-            check_cursor.execute('''SELECT id, quantity FROM sealed_products WHERE product_name = %s AND set_name = %s AND product_type = %s AND language = %s AND location = %s AND is_collectors_item = %s AND buy_price = %s''',
-                                (product_name, set_name, product_type, language, location, is_collectors_int, current_buy_price))
+            check_cursor.execute(f"SELECT id, quantity FROM sealed_products WHERE {match_sql}", match_values)
             existing = check_cursor.fetchone()
+            if not existing and _revive_archived_row_with_cursor(check_cursor, 'sealed_products', match_sql, match_values):
+                check_cursor.execute(f"SELECT id, quantity FROM sealed_products WHERE {match_sql}", match_values)
+                existing = check_cursor.fetchone()
 
         if existing:
             prod_id, new_qty = existing['id'], existing['quantity'] + quantity
@@ -1394,6 +2866,7 @@ def add_sealed_product(product_name, set_name, product_type, language, is_collec
             result = cursor.fetchone()
             if result: prod_id = result[0]
         conn.commit()
+        metrics_cache.invalidate('inventory')
     except psycopg2.IntegrityError as ie:
         print(f"DB IntegrityError add_sealed for {product_name}: {ie}")
         if conn: conn.rollback()
@@ -1412,7 +2885,7 @@ def get_all_sealed_products():
     cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
     prods = []
     try:
-        cursor.execute("SELECT * FROM sealed_products WHERE quantity > 0 ORDER BY product_name, set_name, location, buy_price")
+        cursor.execute(ALL_SEALED_PRODUCTS_SQL)
         prods = cursor.fetchall()
     except psycopg2.Error as e:
         print(f"DB error in get_all_sealed_products: {e}")
@@ -1452,6 +2925,7 @@ def update_sealed_product_quantity(product_id, quantity_change):
         cursor.execute("UPDATE sealed_products SET quantity = %s, last_updated = %s WHERE id = %s",
                        (new_quantity, datetime.datetime.now(), product_id))
         conn.commit()
+        metrics_cache.invalidate('inventory')
         return True, f"Sealed product quantity updated to {new_quantity}."
     except psycopg2.Error as e:
         print(f"DB error in update_sealed_product_quantity for ID {product_id}: {e}")
@@ -1469,6 +2943,7 @@ def delete_sealed_product(product_id):
     try:
         cursor.execute("DELETE FROM sealed_products WHERE id = %s", (product_id,))
         conn.commit()
+        metrics_cache.invalidate('inventory')
         deleted = cursor.rowcount > 0
     except psycopg2.Error as e:
         print(f"DB error in delete_sealed_product for ID {product_id}: {e}")
@@ -1513,6 +2988,7 @@ def update_sealed_product_fields(product_id, data_to_update_from_app):
     try:
         cursor.execute(sql_query_string, final_sql_values_tuple)
         conn.commit()
+        metrics_cache.invalidate('inventory')
         updated_rows = cursor.rowcount
         return (True, "Sealed product updated successfully.") if updated_rows > 0 else (False, "Sealed product not found or data identical.")
     except psycopg2.IntegrityError as e:
@@ -1532,6 +3008,12 @@ def _update_inventory_item_quantity_with_cursor(cursor, item_type, item_id, quan
     try:
         cursor.execute(f"SELECT quantity FROM {table_name} WHERE id = %s FOR UPDATE", (item_id,))
         result = cursor.fetchone() # This cursor might be a plain cursor or DictCursor based on context
+        if not result and quantity_change > 0:
+            # Restocking a sold-out item that was archived: it comes back with its original id,
+            # or is merged into a hot row with the same unique key.
+            item_id = _revive_archived_row_with_cursor(cursor, table_name, "id = %s", (item_id,)) or item_id
+            cursor.execute(f"SELECT quantity FROM {table_name} WHERE id = %s FOR UPDATE", (item_id,))
+            result = cursor.fetchone()
         if not result:
             return False, f"{item_type.replace('_', ' ').capitalize()} not found."
 
@@ -1550,8 +3032,79 @@ def _update_inventory_item_quantity_with_cursor(cursor, item_type, item_id, quan
         print(f"DB error in _update_inventory_item_quantity_with_cursor for {table_name} ID {item_id}: {e}")
         return False, f"DB error during quantity update: {e}"
 
+# --- Idempotent Sale Recording ---
+# The sale form sends a fresh idempotency key with each sale it submits (and the same key again if
+# that submission is retried or double-clicked). record_multi_item_sale claims the key in
+# sale_idempotency_keys inside the sale's own transaction, so a repeat of a committed sale returns
+# the original sale_event_id without deducting stock again, and a repeat that arrives while the
+# first is still running waits on the key's row until it commits. The key is stored with a hash of
+# the request it came with; the same key with a different request raises IdempotencyKeyConflict.
+# prune_sale_idempotency_keys (run nightly by prune_idempotency_keys.py) drops keys older than
+# SALE_IDEMPOTENCY_KEY_TTL_DAYS, outside any sale transaction.
+SALE_IDEMPOTENCY_KEY_TTL_DAYS = int(os.environ.get('SALE_IDEMPOTENCY_KEY_TTL_DAYS', 7))
+SALE_IDEMPOTENCY_KEY_MAX_LENGTH = 200
+
+
+class IdempotencyKeyConflict(Exception):
+    """The idempotency key was already used for a different sale request."""
+
+    def __init__(self, sale_event_id):
+        super().__init__(f"This idempotency key was already used for a different sale (ID: {sale_event_id}).")
+        self.sale_event_id = sale_event_id
+
+
+def get_sale_idempotency_record(idempotency_key):
+    """
+    What is recorded under `idempotency_key`.
+
+    :return: Tuple (sale_event_id, request_hash), or None if the key is unused (or on a database error).
+             sale_event_id is None while the sale that claimed the key is still being recorded.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT sale_event_id, request_hash FROM sale_idempotency_keys WHERE idempotency_key = %s", (idempotency_key,))
+        row = cursor.fetchone()
+        return tuple(row) if row else None
+    except psycopg2.Error as e:
+        print(f"DB error in get_sale_idempotency_record: {e}")
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+def prune_sale_idempotency_keys(older_than_days=SALE_IDEMPOTENCY_KEY_TTL_DAYS):
+    """
+    Deletes idempotency keys older than `older_than_days`, in its own transaction.
+    Returns a tuple: (success_boolean, message_string, deleted_count)
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("DELETE FROM sale_idempotency_keys WHERE created_at < CURRENT_TIMESTAMP - (%s * INTERVAL '1 day')",
+                       (older_than_days,))
+        deleted_count = cursor.rowcount
+        conn.commit()
+        return True, f"Deleted {deleted_count} idempotency key(s) older than {older_than_days} day(s).", deleted_count
+    except psycopg2.Error as e:
+        print(f"DB Error in prune_sale_idempotency_keys: {e}")
+        conn.rollback()
+        return False, f"Database error: {e}", 0
+    finally:
+        cursor.close()
+        conn.close()
+
 def record_multi_item_sale(sale_date_str, total_shipping_cost_str, overall_notes, items_data_from_app,
-                           customer_shipping_charge_str, platform_fee_str, shipping_supplies_data):
+                           customer_shipping_charge_str, platform_fee_str, shipping_supplies_data, platform=None,
+                           idempotency_key=None, request_hash=None):
+    """
+    Records a sale event with its items and shipping supplies, deducting them from stock, in one transaction.
+
+    :param idempotency_key: Optional client-chosen key; a sale already recorded under it is not recorded again.
+    :param request_hash: Hash of the request the key came with, stored alongside it.
+    :return: Tuple (sale_event_id or None, message). For a repeated key, the original sale_event_id.
+    :raises IdempotencyKeyConflict: If the key was recorded with a different request_hash.
+    """
     conn = get_db_connection()
     cursor = conn.cursor() # Use a plain cursor here for DML that doesn't need DictCursor
     sale_event_id = None
@@ -1563,6 +3116,7 @@ def record_multi_item_sale(sale_date_str, total_shipping_cost_str, overall_notes
         our_postage_cost = float(total_shipping_cost_str if total_shipping_cost_str and total_shipping_cost_str.strip() != '' else 0.0)
         customer_shipping_charge = float(customer_shipping_charge_str if customer_shipping_charge_str and customer_shipping_charge_str.strip() != '' else 0.0)
         platform_fee = float(platform_fee_str if platform_fee_str and platform_fee_str.strip() != '' else 0.0)
+        platform = (platform or '').strip() or None
 
     except ValueError as e:
         print(f"DB Error: Invalid date/shipping/fee format: {e}")
@@ -1570,17 +3124,35 @@ def record_multi_item_sale(sale_date_str, total_shipping_cost_str, overall_notes
         return None, f"Invalid date/shipping/fee: {e}"
 
     try:
+        if idempotency_key:
+            # Blocks while another transaction holds the same key; returns nothing once that one has committed it.
+            cursor.execute('''INSERT INTO sale_idempotency_keys (idempotency_key, request_hash) VALUES (%s, %s)
+                              ON CONFLICT (idempotency_key) DO NOTHING RETURNING idempotency_key''', (idempotency_key, request_hash))
+            if cursor.fetchone() is None:
+                cursor.execute("SELECT sale_event_id, request_hash FROM sale_idempotency_keys WHERE idempotency_key = %s", (idempotency_key,))
+                row = cursor.fetchone()
+                conn.rollback()
+                existing_sale_event_id, existing_hash = row if row else (None, None)
+                if existing_hash and request_hash and existing_hash != request_hash:
+                    raise IdempotencyKeyConflict(existing_sale_event_id)
+                print(f"DB: Repeated sale request (key {idempotency_key}) for sale_event ID {existing_sale_event_id}")
+                return existing_sale_event_id, "This sale was already recorded; it was not recorded again."
+
+        _ensure_sale_partitions_with_cursor(cursor, [sale_date_obj.year])
         # Step 1: Insert into sale_events first to get sale_event_id
         # We will update total_profit_loss later after calculating it
         # and total_supplies_cost_for_sale after iterating through supplies.
-        cursor.execute('''INSERT INTO sale_events (sale_date, total_shipping_cost, notes, customer_shipping_charge, platform_fee)
-                          VALUES (%s, %s, %s, %s, %s) RETURNING id''',
-                       (sale_date_obj, our_postage_cost, overall_notes, customer_shipping_charge, platform_fee))
+        cursor.execute('''INSERT INTO sale_events (sale_date, total_shipping_cost, notes, customer_shipping_charge, platform_fee, platform)
+                          VALUES (%s, %s, %s, %s, %s, %s) RETURNING id''',
+                       (sale_date_obj, our_postage_cost, overall_notes, customer_shipping_charge, platform_fee, platform))
         result = cursor.fetchone()
         if result: sale_event_id = result[0]
         else: raise Exception("Failed to create sale event.") # Should always return an ID
 
         print(f"DB: Created sale_event ID {sale_event_id}")
+        if idempotency_key:
+            cursor.execute("UPDATE sale_idempotency_keys SET sale_event_id = %s WHERE idempotency_key = %s",
+                           (sale_event_id, idempotency_key))
 
         # Step 2: Deduct shipping supplies from inventory and record in new table
         # Using a separate cursor with DictCursor capabilities for reading supply details
@@ -1678,9 +3250,9 @@ def record_multi_item_sale(sale_date_str, total_shipping_cost_str, overall_notes
                     lang_str_sealed = (original_item_db_row.get('language') if original_item_db_row.get('language') is not None else 'N/A')
                     original_item_details_snapshot = f"{original_item_db_row['set_name']} - {original_item_db_row['product_type']} {'(Collector)' if original_item_db_row['is_collectors_item'] else ''} (L: {lang_str_sealed.upper()})"
 
-                cursor.execute('''INSERT INTO sale_items (sale_event_id, inventory_item_id, item_type, original_item_name, original_item_details, quantity_sold, sell_price_per_item, buy_price_per_item, item_profit_loss)
-                                  VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)''',
-                               (sale_event_id, inventory_item_id_int, item_type, original_item_name_snapshot, original_item_details_snapshot, quantity_sold, sell_price_per_item, buy_price_per_item, item_profit_loss))
+                cursor.execute('''INSERT INTO sale_items (sale_event_id, sale_date, inventory_item_id, item_type, original_item_name, original_item_details, quantity_sold, sell_price_per_item, buy_price_per_item, item_profit_loss)
+                                  VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)''',
+                               (sale_event_id, sale_date_obj, inventory_item_id_int, item_type, original_item_name_snapshot, original_item_details_snapshot, quantity_sold, sell_price_per_item, buy_price_per_item, item_profit_loss))
 
                 # Use the helper function to update inventory quantity
                 success_inv_update, msg_inv_update = _update_inventory_item_quantity_with_cursor(cursor, item_type, inventory_item_id_int, -quantity_sold)
@@ -1690,10 +3262,13 @@ def record_multi_item_sale(sale_date_str, total_shipping_cost_str, overall_notes
         # Final Update to sale_events: Calculate total_profit_loss and update total_supplies_cost_for_sale
         final_event_profit_loss = total_items_profit_loss + customer_shipping_charge - our_postage_cost - total_shipping_supplies_cost - platform_fee
 
-        cursor.execute('''UPDATE sale_events SET total_profit_loss = %s, total_supplies_cost_for_sale = %s WHERE id = %s''', (final_event_profit_loss, total_shipping_supplies_cost, sale_event_id))
+        cursor.execute('''UPDATE sale_events SET total_profit_loss = %s, total_supplies_cost_for_sale = %s WHERE id = %s AND sale_date = %s''', (final_event_profit_loss, total_shipping_supplies_cost, sale_event_id, sale_date_obj))
         conn.commit()
+        metrics_cache.invalidate('inventory', 'sales')
         print(f"DB: Committed sale_event ID {sale_event_id} with total P/L: {final_event_profit_loss}")
         return sale_event_id, "Sale event recorded successfully."
+    except IdempotencyKeyConflict:
+        raise
     except Exception as e:
         print(f"DB Error in record_multi_item_sale: {e}")
         if conn: conn.rollback()
@@ -1703,17 +3278,32 @@ def record_multi_item_sale(sale_date_str, total_shipping_cost_str, overall_notes
         if conn: conn.close()
 
 
-def get_all_sale_events_with_items():
+def get_all_sale_events_with_items(start_date=None, end_date=None):
+    """
+    Sale events (newest first) with their items, optionally limited to sale dates from start_date through
+    end_date (inclusive). Both bounds apply to sale_events and sale_items, so only the yearly partitions
+    covering the range are read.
+    """
     conn = get_db_connection()
     # Use DictCursor to access columns by name
     cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
     sale_events_processed = []
+    date_bounds_sql = "sale_date >= COALESCE(%s::date, '-infinity') AND sale_date <= COALESCE(%s::date, 'infinity')"
     try:
         # Select all necessary fields from sale_events, including the new ones
-        cursor.execute('''SELECT id, sale_date, total_shipping_cost, notes, total_profit_loss, date_recorded,
-                                 customer_shipping_charge, platform_fee, total_supplies_cost_for_sale
-                         FROM sale_events ORDER BY sale_date DESC, id DESC''')
+        cursor.execute(f'''SELECT id, sale_date, total_shipping_cost, notes, total_profit_loss, date_recorded,
+                                  customer_shipping_charge, platform_fee, platform, total_supplies_cost_for_sale
+                           FROM sale_events WHERE {date_bounds_sql} ORDER BY sale_date DESC, id DESC''', (start_date, end_date))
         events = cursor.fetchall()
+
+        # All items for the range in one query rather than one per event
+        cursor.execute(f'''SELECT id, sale_event_id, inventory_item_id, item_type, original_item_name,
+                                  original_item_details, quantity_sold, sell_price_per_item,
+                                  buy_price_per_item, item_profit_loss
+                           FROM sale_items WHERE {date_bounds_sql} ORDER BY id ASC''', (start_date, end_date))
+        items_by_event = {}
+        for item_row in cursor.fetchall():
+            items_by_event.setdefault(item_row['sale_event_id'], []).append(dict(item_row))
         for event_row in events:
             # event_row is already a DictRow, so direct dictionary conversion is fine
             event_dict = dict(event_row)
@@ -1735,14 +3325,7 @@ def get_all_sale_events_with_items():
                     print(f"Warning: Could not parse date_recorded string: {event_dict.get('date_recorded')}")
                     pass
 
-            # Fetch associated items for this event
-            cursor.execute('''SELECT id, sale_event_id, inventory_item_id, item_type, original_item_name,
-                                     original_item_details, quantity_sold, sell_price_per_item,
-                                     buy_price_per_item, item_profit_loss
-                              FROM sale_items WHERE sale_event_id = %s ORDER BY id ASC''', (event_dict['id'],))
-            items_raw = cursor.fetchall()
-            # Convert item rows to dictionaries
-            event_dict['items'] = [dict(item_row) for item_row in items_raw]
+            event_dict['items'] = items_by_event.get(event_dict['id'], [])
             sale_events_processed.append(event_dict)
 
     except psycopg2.Error as e:
@@ -1755,6 +3338,63 @@ def get_all_sale_events_with_items():
     return sale_events_processed
 
 
+def get_sale_events_page(page=1, per_page=25, date_from=None, date_to=None, filter_text=None):
+    """
+    Returns one page of sale events (newest first) with their items, fetched in two queries.
+
+    :param date_from: Optional 'YYYY-MM-DD' lower bound (inclusive) on sale_date.
+    :param date_to: Optional 'YYYY-MM-DD' upper bound (inclusive) on sale_date.
+    :param filter_text: Optional substring matched against event notes and sold item names.
+    :return: Tuple (list_of_event_dicts, total_count)
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    events = []
+    total_count = 0
+    where_clauses = []
+    where_values = []
+    if date_from:
+        where_clauses.append("sale_date >= %s")
+        where_values.append(date_from)
+    if date_to:
+        where_clauses.append("sale_date <= %s")
+        where_values.append(date_to)
+    if filter_text:
+        search_term = f"%{filter_text.lower()}%"
+        where_clauses.append("""(LOWER(notes) LIKE %s OR EXISTS (SELECT 1 FROM sale_items si
+                                 WHERE si.sale_event_id = sale_events.id AND si.sale_date = sale_events.sale_date
+                                   AND LOWER(si.original_item_name) LIKE %s))""")
+        where_values.extend([search_term, search_term])
+    where_sql = f"WHERE {' AND '.join(where_clauses)}" if where_clauses else ""
+    offset = (max(page, 1) - 1) * per_page
+    try:
+        cursor.execute(f'''SELECT id, sale_date, total_shipping_cost, notes, total_profit_loss, date_recorded,
+                                  customer_shipping_charge, platform_fee, platform, total_supplies_cost_for_sale,
+                                  COUNT(*) OVER() AS total_count
+                           FROM sale_events {where_sql}
+                           ORDER BY sale_date DESC, id DESC LIMIT %s OFFSET %s''', where_values + [per_page, offset])
+        events = [dict(row) for row in cursor.fetchall()]
+        if events:
+            total_count = events[0]['total_count']
+            items_by_event = {event['id']: [] for event in events}
+            # The page's date span bounds sale_items too, so only its years' partitions are read.
+            sale_dates = [event['sale_date'] for event in events]
+            cursor.execute('''SELECT id, sale_event_id, inventory_item_id, item_type, original_item_name,
+                                     original_item_details, quantity_sold, sell_price_per_item,
+                                     buy_price_per_item, item_profit_loss
+                              FROM sale_items WHERE sale_event_id = ANY(%s) AND sale_date BETWEEN %s AND %s
+                              ORDER BY id ASC''', (list(items_by_event), min(sale_dates), max(sale_dates)))
+            for item_row in cursor.fetchall():
+                items_by_event[item_row['sale_event_id']].append(dict(item_row))
+            for event in events:
+                event.pop('total_count', None)
+                event['items'] = items_by_event[event['id']]
+    except psycopg2.Error as e:
+        print(f"DB Error in get_sale_events_page: {e}")
+    finally:
+        cursor.close()
+        conn.close()
+    return events, total_count
 
 
 def add_financial_entry(entry_date, description, category, entry_type, amount, notes):
@@ -1768,6 +3408,7 @@ def add_financial_entry(entry_date, description, category, entry_type, amount, n
         """, (entry_date, description, category, entry_type, amount, notes))
         new_id = cursor.fetchone()[0]
         conn.commit()
+        metrics_cache.invalidate('ledger')
         return new_id
     except psycopg2.Error as e:
         print(f"DB error in add_financial_entry: {e}")
@@ -1777,13 +3418,254 @@ def add_financial_entry(entry_date, description, category, entry_type, amount, n
         cursor.close()
         conn.close()
 
+EMPTY_DASHBOARD_TOTALS = {
+    'num_unique_card_inventory_entries': 0, 'total_single_cards_quantity': 0, 'total_sealed_products_quantity': 0,
+    'total_buy_cost_of_inventory': 0.0, 'total_inventory_market_value': 0.0,
+    'sales_pl': 0.0, 'total_supplies_cost_for_sales': 0.0, 'total_gross_sales': 0.0, 'total_cogs': 0.0,
+    'total_other_income': 0.0, 'total_other_expenses': 0.0,
+}
+
+def get_dashboard_totals():
+    """
+    Computes the dashboard figures with SQL aggregates instead of loading every row.
+    :return: Dict of inventory, sales and ledger totals (0 when empty), or None on a database error
+             (so the metrics cache doesn't keep a zeroed result).
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    totals = dict(EMPTY_DASHBOARD_TOTALS)
+    try:
+        cursor.execute('''SELECT COUNT(*) AS entries, COALESCE(SUM(quantity), 0) AS quantity,
+                                 COALESCE(SUM(quantity * buy_price::float8), 0) AS buy_cost,
+                                 COALESCE(SUM(quantity * (CASE WHEN is_foil = 1 THEN foil_market_price_usd ELSE market_price_usd END)::float8), 0) AS market_value
+                          FROM cards WHERE quantity > 0''')
+        cards = cursor.fetchone()
+        cursor.execute('''SELECT COALESCE(SUM(quantity), 0) AS quantity,
+                                 COALESCE(SUM(quantity * buy_price::float8), 0) AS buy_cost,
+                                 COALESCE(SUM(quantity * manual_market_price::float8), 0) AS market_value
+                          FROM sealed_products WHERE quantity > 0''')
+        sealed = cursor.fetchone()
+        totals['num_unique_card_inventory_entries'] = cards['entries']
+        totals['total_single_cards_quantity'] = cards['quantity']
+        totals['total_sealed_products_quantity'] = sealed['quantity']
+        totals['total_buy_cost_of_inventory'] = cards['buy_cost'] + sealed['buy_cost']
+        totals['total_inventory_market_value'] = cards['market_value'] + sealed['market_value']
+
+        cursor.execute('''SELECT COALESCE(SUM(total_profit_loss::float8), 0) AS sales_pl,
+                                 COALESCE(SUM(total_supplies_cost_for_sale::float8), 0) AS supplies_cost
+                          FROM sale_events''')
+        sales = cursor.fetchone()
+        totals['sales_pl'] = sales['sales_pl']
+        totals['total_supplies_cost_for_sales'] = sales['supplies_cost']
+        cursor.execute('''SELECT COALESCE(SUM(quantity_sold * sell_price_per_item::float8), 0) AS gross_sales,
+                                 COALESCE(SUM(quantity_sold * buy_price_per_item::float8), 0) AS cogs
+                          FROM sale_items''')
+        items = cursor.fetchone()
+        totals['total_gross_sales'] = items['gross_sales']
+        totals['total_cogs'] = items['cogs']
+
+        cursor.execute('''SELECT COALESCE(SUM(amount::float8) FILTER (WHERE entry_type = 'income'), 0) AS income,
+                                 COALESCE(SUM(amount::float8) FILTER (WHERE entry_type = 'expense'), 0) AS expenses
+                          FROM financial_entries''')
+        ledger = cursor.fetchone()
+        totals['total_other_income'] = ledger['income']
+        totals['total_other_expenses'] = ledger['expenses']
+    except psycopg2.Error as e:
+        print(f"DB error in get_dashboard_totals: {e}")
+        totals = None
+    finally:
+        cursor.close()
+        conn.close()
+    return totals
+
+def get_monthly_sales_summary():
+    """
+    Per-month sales P/L, event counts and units sold (cards/sealed), newest month first.
+    :return: List of dicts with year, month, profit_loss, sales_count, single_cards_sold, sealed_products_sold,
+             or None on a database error.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    summary = []
+    try:
+        # Events and items are aggregated separately so joining items doesn't multiply event totals.
+        cursor.execute('''
+            WITH event_months AS (
+                SELECT date_trunc('month', sale_date)::date AS month, COUNT(*) AS sales_count,
+                       COALESCE(SUM(total_profit_loss::float8), 0) AS profit_loss
+                FROM sale_events GROUP BY 1
+            ), item_months AS (
+                SELECT date_trunc('month', se.sale_date)::date AS month,
+                       COALESCE(SUM(si.quantity_sold) FILTER (WHERE si.item_type = 'single_card'), 0) AS single_cards_sold,
+                       COALESCE(SUM(si.quantity_sold) FILTER (WHERE si.item_type = 'sealed_product'), 0) AS sealed_products_sold
+                FROM sale_items si JOIN sale_events se ON se.id = si.sale_event_id GROUP BY 1
+            )
+            SELECT em.month, em.sales_count, em.profit_loss,
+                   COALESCE(im.single_cards_sold, 0) AS single_cards_sold,
+                   COALESCE(im.sealed_products_sold, 0) AS sealed_products_sold
+            FROM event_months em LEFT JOIN item_months im USING (month)
+            ORDER BY em.month DESC
+        ''')
+        for row in cursor.fetchall():
+            summary.append({
+                'year': row['month'].year, 'month': row['month'].month,
+                'profit_loss': row['profit_loss'], 'sales_count': row['sales_count'],
+                'single_cards_sold': int(row['single_cards_sold']), 'sealed_products_sold': int(row['sealed_products_sold']),
+            })
+    except psycopg2.Error as e:
+        print(f"DB error in get_monthly_sales_summary: {e}")
+        summary = None
+    finally:
+        cursor.close()
+        conn.close()
+    return summary
+
+def get_sales_summary_between(start_date, end_date=None):
+    """
+    Sales P/L, event count and units sold (cards/sealed) for sale dates from start_date through end_date
+    (inclusive; open-ended if None). Both tables are bounded on sale_date, so only the yearly partitions
+    covering the range are read; the dashboard's current month and year don't grow with history.
+    :return: Dict with profit_loss, sales_count, single_cards_sold, sealed_products_sold, or None on a database error.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    try:
+        cursor.execute('''
+            WITH events AS (
+                SELECT COUNT(*) AS sales_count, COALESCE(SUM(total_profit_loss::float8), 0) AS profit_loss
+                FROM sale_events WHERE sale_date >= %s AND sale_date <= COALESCE(%s::date, 'infinity')
+            ), items AS (
+                SELECT COALESCE(SUM(quantity_sold) FILTER (WHERE item_type = 'single_card'), 0) AS single_cards_sold,
+                       COALESCE(SUM(quantity_sold) FILTER (WHERE item_type = 'sealed_product'), 0) AS sealed_products_sold
+                FROM sale_items WHERE sale_date >= %s AND sale_date <= COALESCE(%s::date, 'infinity')
+            )
+            SELECT * FROM events, items
+        ''', (start_date, end_date, start_date, end_date))
+        row = cursor.fetchone()
+        return {'profit_loss': row['profit_loss'], 'sales_count': row['sales_count'],
+                'single_cards_sold': int(row['single_cards_sold']), 'sealed_products_sold': int(row['sealed_products_sold'])}
+    except psycopg2.Error as e:
+        print(f"DB error in get_sales_summary_between: {e}")
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+def get_pl_report(report_query):
+    """
+    Runs a P/L report built by reports.compile_pl_report().
+
+    :param report_query: Tuple (sql, params).
+    :return: List of dict rows, or None on a database error.
+    """
+    sql, params = report_query
+    conn = get_db_connection()
+    cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    try:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+    except psycopg2.Error as e:
+        print(f"DB error in get_pl_report: {e}")
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+
+# --- Valuation Snapshots ---
+# A daily copy of the inventory totals (cards and sealed products in stock), overall and broken
+# down by VALUATION_DIMENSIONS, so value-over-time charts and period comparisons read a few
+# precomputed rows instead of the inventory. Taken nightly by snapshot_valuation.py or on demand
+# from the dashboard; taking one again on the same day replaces that day's rows.
+
+VALUATION_DIMENSIONS = ['item_type', 'location', 'set', 'rarity', 'product_type']
+
+def take_valuation_snapshot():
+    """
+    Aggregates the current stock with GROUPING SETS (one pass for the total and every dimension)
+    into today's valuation_snapshots rows.
+    Returns a tuple: (success_boolean, message_string, rows_written)
+    """
+    stock_selects = " UNION ALL ".join(f"{_INVENTORY_UNION_SELECTS[table_name]} WHERE {QUANTITY_COLUMNS[table_name]} > 0"
+                                       for table_name in ('cards', 'sealed_products'))
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("DELETE FROM valuation_snapshots WHERE snapshot_date = CURRENT_DATE")
+        # rarity_key / product_type_key are NULL for the other item type, so HAVING drops those groups.
+        cursor.execute(f"""
+            INSERT INTO valuation_snapshots (snapshot_date, dimension, dimension_value, item_count,
+                                             total_quantity, total_buy_cost, total_market_value)
+            SELECT CURRENT_DATE,
+                   CASE WHEN GROUPING(item_type) = 0 THEN 'item_type'
+                        WHEN GROUPING(location_key) = 0 THEN 'location'
+                        WHEN GROUPING(set_key) = 0 THEN 'set'
+                        WHEN GROUPING(rarity_key) = 0 THEN 'rarity'
+                        WHEN GROUPING(product_type_key) = 0 THEN 'product_type'
+                        ELSE 'total' END,
+                   COALESCE(item_type, location_key, set_key, rarity_key, product_type_key, ''),
+                   COUNT(*), COALESCE(SUM(quantity), 0),
+                   COALESCE(SUM(quantity * buy_price::float8), 0),
+                   COALESCE(SUM(quantity * current_market_price::float8), 0)
+            FROM (
+                SELECT item_type, COALESCE(location, '') AS location_key, COALESCE(LOWER(set_code), set_name, '') AS set_key,
+                       CASE WHEN item_type = 'single_card' THEN COALESCE(LOWER(rarity), '') END AS rarity_key,
+                       CASE WHEN item_type = 'sealed_product' THEN COALESCE(product_type, '') END AS product_type_key,
+                       quantity, buy_price, current_market_price
+                FROM ({stock_selects}) inventory
+            ) stock
+            GROUP BY GROUPING SETS ((), (item_type), (location_key), (set_key), (rarity_key), (product_type_key))
+            HAVING NOT (GROUPING(rarity_key) = 0 AND rarity_key IS NULL)
+               AND NOT (GROUPING(product_type_key) = 0 AND product_type_key IS NULL)
+        """)
+        rows_written = cursor.rowcount
+        conn.commit()
+        return True, f"Valuation snapshot saved ({rows_written} rows).", rows_written
+    except psycopg2.Error as e:
+        print(f"DB error in take_valuation_snapshot: {e}")
+        conn.rollback()
+        return False, f"Database error: {e}", 0
+    finally:
+        cursor.close()
+        conn.close()
+
+def get_valuation_history(dimension='total', dimension_value=None, start_date=None, end_date=None):
+    """
+    Reads snapshot rows for a value-over-time series.
+
+    :param dimension: 'total' or one of VALUATION_DIMENSIONS.
+    :param dimension_value: Limit to one value of the dimension (e.g. a location); None for all of them.
+    :param start_date: Optional first snapshot date, inclusive; end_date likewise.
+    :return: List of dicts (snapshot_date, dimension_value, item_count, total_quantity, total_buy_cost,
+             total_market_value) ordered by date then value; None on a database error.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    try:
+        cursor.execute(
+            """SELECT snapshot_date, dimension_value, item_count, total_quantity, total_buy_cost, total_market_value
+               FROM valuation_snapshots
+               WHERE dimension = %s AND (%s::text IS NULL OR dimension_value = %s)
+                 AND snapshot_date >= COALESCE(%s::date, '-infinity') AND snapshot_date <= COALESCE(%s::date, 'infinity')
+               ORDER BY snapshot_date, dimension_value""",
+            (dimension, dimension_value, dimension_value, start_date, end_date)
+        )
+        return cursor.fetchall()
+    except psycopg2.Error as e:
+        print(f"DB error in get_valuation_history: {e}")
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+
 def get_all_financial_entries():
     """Retrieves all financial entries, ordered by date."""
     conn = get_db_connection()
     cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
     entries = []
     try:
-        cursor.execute("SELECT * FROM financial_entries ORDER BY entry_date DESC, id DESC")
+        cursor.execute(ALL_FINANCIAL_ENTRIES_SQL)
         entries = cursor.fetchall()
     except psycopg2.Error as e:
         print(f"DB error in get_all_financial_entries: {e}")
@@ -1800,6 +3682,7 @@ def delete_financial_entry(entry_id):
     try:
         cursor.execute("DELETE FROM financial_entries WHERE id = %s", (entry_id,))
         conn.commit()
+        metrics_cache.invalidate('ledger')
         deleted = cursor.rowcount > 0
     except psycopg2.Error as e:
         print(f"DB error in delete_financial_entry for ID {entry_id}: {e}")
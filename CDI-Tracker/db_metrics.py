@@ -0,0 +1,179 @@
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+# --- Per-request database instrumentation ---
+# database.get_db_connection() hands out connections whose cursors report every statement
+# here. app.py starts a fresh RequestStats before each request and reports it afterwards
+# (response headers + one log line), so query counts and N+1 loops are visible per page.
+
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 200))
+QUERY_COUNT_WARNING = int(os.environ.get('DB_QUERY_COUNT_WARNING', 50))
+LOG_REQUESTS = os.environ.get('DB_METRICS_LOG', '1') == '1'
+SLOWEST_STATEMENTS_KEPT = 5
+
+logger = logging.getLogger('cdi_tracker.db')
+if not logger.handlers:
+    _handler = logging.StreamHandler(sys.stdout)
+    _handler.setFormatter(logging.Formatter('[db] %(message)s'))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+_local = threading.local()
+_instrumented_cursor_classes = {}
+
+_STRING_LITERAL_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL_RE = re.compile(r"\b\d+(?:\.\d+)?\b")
+_WHITESPACE_RE = re.compile(r"\s+")
+_IN_LIST_RE = re.compile(r"\(\s*(?:\?\s*,\s*)+\?\s*\)")
+
+
+class RequestStats:
+    """Database activity collected while serving one request."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.query_count = 0
+        self.query_time = 0.0
+        self.connection_count = 0
+        self.connection_time = 0.0
+        self.slowest = []  # (duration, normalized_sql, params_shape), longest first
+        self.statement_counts = Counter()
+
+    def most_repeated_statement(self):
+        if not self.statement_counts:
+            return None, 0
+        return self.statement_counts.most_common(1)[0]
+
+    def summary_line(self, method, path, status_code):
+        total_ms = (time.perf_counter() - self.started) * 1000
+        line = (f"{method} {path} -> {status_code} in {total_ms:.1f}ms | {self.query_count} queries "
+                f"{self.query_time * 1000:.1f}ms | {self.connection_count} connections "
+                f"{self.connection_time * 1000:.1f}ms")
+        if self.slowest:
+            duration, sql, _ = self.slowest[0]
+            line += f" | slowest {duration * 1000:.1f}ms: {sql[:120]}"
+        return line
+
+
+def start_request():
+    _local.stats = RequestStats()
+
+def finish_request():
+    stats = getattr(_local, 'stats', None)
+    _local.stats = None
+    return stats
+
+def current_stats():
+    return getattr(_local, 'stats', None)
+
+
+def normalize_sql(sql):
+    """Collapses whitespace and replaces literals/placeholders with '?' so similar statements group together."""
+    if isinstance(sql, bytes):
+        sql = sql.decode('utf-8', errors='replace')
+    sql = str(sql).replace('%s', '?')
+    sql = _STRING_LITERAL_RE.sub('?', sql)
+    sql = _NUMBER_LITERAL_RE.sub('?', sql)
+    sql = _WHITESPACE_RE.sub(' ', sql).strip()
+    return _IN_LIST_RE.sub('(?...)', sql)
+
+def params_shape(params):
+    """Describes parameter types without logging their values, e.g. '(int, str, float)'."""
+    if params is None:
+        return '()'
+    if isinstance(params, dict):
+        return '{' + ', '.join(f"{key}: {type(value).__name__}" for key, value in params.items()) + '}'
+    if isinstance(params, (list, tuple)):
+        parts = []
+        for value in params:
+            if isinstance(value, (list, tuple)):
+                parts.append(f"{type(value).__name__}[{len(value)}]")
+            else:
+                parts.append(type(value).__name__)
+        return '(' + ', '.join(parts) + ')'
+    return type(params).__name__
+
+
+def record_connection(duration):
+    stats = current_stats()
+    if stats is not None:
+        stats.connection_count += 1
+        stats.connection_time += duration
+
+def record_query(sql, params, duration):
+    duration_ms = duration * 1000
+    stats = current_stats()
+    if stats is None and duration_ms < SLOW_QUERY_MS:
+        return
+    normalized = normalize_sql(sql)
+    if duration_ms >= SLOW_QUERY_MS:
+        logger.warning(f"SLOW QUERY {duration_ms:.1f}ms: {normalized} params={params_shape(params)}")
+    if stats is None:
+        return
+    stats.query_count += 1
+    stats.query_time += duration
+    stats.statement_counts[normalized] += 1
+    if len(stats.slowest) < SLOWEST_STATEMENTS_KEPT or duration > stats.slowest[-1][0]:
+        stats.slowest.append((duration, normalized, params_shape(params)))
+        stats.slowest.sort(key=lambda entry: entry[0], reverse=True)
+        del stats.slowest[SLOWEST_STATEMENTS_KEPT:]
+
+
+def instrumented_cursor_class(base_cursor_class):
+    """Returns a subclass of `base_cursor_class` (plain, DictCursor, ...) that times every statement."""
+    cursor_class = _instrumented_cursor_classes.get(base_cursor_class)
+    if cursor_class is not None:
+        return cursor_class
+
+    class InstrumentedCursor(base_cursor_class):
+        def execute(self, query, vars=None):
+            started = time.perf_counter()
+            try:
+                return super().execute(query, vars)
+            finally:
+                record_query(query, vars, time.perf_counter() - started)
+
+        def executemany(self, query, vars_list):
+            started = time.perf_counter()
+            try:
+                return super().executemany(query, vars_list)
+            finally:
+                record_query(query, None, time.perf_counter() - started)
+
+        def copy_expert(self, sql, file, size=8192):
+            started = time.perf_counter()
+            try:
+                return super().copy_expert(sql, file, size)
+            finally:
+                record_query(sql, None, time.perf_counter() - started)
+
+    InstrumentedCursor.__name__ = f"Instrumented{base_cursor_class.__name__}"
+    _instrumented_cursor_classes[base_cursor_class] = InstrumentedCursor
+    return InstrumentedCursor
+
+
+def log_request(stats, method, path, status_code):
+    if stats is None:
+        return
+    if LOG_REQUESTS:
+        logger.info(stats.summary_line(method, path, status_code))
+    if stats.query_count >= QUERY_COUNT_WARNING:
+        statement, repeats = stats.most_repeated_statement()
+        logger.warning(f"{method} {path} ran {stats.query_count} queries (possible N+1); "
+                       f"most repeated x{repeats}: {statement[:200]}")
+
+def apply_response_headers(stats, response):
+    if stats is None:
+        return response
+    response.headers['X-DB-Query-Count'] = str(stats.query_count)
+    response.headers['X-DB-Time-Ms'] = f"{stats.query_time * 1000:.1f}"
+    response.headers['X-DB-Connections'] = str(stats.connection_count)
+    response.headers['Server-Timing'] = (f'db;dur={stats.query_time * 1000:.1f};desc="{stats.query_count} queries", '
+                                         f'dbconnect;dur={stats.connection_time * 1000:.1f}')
+    return response
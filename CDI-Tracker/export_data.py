@@ -0,0 +1,52 @@
+import argparse
+import datetime
+import sys
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+import exports
+
+# Command-line counterpart of the /export route: streams one dataset to a file (or stdout) as CSV
+# or JSON Lines through a server-side cursor, so even very large tables export in constant memory.
+#   python export_data.py cards --format csv --filter filter_location="Box 3"
+#   python export_data.py sales --format jsonl --start-date 2024-01-01 --output sales_2024.jsonl
+
+
+def _parse_filter(text):
+    key, separator, value = text.partition('=')
+    if not separator:
+        raise argparse.ArgumentTypeError(f"Filter '{text}' must look like key=value (e.g. filter_set=mh3)")
+    return key.strip(), value.strip()
+
+def export_to(dataset, export_format, filters, output):
+    """Writes the export to the binary file object `output`. Returns the number of bytes written."""
+    bytes_written = 0
+    for chunk in exports.generate_export(dataset, export_format, filters):
+        output.write(chunk)
+        bytes_written += len(chunk)
+    return bytes_written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export inventory, sales or the ledger as CSV or JSON Lines.")
+    parser.add_argument('dataset', choices=exports.EXPORT_DATASETS, help="What to export")
+    parser.add_argument('--format', dest='export_format', choices=list(exports.EXPORT_FORMATS), default='csv', help="Output format (default: csv)")
+    parser.add_argument('--output', '-o', help="Output file (default: cdi_<dataset>_<date>.<format>; '-' for stdout)")
+    parser.add_argument('--filter', action='append', type=_parse_filter, default=[], metavar='KEY=VALUE',
+                        help="Inventory tab filter, e.g. filter_text=bolt or filter_foil=yes (repeatable)")
+    parser.add_argument('--start-date', type=datetime.date.fromisoformat, help="First sale/ledger date to include, YYYY-MM-DD")
+    parser.add_argument('--end-date', type=datetime.date.fromisoformat, help="Last sale/ledger date to include, YYYY-MM-DD")
+    args = parser.parse_args()
+
+    filters = dict(args.filter)
+    filters['start_date'], filters['end_date'] = args.start_date, args.end_date
+    started = datetime.datetime.now()
+    if args.output == '-':
+        bytes_written = export_to(args.dataset, args.export_format, filters, sys.stdout.buffer)
+    else:
+        output_path = args.output or exports.export_filename(args.dataset, args.export_format, datetime.date.today())
+        with open(output_path, 'wb') as output:
+            bytes_written = export_to(args.dataset, args.export_format, filters, output)
+        print(f"Wrote {bytes_written:,} bytes to {output_path} in {(datetime.datetime.now() - started).total_seconds():.1f}s.")
@@ -0,0 +1,77 @@
+import csv
+import io
+import json
+
+import database
+import json_provider
+
+# --- Streaming exports ---
+# Turns database.iter_export_rows() into CSV or JSON Lines output without building the file in
+# memory: rows are encoded as they arrive from the server-side cursor and handed out in
+# EXPORT_CHUNK_BYTES pieces, which the /export route sends as a chunked response and
+# export_data.py writes to a file.
+
+EXPORT_CHUNK_BYTES = 64 * 1024
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+EXPORT_DATASETS = list(database.EXPORT_COLUMNS)
+
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return value
+
+def _iter_csv(rows, columns):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for row in rows:
+        writer.writerow([_csv_value(value) for value in row])
+        if buffer.tell() >= EXPORT_CHUNK_BYTES:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+def _iter_jsonl(rows, columns):
+    if json_provider.orjson is not None:
+        encode = lambda record: json_provider.orjson.dumps(record, default=json_provider._default)
+    else:
+        encode = lambda record: json.dumps(record, default=json_provider._default, separators=(',', ':')).encode('utf-8')
+    chunk, chunk_size = [], 0
+    for row in rows:
+        line = encode(dict(zip(columns, row))) + b'\n'
+        chunk.append(line)
+        chunk_size += len(line)
+        if chunk_size >= EXPORT_CHUNK_BYTES:
+            yield b''.join(chunk)
+            chunk, chunk_size = [], 0
+    if chunk:
+        yield b''.join(chunk)
+
+
+def generate_export(dataset, export_format, filters):
+    """
+    Streams one dataset as encoded bytes.
+
+    :param dataset: One of EXPORT_DATASETS.
+    :param export_format: 'csv' or 'jsonl'.
+    :param filters: See database.iter_export_rows.
+    :return: Generator of byte strings of about EXPORT_CHUNK_BYTES each.
+    :raises ValueError: For an unknown dataset or format (before any query runs).
+    """
+    if dataset not in database.EXPORT_COLUMNS:
+        raise ValueError(f"Unknown export dataset '{dataset}'. Choose from: {', '.join(EXPORT_DATASETS)}.")
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format '{export_format}'. Choose from: {', '.join(EXPORT_FORMATS)}.")
+    columns = database.EXPORT_COLUMNS[dataset]
+    rows = database.iter_export_rows(dataset, filters)
+    return _iter_csv(rows, columns) if export_format == 'csv' else _iter_jsonl(rows, columns)
+
+def export_filename(dataset, export_format, today):
+    return f"cdi_{dataset}_{today.isoformat()}.{export_format}"
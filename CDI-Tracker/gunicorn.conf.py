@@ -0,0 +1,50 @@
+import multiprocessing
+import os
+
+# --- gunicorn settings (used by render.yaml: `gunicorn -c gunicorn.conf.py wsgi:app`) ---
+# Each worker is a separate process with WEB_THREADS threads, so one slow Scryfall lookup or
+# CSV import ties up a single thread instead of the whole site. All values can be overridden
+# through the environment without a code change.
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 10000)}"
+workers = int(os.environ.get('WEB_CONCURRENCY', min(multiprocessing.cpu_count() * 2 + 1, 4)))
+worker_class = 'gthread'
+threads = int(os.environ.get('WEB_THREADS', 4))
+
+# Import the app once in the master and fork it into workers: faster boots, shared read-only memory.
+preload_app = True
+
+timeout = int(os.environ.get('WEB_TIMEOUT', 60))  # A worker silent this long is killed and replaced.
+graceful_timeout = int(os.environ.get('WEB_GRACEFUL_TIMEOUT', 30))  # In-flight requests get this long on restart/deploy (SIGHUP/SIGTERM).
+keepalive = 5
+
+# Recycle workers periodically so slow leaks can't accumulate; jitter keeps them from restarting together.
+max_requests = int(os.environ.get('WEB_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.environ.get('WEB_MAX_REQUESTS_JITTER', 100))
+
+accesslog = '-'
+errorlog = '-'
+loglevel = os.environ.get('WEB_LOG_LEVEL', 'info')
+
+
+def pre_fork(server, worker):
+    # Anything the master opened while preloading must not be inherited by a worker:
+    # two processes talking over one socket corrupt both sessions.
+    import database
+    database.close_pool()
+
+def post_fork(server, worker):
+    import database
+    import import_jobs
+    import metrics_cache
+    import scryfall
+    database.close_pool()  # Forgets (without closing) anything still inherited from the master.
+    import_jobs.reset_connection()
+    metrics_cache.reset_connection()
+    scryfall.reset_session()
+    server.log.info(f"Worker {worker.pid} ready ({threads} threads, DB pool {database.DB_POOL_SIZE}).")
+
+def worker_exit(server, worker):
+    # Background CSV imports run on daemon threads of this worker and end with it (recycling, deploys).
+    import import_jobs
+    import_jobs.abandon_thread_jobs()
@@ -0,0 +1,286 @@
+import datetime
+import json
+import os
+import tempfile
+import threading
+import traceback
+import uuid
+
+import psycopg2
+
+try:
+    import redis
+except ImportError:  # Redis is optional; job state falls back to the import_jobs table.
+    redis = None
+
+try:
+    import rq
+except ImportError:  # RQ is optional; imports then run on a background thread in the web process.
+    rq = None
+
+import csv_import
+import database
+
+# --- Background CSV import jobs ---
+# POST /import_csv stores the upload as a job and returns at once. The job runs in one of two places:
+#   * IMPORT_USE_RQ=1 with REDIS_URL set: enqueued on the RQ queue IMPORT_QUEUE_NAME and run by a
+#     separate `rq worker cdi-imports` process, so imports never use web threads at all.
+#   * Otherwise: on a daemon thread in the web process. At most IMPORT_MAX_CONCURRENT of these run
+#     per process (the rest wait as 'queued'), and at most IMPORT_MAX_PENDING may be waiting or
+#     running before new submissions are refused, so imports can't starve interactive requests.
+# Job state (status, counts, per-row errors, summary) lives in Redis when REDIS_URL is set, otherwise
+# in the import_jobs table, so any worker can report on any job either way. If that store can't be
+# read or written (Redis down with REDIS_URL set, or a database error), the submission or status
+# request fails with ImportStateUnavailable instead of switching stores, so a job's state is never
+# split between the two; a running job keeps importing and only loses that progress update.
+# A thread-backed job dies with its process when gunicorn recycles or kills the worker. The worker's
+# exit hook marks its jobs failed (abandon_thread_jobs), and as a backstop each job's thread sends a
+# heartbeat every IMPORT_HEARTBEAT_SECONDS: get_job reports an unfinished job whose heartbeat is
+# older than IMPORT_STALE_SECONDS as failed. Uploading the same file again resumes from its checkpoints.
+# Uploads are spooled to IMPORT_SPOOL_DIR and the job streams the file from there, deleting it when
+# done; the web process never holds a whole CSV in memory. RQ workers must see the same directory.
+
+REDIS_URL = os.environ.get('REDIS_URL')
+IMPORT_USE_RQ = os.environ.get('IMPORT_USE_RQ') == '1'
+IMPORT_QUEUE_NAME = 'cdi-imports'
+IMPORT_MAX_CONCURRENT = int(os.environ.get('IMPORT_MAX_CONCURRENT', 1))
+IMPORT_MAX_PENDING = int(os.environ.get('IMPORT_MAX_PENDING', 5))
+IMPORT_JOB_TIMEOUT_SECONDS = int(os.environ.get('IMPORT_JOB_TIMEOUT', 2 * 60 * 60))
+JOB_TTL_SECONDS = 24 * 60 * 60
+IMPORT_HEARTBEAT_SECONDS = 30
+IMPORT_STALE_SECONDS = int(os.environ.get('IMPORT_STALE_SECONDS', 120))
+MAX_STORED_ERRORS = 500  # Beyond this only error_count keeps growing.
+IMPORT_SPOOL_DIR = os.environ.get('IMPORT_SPOOL_DIR', os.path.join(tempfile.gettempdir(), 'cdi-imports'))
+
+JOB_KEY_PREFIX = 'cdi:import:'
+FINAL_STATUSES = ('finished', 'failed')
+INTERRUPTED_SUMMARY = ("The import stopped before finishing because the web worker running it was restarted. "
+                       "Upload the same file again to continue where it stopped.")
+
+_lock = threading.Lock()
+_thread_slots = threading.BoundedSemaphore(IMPORT_MAX_CONCURRENT)
+_pending_thread_jobs = 0
+_active_thread_jobs = set()  # Ids of the thread-backed jobs this process has started and not yet finished.
+_redis_client = None
+
+
+class ImportQueueFull(Exception):
+    """Too many imports are already waiting or running in this process."""
+
+class ImportStateUnavailable(Exception):
+    """The job state store (Redis, or the import_jobs table) could not be read or written."""
+
+
+# Errors from the state store that become ImportStateUnavailable.
+_STATE_ERRORS = (psycopg2.Error,) + ((redis.RedisError,) if redis is not None else ())
+
+
+def _get_redis():
+    global _redis_client
+    if not REDIS_URL or redis is None:
+        return None
+    if _redis_client is None:
+        _redis_client = redis.Redis.from_url(REDIS_URL, socket_timeout=5, socket_connect_timeout=2)
+    return _redis_client
+
+def reset_connection():
+    """Drops the Redis client so a forked worker opens its own connection."""
+    global _redis_client
+    _redis_client = None
+
+
+def _now():
+    return datetime.datetime.now().isoformat(timespec='seconds')
+
+def _save(job):
+    """:raises ImportStateUnavailable: If the state could not be stored."""
+    job['updated_at'] = _now()
+    try:
+        client = _get_redis()
+        if client is not None:
+            client.set(JOB_KEY_PREFIX + job['id'], json.dumps(job), ex=JOB_TTL_SECONDS)
+            return
+        saved = database.save_import_job(job)
+    except _STATE_ERRORS as e:
+        raise ImportStateUnavailable(f"Import job state could not be saved: {e}") from e
+    if not saved:
+        raise ImportStateUnavailable("Import job state could not be saved to the database.")
+
+def _load(job_id):
+    """
+    Returns (job state dict or None, whether the job's heartbeat is recent).
+
+    :raises ImportStateUnavailable: If Redis can't be read, or the database can't be reached.
+    """
+    try:
+        client = _get_redis()
+        if client is not None:
+            raw, alive = client.mget([JOB_KEY_PREFIX + job_id, JOB_KEY_PREFIX + job_id + ':alive'])
+            return (json.loads(raw) if raw else None), alive is not None
+        stored = database.get_import_job(job_id)
+    except _STATE_ERRORS as e:
+        raise ImportStateUnavailable(f"Import job state could not be read: {e}") from e
+    if stored is None:
+        return None, False
+    job, idle_seconds = stored
+    return job, idle_seconds < IMPORT_STALE_SECONDS
+
+def _heartbeat(job_id):
+    client = _get_redis()
+    if client is not None:
+        client.set(JOB_KEY_PREFIX + job_id + ':alive', 1, ex=IMPORT_STALE_SECONDS)
+    else:
+        database.touch_import_job(job_id)
+
+def _heartbeat_until(job_id, stop):
+    while True:
+        try:
+            _heartbeat(job_id)
+        except Exception as e:  # A missed beat only risks a false "interrupted"; keep trying.
+            print(f"Import job {job_id}: heartbeat failed ({e}).")
+        if stop.wait(IMPORT_HEARTBEAT_SECONDS):
+            return
+
+def get_job(job_id):
+    """
+    Returns the job's state dict, or None if the id is unknown or expired.
+
+    :raises ImportStateUnavailable: If the state store can't be reached.
+    """
+    job, alive = _load(job_id)
+    if job and job['backend'] == 'thread' and job['status'] not in FINAL_STATUSES and not alive:
+        # Its thread stopped beating without finishing: the process running it is gone.
+        job.update(status='failed', summary=INTERRUPTED_SUMMARY, finished_at=_now())
+        _save(job)
+    return job
+
+def _update(job_id, new_errors=None, **fields):
+    job = get_job(job_id)
+    if job is None:
+        return None
+    job.update(fields)
+    if new_errors:
+        job['error_count'] += len(new_errors)
+        room = MAX_STORED_ERRORS - len(job['errors'])
+        if room > 0:
+            job['errors'].extend(new_errors[:room])
+    _save(job)
+    return job
+
+
+def _spool_upload(upload, job_id):
+    """Writes the uploaded file to IMPORT_SPOOL_DIR in blocks and returns its path."""
+    os.makedirs(IMPORT_SPOOL_DIR, exist_ok=True)
+    path = os.path.join(IMPORT_SPOOL_DIR, f"{job_id}.csv")
+    upload.save(path)
+    return path
+
+def submit_import(upload, options):
+    """
+    Spools the upload to disk, creates an import job and starts (or enqueues) it.
+
+    :param upload: werkzeug FileStorage from the request.
+    :param options: Dict with default_buy_price, default_location, default_asking_price,
+                    default_language, default_condition, assume_non_foil and restart_import.
+    :return: The job id.
+    :raises ImportQueueFull: When IMPORT_MAX_PENDING thread-backed imports are already pending.
+    :raises ImportStateUnavailable: When the job could not be recorded or enqueued; nothing is left behind.
+    :raises OSError: When the upload could not be spooled.
+    """
+    global _pending_thread_jobs
+    use_rq = IMPORT_USE_RQ and rq is not None and _get_redis() is not None
+    if not use_rq:
+        with _lock:
+            if _pending_thread_jobs >= IMPORT_MAX_PENDING:
+                raise ImportQueueFull(f"{IMPORT_MAX_PENDING} imports are already queued or running; try again when one finishes.")
+            _pending_thread_jobs += 1
+
+    job = {
+        'id': uuid.uuid4().hex, 'filename': upload.filename, 'status': 'queued', 'backend': 'rq' if use_rq else 'thread',
+        'bytes_read': 0, 'bytes_total': 0, 'rows_read': 0, 'stacks_done': 0, 'imported': 0, 'failed': 0, 'skipped': 0,
+        'resumed': 0, 'content_hash': None, 'errors': [], 'error_count': 0, 'summary': None, 'created_at': _now(), 'finished_at': None,
+    }
+    path = None
+    try:
+        path = _spool_upload(upload, job['id'])
+        job['bytes_total'] = os.path.getsize(path)
+        if _get_redis() is None:
+            database.prune_import_jobs(JOB_TTL_SECONDS)  # Redis expires its keys itself.
+        _save(job)
+        if use_rq:
+            queue = rq.Queue(IMPORT_QUEUE_NAME, connection=_get_redis())
+            queue.enqueue(run_import_job, job['id'], path, options,
+                          job_timeout=IMPORT_JOB_TIMEOUT_SECONDS, result_ttl=JOB_TTL_SECONDS)
+        else:
+            _heartbeat(job['id'])  # Alive from the start, before its thread gets going.
+            threading.Thread(target=_run_on_thread, args=(job['id'], path, options),
+                             name=f"csv-import-{job['id'][:8]}", daemon=True).start()
+    except Exception as e:
+        # Nothing will run this job: give back its slot and drop the spooled file.
+        if not use_rq:
+            with _lock:
+                _pending_thread_jobs -= 1
+        if path:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        if isinstance(e, _STATE_ERRORS):
+            raise ImportStateUnavailable(f"Import could not be started: {e}") from e
+        raise
+    return job['id']
+
+def _run_on_thread(job_id, path, options):
+    global _pending_thread_jobs
+    with _lock:
+        _active_thread_jobs.add(job_id)
+    stop_heartbeat = threading.Event()
+    threading.Thread(target=_heartbeat_until, args=(job_id, stop_heartbeat),
+                     name=f"csv-import-heartbeat-{job_id[:8]}", daemon=True).start()
+    try:
+        with _thread_slots:
+            run_import_job(job_id, path, options)
+    finally:
+        stop_heartbeat.set()
+        with _lock:
+            _pending_thread_jobs -= 1
+            _active_thread_jobs.discard(job_id)
+
+def abandon_thread_jobs():
+    """
+    Marks the unfinished thread-backed jobs of this process as failed. gunicorn calls this as a worker
+    exits, since the daemon threads running them are about to die with it.
+    """
+    with _lock:
+        job_ids = list(_active_thread_jobs)
+    for job_id in job_ids:
+        try:
+            job = get_job(job_id)
+            if job and job['status'] not in FINAL_STATUSES:
+                _update(job_id, status='failed', summary=INTERRUPTED_SUMMARY, finished_at=_now())
+        except ImportStateUnavailable as e:
+            print(f"Import job {job_id}: could not be marked interrupted ({e}).")
+
+def _record(job_id, **fields):
+    """_update for the running job: a state store outage loses this update but doesn't stop the import."""
+    try:
+        _update(job_id, **fields)
+    except ImportStateUnavailable as e:
+        print(f"Import job {job_id}: update not saved ({e}).")
+
+def run_import_job(job_id, path, options):
+    """Job body (the RQ task, or the thread target). Records progress and the final outcome on the job."""
+    _record(job_id, status='running')
+    try:
+        result = csv_import.run_import(path, options, lambda **progress: _record(job_id, **progress), import_id=job_id)
+        _record(job_id, status='finished', summary=result['summary'], finished_at=_now())
+    except csv_import.CsvImportError as e:
+        _record(job_id, status='failed', summary=str(e), finished_at=_now())
+    except Exception as e:
+        traceback.print_exc()
+        _record(job_id, status='failed', summary=f"Critical error processing CSV file: {e}", finished_at=_now())
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
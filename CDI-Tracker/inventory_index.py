@@ -0,0 +1,319 @@
+import os
+import threading
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional; without it the inventory tab is filtered, sorted and totalled in SQL.
+    np = None
+
+import database
+
+# --- Columnar inventory index ---
+# A process-local, column-oriented snapshot of every in-stock card, sealed product and supply batch:
+# numpy arrays for quantities, prices and flags, and dictionary-encoded text columns (an int32 code
+# per row into a list of distinct values). The inventory tab's filters become boolean masks (a text
+# filter is tested once per distinct value, then mapped over the codes), sorts become one lexsort,
+# and only the requested page is turned back into row dicts.
+# Freshness: each use compares the table_versions counters with the snapshot's; after a write, only
+# rows whose database-assigned row_version shows they were committed since the snapshot's read are
+# fetched again (see database.get_inventory_index_changes), and rows whose id is no longer in stock
+# are dropped. Set INVENTORY_INDEX=0 (or don't install numpy) to keep everything in SQL. Text
+# ordering is Python's lower-cased ordering, which can differ from the database collation for punctuation.
+
+INVENTORY_INDEX_ENABLED = os.environ.get('INVENTORY_INDEX', '1') == '1'
+INDEX_TABLES = ('cards', 'sealed_products', 'shipping_supplies_inventory')
+
+ITEM_TYPES = ('single_card', 'sealed_product', 'shipping_supply')  # Position = type code.
+ITEM_TYPE_SORT_RANK = [sorted(ITEM_TYPES).index(item_type) for item_type in ITEM_TYPES]  # SQL orders item_type as text.
+NUMERIC_COLUMNS = ('quantity', 'buy_price', 'sell_price', 'current_market_price')
+FLAG_COLUMNS = ('is_foil', 'is_collectors_item')
+TEXT_COLUMNS = ('display_name', 'location', 'set_code', 'collector_number', 'rarity', 'language', 'condition',
+                'set_name', 'product_type', 'description', 'unit_of_measure')
+OBJECT_COLUMNS = ('image_uri', 'purchase_date')
+
+# Per item type, the columns filter_text searches (as in database._inventory_where_clauses).
+TEXT_SEARCH_COLUMNS = {
+    'single_card': ('display_name', 'set_code', 'location', 'collector_number', 'rarity', 'language'),
+    'sealed_product': ('display_name', 'set_name', 'location', 'product_type', 'language'),
+    'shipping_supply': ('display_name', 'description', 'location', 'unit_of_measure'),
+}
+# filter key -> {item type it applies to: column compared case-insensitively}
+EQUALS_FILTERS = {
+    'filter_set': {'single_card': 'set_code', 'sealed_product': 'set_name'},
+    'filter_rarity': {'single_card': 'rarity'},
+    'filter_card_lang': {'single_card': 'language'},
+    'filter_condition': {'single_card': 'condition'},
+    'filter_sealed_lang': {'sealed_product': 'language'},
+}
+SEARCHED_COLUMNS = sorted(set().union(*TEXT_SEARCH_COLUMNS.values()))
+FLAG_FILTERS = {'filter_foil': ('single_card', 'is_foil'), 'filter_collector': ('sealed_product', 'is_collectors_item')}
+ITEM_SPECIFIC_FILTER_KEYS = list(EQUALS_FILTERS) + list(FLAG_FILTERS)
+
+# Sort keys of database.INVENTORY_SORT_EXPRESSIONS: (column, kind).
+SORT_COLUMNS = {
+    'display_name': ('display_name', 'text'), 'supply_name': ('display_name', 'text'),
+    'set_name_sort': ('set_code', 'set'), 'location': ('location', 'text'),
+    'quantity': ('quantity', 'number'), 'buy_price': ('buy_price', 'number'), 'cost_per_unit': ('buy_price', 'number'),
+    'current_market_price': ('current_market_price', 'number'), 'rarity': ('rarity', 'text'),
+    'language': ('language', 'text'), 'condition': ('condition', 'text'),
+    'collector_number': ('collector_number', 'text'), 'product_type': ('product_type', 'text'),
+    'purchase_date': ('purchase_ordinal', 'number'),
+}
+
+_lock = threading.Lock()
+_snapshot = None
+
+
+class _Dictionary:
+    """Distinct values of one text column; codes are positions in `values`. Frozen once its snapshot is published."""
+
+    __slots__ = ('values', 'codes_by_value', '_lowered', '_ranks')
+
+    def __init__(self, values=None):
+        self.values = list(values) if values else [None]  # Code 0 is NULL.
+        self.codes_by_value = {value: code for code, value in enumerate(self.values)}
+        self._lowered = None
+        self._ranks = None
+
+    def encode(self, value):
+        code = self.codes_by_value.get(value)
+        if code is None:
+            code = self.codes_by_value[value] = len(self.values)
+            self.values.append(value)
+            self._lowered = self._ranks = None
+        return code
+
+    def lowered(self):
+        if self._lowered is None:
+            self._lowered = [(value or '').lower() for value in self.values]
+        return self._lowered
+
+    def matching_codes(self, predicate):
+        """Boolean array over codes: True where the lower-cased, non-NULL value satisfies `predicate`."""
+        return np.fromiter((code and predicate(value) for code, value in enumerate(self.lowered())),
+                           dtype=bool, count=len(self.values))
+
+    def sort_ranks(self):
+        """Rank of each code when values are ordered lower-cased, NULL as ''."""
+        if self._ranks is None:
+            lowered = self.lowered()
+            ranks = np.empty(len(lowered), dtype=np.int64)
+            ranks[sorted(range(len(lowered)), key=lowered.__getitem__)] = np.arange(len(lowered))
+            self._ranks = ranks
+        return self._ranks
+
+
+class _Snapshot:
+    """The arrays for one point in time. Never modified after it's built; a refresh builds a new one."""
+
+    def __init__(self, columns, dictionaries, versions, read_marker):
+        self.columns = columns
+        self.dictionaries = dictionaries
+        self.versions = versions
+        self.read_marker = read_marker
+        self.size = len(columns['id'])
+        self._orders = {}
+
+    def keys(self):
+        return self.columns['item_type'].astype(np.int64) << 40 | self.columns['id']
+
+    def order(self, sort_key, sort_dir):
+        """
+        Positions of all rows in page order for this sort (ORDER BY <key> <dir> NULLS FIRST,
+        LOWER(display_name) <dir>, item_type, id), computed once per snapshot.
+        """
+        cache_key = (sort_key, sort_dir)
+        order = self._orders.get(cache_key)
+        if order is None:
+            descending = sort_dir == 'desc'
+            primary = _sort_values(self, sort_key)
+            if descending:
+                primary = -primary
+            primary = np.where(np.isnan(primary), -np.inf, primary)  # NULLS FIRST in both directions.
+            name_rank = self.dictionaries['display_name'].sort_ranks()[self.columns['display_name']]
+            if descending:
+                name_rank = -name_rank
+            type_rank = np.asarray(ITEM_TYPE_SORT_RANK)[self.columns['item_type']]
+            order = self._orders[cache_key] = np.lexsort((self.columns['id'], type_rank, name_rank, primary))
+        return order
+
+
+def _columns_from_rows(rows, dictionaries):
+    type_codes = {item_type: code for code, item_type in enumerate(ITEM_TYPES)}
+    columns = {
+        'item_type': np.fromiter((type_codes[row['item_type']] for row in rows), dtype=np.int8, count=len(rows)),
+        'id': np.fromiter((row['id'] for row in rows), dtype=np.int64, count=len(rows)),
+    }
+    for name in NUMERIC_COLUMNS:
+        columns[name] = np.array([row[name] for row in rows], dtype=np.float64)  # None -> nan
+    columns['purchase_ordinal'] = np.array([row['purchase_date'].toordinal() if row['purchase_date'] else None for row in rows], dtype=np.float64)
+    for name in FLAG_COLUMNS:
+        columns[name] = np.fromiter((row[name] or 0 for row in rows), dtype=np.int8, count=len(rows))
+    for name in TEXT_COLUMNS:
+        encode = dictionaries[name].encode
+        columns[name] = np.fromiter((encode(row[name]) for row in rows), dtype=np.int32, count=len(rows))
+    for name in OBJECT_COLUMNS:
+        column = np.empty(len(rows), dtype=object)
+        column[:] = [row[name] for row in rows]
+        columns[name] = column
+    return columns
+
+
+def _refresh(previous, versions):
+    """Builds a snapshot for `versions` from `previous` (None for a full load) plus the rows changed since."""
+    if previous and any(len(dictionary.values) > 2 * previous.size + 1000 for dictionary in previous.dictionaries.values()):
+        previous = None  # Values no row uses any more pile up in the dictionaries; start over now and then.
+    changes = database.get_inventory_index_changes(previous.read_marker if previous else None)
+    if changes is None:
+        return None
+    rows, in_stock_ids, read_marker = changes
+
+    if previous:
+        # Readers of the previous snapshot may still be using its dictionaries, so extend copies.
+        dictionaries = {name: _Dictionary(dictionary.values) for name, dictionary in previous.dictionaries.items()}
+    else:
+        dictionaries = {name: _Dictionary() for name in TEXT_COLUMNS}
+    changed = _columns_from_rows(rows, dictionaries)
+
+    if previous and previous.size:
+        old_keys = previous.keys()
+        in_stock_keys = np.concatenate([np.asarray(in_stock_ids[table_name], dtype=np.int64) | (np.int64(code) << 40)
+                                        for code, table_name in enumerate(INDEX_TABLES)])
+        changed_keys = changed['item_type'].astype(np.int64) << 40 | changed['id']
+        keep = np.isin(old_keys, in_stock_keys) & ~np.isin(old_keys, changed_keys)
+        columns = {name: np.concatenate([previous.columns[name][keep], changed[name]]) for name in changed}
+    else:
+        columns = changed
+    return _Snapshot(columns, dictionaries, versions, read_marker)
+
+def get_snapshot():
+    """Returns an up-to-date snapshot, or None when the index is disabled, numpy is missing or the database can't be read."""
+    global _snapshot
+    if np is None or not INVENTORY_INDEX_ENABLED:
+        return None
+    versions = database.get_table_versions(INDEX_TABLES)
+    if versions is None:
+        return None
+    snapshot = _snapshot
+    if snapshot is not None and snapshot.versions == versions:
+        return snapshot
+    with _lock:
+        if _snapshot is not None and _snapshot.versions == versions:
+            return _snapshot
+        refreshed = _refresh(_snapshot, versions)
+        if refreshed is not None:
+            _snapshot = refreshed
+        return refreshed
+
+def reset():
+    """Drops the snapshot (the next use reloads everything)."""
+    global _snapshot
+    with _lock:
+        _snapshot = None
+
+
+def _filter_mask(snapshot, filters):
+    columns, dictionaries = snapshot.columns, snapshot.dictionaries
+    item_type = columns['item_type']
+    allowed_types = list(ITEM_TYPES)
+    if filters.get('filter_type', 'all') != 'all':
+        allowed_types = [filters['filter_type']] if filters['filter_type'] in ITEM_TYPES else []
+    if any(filters.get(key, 'all') not in (None, '', 'all') for key in ITEM_SPECIFIC_FILTER_KEYS):
+        allowed_types = [t for t in allowed_types if t != 'shipping_supply']
+    mask = np.isin(item_type, [ITEM_TYPES.index(t) for t in allowed_types])
+
+    if filters.get('filter_text'):
+        # A column one item type doesn't search is NULL for that type in the union rows, so OR-ing
+        # every searched column over all rows gives the same result as searching per type.
+        term = filters['filter_text'].lower()
+        text_match = np.zeros(snapshot.size, dtype=bool)
+        for column in SEARCHED_COLUMNS:
+            text_match |= dictionaries[column].matching_codes(lambda value: term in value)[columns[column]]
+        mask &= text_match
+
+    if filters.get('filter_location') and filters['filter_location'] != 'all':
+        location = filters['filter_location'].lower()
+        mask &= dictionaries['location'].matching_codes(lambda value: value == location)[columns['location']]
+
+    for filter_key, columns_by_type in EQUALS_FILTERS.items():
+        wanted = filters.get(filter_key)
+        if not wanted or wanted == 'all':
+            continue
+        wanted = wanted.lower()
+        for type_name, column in columns_by_type.items():
+            matches = dictionaries[column].matching_codes(lambda value: value == wanted)[columns[column]]
+            mask &= (item_type != ITEM_TYPES.index(type_name)) | matches
+    for filter_key, (type_name, column) in FLAG_FILTERS.items():
+        wanted = filters.get(filter_key, 'all')
+        if wanted == 'all':
+            continue
+        mask &= (item_type != ITEM_TYPES.index(type_name)) | (columns[column] == (1 if wanted == 'yes' else 0))
+    return mask
+
+def _sort_values(snapshot, sort_key):
+    """Primary sort key of every row as an ascending float array (NaN for NULL)."""
+    columns, dictionaries = snapshot.columns, snapshot.dictionaries
+    column, kind = SORT_COLUMNS.get(sort_key, SORT_COLUMNS['display_name'])
+    if kind == 'number':
+        return columns[column]
+    if kind == 'set':
+        # COALESCE(set_code, set_name, ''): cards have a set code, sealed products a set name.
+        set_codes, set_names = dictionaries['set_code'].lowered(), dictionaries['set_name'].lowered()
+        rank = {value: position for position, value in enumerate(sorted(set(set_codes) | set(set_names)))}
+        code_ranks = np.array([rank[value] for value in set_codes], dtype=np.float64)
+        name_ranks = np.array([rank[value] for value in set_names], dtype=np.float64)
+        return np.where(columns['set_code'] != 0, code_ranks[columns['set_code']], name_ranks[columns['set_name']])
+    return dictionaries[column].sort_ranks()[columns[column]].astype(np.float64)
+
+def get_inventory_page(filters, sort_key='display_name', sort_dir='asc', page=1, per_page=50):
+    """
+    Same contract as database.get_inventory_page, answered from the snapshot.
+
+    :return: Tuple (list_of_row_dicts, total_count), or None when the index isn't available.
+    """
+    snapshot = get_snapshot()
+    if snapshot is None:
+        return None
+    order = snapshot.order(sort_key, 'desc' if sort_dir == 'desc' else 'asc')
+    selected = order[_filter_mask(snapshot, filters)[order]]
+    offset = (max(page, 1) - 1) * per_page
+    return [_row_dict(snapshot, position) for position in selected[offset:offset + per_page]], len(selected)
+
+def _row_dict(snapshot, position):
+    columns, dictionaries = snapshot.columns, snapshot.dictionaries
+    item_type = ITEM_TYPES[columns['item_type'][position]]
+    row = {'item_type': item_type, 'id': int(columns['id'][position])}
+    for name in NUMERIC_COLUMNS:
+        value = columns[name][position]
+        row[name] = None if np.isnan(value) else float(value)
+    row['quantity'] = int(row['quantity'])
+    for name in TEXT_COLUMNS:
+        row[name] = dictionaries[name].values[columns[name][position]]
+    for name in OBJECT_COLUMNS:
+        row[name] = columns[name][position]
+    row['is_foil'] = int(columns['is_foil'][position]) if item_type == 'single_card' else None
+    row['is_collectors_item'] = int(columns['is_collectors_item'][position]) if item_type == 'sealed_product' else None
+    return row
+
+def inventory_totals():
+    """
+    The inventory part of database.get_dashboard_totals(), from the snapshot.
+
+    :return: Dict with num_unique_card_inventory_entries, total_single_cards_quantity,
+             total_sealed_products_quantity, total_buy_cost_of_inventory and total_inventory_market_value,
+             or None when the index isn't available.
+    """
+    snapshot = get_snapshot()
+    if snapshot is None:
+        return None
+    columns = snapshot.columns
+    stock = columns['item_type'] != ITEM_TYPES.index('shipping_supply')
+    cards = columns['item_type'] == ITEM_TYPES.index('single_card')
+    quantity = columns['quantity']
+    return {
+        'num_unique_card_inventory_entries': int(cards.sum()),
+        'total_single_cards_quantity': int(quantity[cards].sum()),
+        'total_sealed_products_quantity': int(quantity[stock & ~cards].sum()),
+        'total_buy_cost_of_inventory': float(np.nansum(quantity[stock] * columns['buy_price'][stock])),
+        'total_inventory_market_value': float(np.nansum(quantity[stock] * columns['current_market_price'][stock])),
+    }
@@ -0,0 +1,85 @@
+import threading
+
+import database
+
+# --- Inventory option strings ---
+# The sale forms show each inventory row as a long "Name (SET-CN) (Foil) (R:, L:, C:, BP:) - Qty - Loc"
+# string. Formatting is memoized per row on (item_type, id, last_updated): every database.py write
+# to an inventory row stamps last_updated, so an unchanged row is never reformatted and a changed
+# one replaces its single memo entry. The memo is per process and holds at most one entry per row.
+
+_lock = threading.Lock()
+_sale_option_memo = {}
+_supply_option_memo = {}
+
+
+def format_currency_with_commas(value):
+    if value is None: return "$0.00"
+    try:
+        num_value = float(value)
+        return f"-${abs(num_value):,.2f}" if num_value < 0 else f"${num_value:,.2f}"
+    except (ValueError, TypeError): return str(value)
+
+
+def _memoized(memo, key, last_updated, build):
+    with _lock:
+        cached = memo.get(key)
+    if cached is not None and cached[0] == last_updated:
+        return cached[1]
+    value = build()
+    with _lock:
+        memo[key] = (last_updated, value)
+    return value
+
+
+def _format_sale_option(item_type, row):
+    if item_type == 'single_card':
+        quantity = row['quantity']
+        display_text_val = f"{row['name']} ({(row['set_code'] or 'N/A').upper()}-{row['collector_number'] or 'N/A'}) {'(Foil)' if row['is_foil'] else ''} (R: {row['rarity'] or 'N/A'}, L: {row['language'] or 'N/A'}, C: {row['condition'] or 'N/A'}, BP: {format_currency_with_commas(row['buy_price'])}) - Qty: {quantity} - Loc: {row['location'] or 'N/A'}"
+    elif item_type == 'sealed_product':
+        quantity = row['quantity']
+        display_text_val = f"{row['product_name']} ({row['set_name'] or 'N/A'} / {row['product_type'] or 'N/A'}){' (Collector)' if row['is_collectors_item'] else ''} (L: {row['language'] or 'N/A'}, BP: {format_currency_with_commas(row['buy_price'])}) - Qty: {quantity} - Loc: {row['location'] or 'N/A'}"
+    else:
+        quantity = row['quantity_on_hand']
+        display_text_val = f"{row['supply_name']} ({row['description'] or 'N/A'}) (UOM: {row['unit_of_measure'] or 'N/A'}, BP: {format_currency_with_commas(row['cost_per_unit'])}) - Qty: {quantity} - Loc: {row['location'] or 'N/A'}"
+    return {"id": f"{item_type}-{row['id']}", "display": display_text_val, "type": item_type, "quantity": quantity}
+
+def sale_option(item_type, row):
+    """
+    Shapes an inventory row into a sale form item option.
+
+    :param item_type: 'single_card', 'sealed_product' or 'shipping_supply'.
+    :param row: Row from the matching inventory table (must include id and last_updated).
+    :return: Dict {"id": "<type>-<id>", "display", "type", "quantity"}. Shared between callers; don't mutate.
+    """
+    return _memoized(_sale_option_memo, (item_type, row['id']), row.get('last_updated'),
+                     lambda: _format_sale_option(item_type, row))
+
+def shipping_supply_option(supply):
+    """Shapes a supply batch into a shipping supply picker option: {"id", "display", "cost_per_unit", "quantity_on_hand"}."""
+    def build():
+        display_text_val = f"{supply['supply_name']} ({supply.get('description', 'N/A')}) - Qty: {supply['quantity_on_hand']} {supply['unit_of_measure']} @ {format_currency_with_commas(supply.get('cost_per_unit'))} each"
+        return {"id": supply['id'], "display": display_text_val,
+                "cost_per_unit": supply['cost_per_unit'], "quantity_on_hand": supply['quantity_on_hand']}
+    return _memoized(_supply_option_memo, supply['id'], supply.get('last_updated'), build)
+
+
+def build_sale_inventory_options():
+    """Options for every in-stock card, sealed product and supply batch, sorted by display string."""
+    # Streamed, so only the option list is held in memory, not the rows as well.
+    options = [sale_option('single_card', card) for card in database.iter_cards(row_format='dict')]
+    options += [sale_option('sealed_product', product) for product in database.iter_sealed_products(row_format='dict')]
+    options += [sale_option('shipping_supply', supply) for supply in database.iter_shipping_supplies(row_format='dict')]
+    options.sort(key=lambda option: option['display'].lower())
+    return options
+
+def build_shipping_supply_options(supplies=None):
+    """Shipping supply picker options for every in-stock supply batch, sorted by supply name."""
+    if supplies is None:
+        supplies = database.get_all_shipping_supplies()
+    sorted_supplies = sorted(supplies, key=lambda supply: supply.get('supply_name', '').lower())
+    return [shipping_supply_option(supply) for supply in sorted_supplies]
+
+def search_sale_options(query_text, limit):
+    """Sale item typeahead: the top `limit` in-stock matches for `query_text`, as options."""
+    return [sale_option(item_type, row) for item_type, row in database.search_sale_items(query_text, limit)]
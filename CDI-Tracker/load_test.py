@@ -0,0 +1,83 @@
+import argparse
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+# Concurrent throughput check against a running server, e.g. compare
+#   python app.py                                  (Flask dev server)
+#   gunicorn -c gunicorn.conf.py wsgi:app          (production config)
+# with `python load_test.py --base-url http://localhost:10000 --concurrency 1 8 32`.
+# Each level runs for --duration seconds; every simulated user loops over DEFAULT_PATHS.
+
+DEFAULT_PATHS = [
+    '/?tab=dashboardTab',
+    '/api/v1/inventory?page=1&per_page=50',
+    '/api/v1/sales?page=1',
+    '/api/sale_item_search?q=bolt',
+    '/api/v1/supply_presets',
+]
+
+_thread_local = threading.local()
+
+
+def _session():
+    if not hasattr(_thread_local, 'session'):
+        _thread_local.session = requests.Session()
+    return _thread_local.session
+
+def _user_loop(base_url, paths, deadline, timeout):
+    latencies, errors, index = [], 0, 0
+    while time.perf_counter() < deadline:
+        url = base_url + paths[index % len(paths)]
+        index += 1
+        started = time.perf_counter()
+        try:
+            response = _session().get(url, timeout=timeout)
+            if response.status_code >= 400:
+                errors += 1
+        except requests.exceptions.RequestException:
+            errors += 1
+        latencies.append(time.perf_counter() - started)
+    return latencies, errors
+
+def run_level(base_url, paths, concurrency, duration, timeout):
+    deadline = time.perf_counter() + duration
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(lambda _: _user_loop(base_url, paths, deadline, timeout), range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies = sorted(latency for user_latencies, _ in results for latency in user_latencies)
+    errors = sum(user_errors for _, user_errors in results)
+    if not latencies:
+        return {'concurrency': concurrency, 'requests': 0, 'errors': errors, 'rps': 0.0, 'p50': 0.0, 'p95': 0.0, 'max': 0.0}
+    return {
+        'concurrency': concurrency,
+        'requests': len(latencies),
+        'errors': errors,
+        'rps': len(latencies) / elapsed,
+        'p50': statistics.median(latencies) * 1000,
+        'p95': latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000,
+        'max': latencies[-1] * 1000,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure concurrent request throughput against a running CDI-Tracker server.")
+    parser.add_argument('--base-url', default='http://localhost:10000', help="Server to test (default: http://localhost:10000)")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16, 32], help="Simultaneous users per level (default: 1 4 16 32)")
+    parser.add_argument('--duration', type=float, default=15, help="Seconds per level (default: 15)")
+    parser.add_argument('--timeout', type=float, default=30, help="Per-request timeout in seconds (default: 30)")
+    parser.add_argument('--path', action='append', dest='paths', help="Path to request (repeatable; default: a mix of pages and API calls)")
+    args = parser.parse_args()
+
+    paths = args.paths or DEFAULT_PATHS
+    base_url = args.base_url.rstrip('/')
+    print(f"Load test against {base_url}: {len(paths)} paths, {args.duration:.0f}s per level\n")
+    print(f"{'users':>6}{'requests':>10}{'errors':>8}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'max ms':>9}")
+    for concurrency in args.concurrency:
+        result = run_level(base_url, paths, concurrency, args.duration, args.timeout)
+        print(f"{result['concurrency']:>6}{result['requests']:>10}{result['errors']:>8}{result['rps']:>9.1f}"
+              f"{result['p50']:>9.1f}{result['p95']:>9.1f}{result['max']:>9.1f}")
@@ -0,0 +1,158 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import redis
+except ImportError:  # Redis is optional; the in-process fallback is used without it.
+    redis = None
+
+# --- Dashboard metrics cache ---
+# Computed metrics are cached per group ('inventory', 'sales', 'ledger'). Each group has a
+# generation counter that the database.py mutation functions bump after they commit; cache
+# keys include the generation, so a bump invalidates every metric built from that group at once.
+# A value computed while a write commits is stored under the old generation and never read.
+#
+# With REDIS_URL set, counters and values live in Redis and every gunicorn worker sees the same
+# generation. Without it (or if Redis is unreachable) each process keeps its own values, and a
+# group's generation also includes the table_versions counters of its tables (GROUP_TABLES), which
+# the database's triggers bump on every write, so a write from any worker (or outside the app)
+# invalidates every worker's copy. Local values also expire after CACHE_TTL_SECONDS, and at most
+# LOCAL_MAX_ENTRIES are kept (least recently used dropped first). After a Redis failure the process
+# uses its own values for REDIS_RETRY_SECONDS, then tries Redis again.
+
+REDIS_URL = os.environ.get('REDIS_URL')
+CACHE_PREFIX = 'cdi:metrics:'
+CACHE_TTL_SECONDS = int(os.environ.get('METRICS_CACHE_TTL', 3600))  # Safety net for writes made outside the app.
+REDIS_RETRY_SECONDS = int(os.environ.get('METRICS_CACHE_REDIS_RETRY', 30))
+
+LOCAL_MAX_ENTRIES = int(os.environ.get('METRICS_CACHE_LOCAL_MAX_ENTRIES', 256))
+
+GROUPS = ('inventory', 'sales', 'ledger')
+# Tables whose table_versions counters make up each group's generation without Redis.
+GROUP_TABLES = {
+    'inventory': ('cards', 'sealed_products', 'shipping_supplies_inventory'),
+    'sales': ('sale_events', 'sale_items', 'sale_event_shipping_supplies'),
+    'ledger': ('financial_entries',),
+}
+
+_lock = threading.Lock()
+_local_generations = {}
+_local_values = OrderedDict()  # key -> (expires_at monotonic, value), least recently used first
+_redis_client = None
+_redis_retry_at = 0.0  # time.monotonic() before which Redis is not tried again.
+
+
+def _get_redis():
+    global _redis_client
+    if not REDIS_URL or redis is None or time.monotonic() < _redis_retry_at:
+        return None
+    if _redis_client is None:
+        try:
+            _redis_client = redis.Redis.from_url(REDIS_URL, socket_timeout=0.5, socket_connect_timeout=0.5)
+            _redis_client.ping()
+        except redis.RedisError as e:
+            _redis_failed(f"Redis unavailable ({e})")
+    return _redis_client
+
+def _redis_failed(message):
+    """Drops the client and falls back to the in-process cache for REDIS_RETRY_SECONDS."""
+    global _redis_client, _redis_retry_at
+    print(f"Metrics cache: {message}; using in-process cache for {REDIS_RETRY_SECONDS}s.")
+    _redis_client = None
+    _redis_retry_at = time.monotonic() + REDIS_RETRY_SECONDS
+
+def reset_connection():
+    """Drops the Redis client so a forked worker opens its own connection."""
+    global _redis_client, _redis_retry_at
+    _redis_client = None
+    _redis_retry_at = 0.0
+
+
+def _generation_key(group):
+    return f"{CACHE_PREFIX}{group}:generation"
+
+def _generations(groups):
+    client = _get_redis()
+    if client is not None:
+        try:
+            values = client.mget([_generation_key(group) for group in groups])
+            return tuple(int(value or 0) for value in values)
+        except redis.RedisError as e:
+            _redis_failed(f"Redis read failed ({e})")
+    import database  # Not at module level: database imports this module.
+    tables = [table_name for group in groups for table_name in GROUP_TABLES[group]]
+    table_versions = dict(zip(tables, database.get_table_versions(tables) or ()))
+    with _lock:
+        # "<local>.<sum of table versions>": either part moving on gives a new generation. Without
+        # table_versions (init_db not re-run, or a DB error) only this process's writes count.
+        return tuple(f"{_local_generations.get(group, 0)}.{sum(table_versions.get(table_name, 0) for table_name in GROUP_TABLES[group])}"
+                     for group in groups)
+
+def _value_key(name, groups, generations):
+    versions = ":".join(f"{group}{generation}" for group, generation in zip(groups, generations))
+    return f"{CACHE_PREFIX}value:{name}:{versions}"
+
+
+def get_or_compute(name, groups, compute):
+    """
+    Returns the cached metric `name`, computing and storing it on a miss.
+
+    :param name: Metric name, e.g. 'dashboard_totals'.
+    :param groups: Groups whose tables the metric reads; a write to any of them invalidates it.
+    :param compute: Zero-argument callable returning a JSON-serializable value, or None on failure
+                    (None is returned to the caller but not cached).
+    """
+    groups = tuple(groups)
+    key = _value_key(name, groups, _generations(groups))
+
+    client = _get_redis()
+    if client is not None:
+        try:
+            cached = client.get(key)
+            if cached is not None:
+                return json.loads(cached)
+            value = compute()
+            if value is not None:
+                client.set(key, json.dumps(value), ex=CACHE_TTL_SECONDS)
+            return value
+        except redis.RedisError as e:
+            _redis_failed(f"Redis error for {name} ({e})")
+
+    with _lock:
+        cached = _local_values.get(key)
+        if cached is not None and cached[0] > time.monotonic():
+            _local_values.move_to_end(key)
+            return cached[1]
+    value = compute()
+    if value is not None:
+        with _lock:
+            _local_values[key] = (time.monotonic() + CACHE_TTL_SECONDS, value)
+            _local_values.move_to_end(key)
+            while len(_local_values) > LOCAL_MAX_ENTRIES:
+                _local_values.popitem(last=False)
+    return value
+
+def invalidate(*groups):
+    """Bumps the generation of each group. Called by database.py after a committed write."""
+    client = _get_redis()
+    if client is not None:
+        try:
+            pipeline = client.pipeline()
+            for group in groups:
+                pipeline.incr(_generation_key(group))
+            pipeline.execute()
+        except redis.RedisError as e:
+            _redis_failed(f"Redis invalidation failed ({e})")
+    with _lock:
+        for group in groups:
+            _local_generations[group] = _local_generations.get(group, 0) + 1
+        # Values keyed by an old generation can never be read again.
+        stale_keys = [key for key in _local_values if any(f":{group}" in key for group in groups)]
+        for key in stale_keys:
+            del _local_values[key]
+
+def invalidate_all():
+    invalidate(*GROUPS)
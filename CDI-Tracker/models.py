@@ -0,0 +1,201 @@
+# --- Inventory row models ---
+# Slotted classes for the three inventory item types (and sold sale items), so bulk loads hold one
+# small object per row instead of a ~20-key dict, and derived values (market value, P/L) are
+# computed in one place. Build them with from_row() on a row of the item's own table, or
+# inventory_item_from_row() on a database.get_inventory_page() row; to_item_dict() gives the
+# dict the inventory grid / JSON API expects.
+
+
+def _market_vs_buy_percentage(market_price, buy_price):
+    """Percent market price is above buy price; "Infinite" for a free item with a market price, "N/A" if either is unknown."""
+    if market_price is None or buy_price is None:
+        return "N/A"
+    if buy_price > 0:
+        return ((market_price - buy_price) / buy_price) * 100
+    return "Infinite" if market_price > 0 else 0.0
+
+
+class _StockItem:
+    """Fields and value math shared by cards and sealed products; subclasses define display_name and current_market_price."""
+
+    __slots__ = ('id', 'quantity', 'location', 'buy_price', 'sell_price', 'image_uri', 'language', 'last_updated')
+
+    item_type = None
+
+    @property
+    def total_buy_cost(self):
+        return (self.quantity * self.buy_price) if self.buy_price is not None else 0
+
+    @property
+    def total_market_value(self):
+        market_price = self.current_market_price
+        return (self.quantity * market_price) if market_price is not None else 0
+
+    @property
+    def potential_pl_at_asking_price(self):
+        """P/L if the whole stack sells at the asking price; None without an asking (or buy) price."""
+        if self.sell_price is None or self.buy_price is None:
+            return None
+        return (self.quantity * self.sell_price) - self.total_buy_cost
+
+    def to_item_dict(self):
+        potential_pl = self.potential_pl_at_asking_price
+        return {
+            'type': self.item_type, 'internal_type': self.item_type, 'original_id': self.id,
+            'display_name': self.display_name or 'N/A', 'quantity': self.quantity, 'location': self.location,
+            'buy_price': self.buy_price, 'sell_price': self.sell_price, 'image_uri': self.image_uri,
+            'language': self.language, 'current_market_price': self.current_market_price,
+            'total_buy_cost': self.total_buy_cost, 'total_market_value': self.total_market_value,
+            'potential_pl_at_asking_price_display': "N/A (No asking price)" if potential_pl is None else potential_pl,
+        }
+
+
+class Card(_StockItem):
+    __slots__ = ('name', 'set_code', 'collector_number', 'is_foil', 'rarity', 'condition',
+                 'market_price_usd', 'foil_market_price_usd', 'scryfall_id')
+
+    item_type = 'single_card'
+
+    @classmethod
+    def from_row(cls, row):
+        """From a `cards` row (DictRow or dict)."""
+        card = cls()
+        card.id, card.name, card.quantity = row['id'], row['name'], row['quantity'] or 0
+        card.set_code, card.collector_number, card.is_foil = row['set_code'], row['collector_number'], bool(row['is_foil'])
+        card.rarity, card.language, card.condition = row['rarity'], row['language'], row['condition']
+        card.location, card.buy_price, card.sell_price = row['location'], row['buy_price'], row['sell_price']
+        card.market_price_usd, card.foil_market_price_usd = row['market_price_usd'], row['foil_market_price_usd']
+        card.image_uri, card.scryfall_id, card.last_updated = row['image_uri'], row.get('scryfall_id'), row.get('last_updated')
+        return card
+
+    @property
+    def display_name(self):
+        return self.name
+
+    @property
+    def current_market_price(self):
+        return self.foil_market_price_usd if self.is_foil else self.market_price_usd
+
+    @property
+    def market_vs_buy_percentage(self):
+        return _market_vs_buy_percentage(self.current_market_price, self.buy_price)
+
+    def to_item_dict(self):
+        item = super().to_item_dict()
+        item.update({'set_code': self.set_code, 'collector_number': self.collector_number, 'is_foil': self.is_foil,
+                     'rarity': self.rarity, 'condition': self.condition,
+                     'market_vs_buy_percentage_display': self.market_vs_buy_percentage})
+        return item
+
+
+class SealedProduct(_StockItem):
+    __slots__ = ('product_name', 'set_name', 'product_type', 'is_collectors_item', 'manual_market_price')
+
+    item_type = 'sealed_product'
+
+    @classmethod
+    def from_row(cls, row):
+        """From a `sealed_products` row."""
+        product = cls()
+        product.id, product.product_name, product.quantity = row['id'], row['product_name'], row['quantity'] or 0
+        product.set_name, product.product_type = row['set_name'], row['product_type']
+        product.is_collectors_item, product.language = bool(row['is_collectors_item']), row['language']
+        product.location, product.buy_price, product.sell_price = row['location'], row['buy_price'], row['sell_price']
+        product.manual_market_price, product.image_uri = row['manual_market_price'], row['image_uri']
+        product.last_updated = row.get('last_updated')
+        return product
+
+    @property
+    def display_name(self):
+        return self.product_name
+
+    @property
+    def current_market_price(self):
+        return self.manual_market_price
+
+    def to_item_dict(self):
+        item = super().to_item_dict()
+        item.update({'set_name': self.set_name, 'product_type': self.product_type,
+                     'is_collectors_item': self.is_collectors_item,
+                     'market_vs_buy_percentage_display': "N/A (Manual Price)"})
+        return item
+
+
+class ShippingSupply:
+    __slots__ = ('id', 'supply_name', 'description', 'unit_of_measure', 'purchase_date', 'quantity_on_hand',
+                 'cost_per_unit', 'location', 'last_updated')
+
+    item_type = 'shipping_supply'
+
+    @classmethod
+    def from_row(cls, row):
+        """From a `shipping_supplies_inventory` row."""
+        supply = cls()
+        supply.id, supply.supply_name, supply.description = row['id'], row['supply_name'], row['description']
+        supply.unit_of_measure, supply.purchase_date = row['unit_of_measure'], row['purchase_date']
+        supply.quantity_on_hand, supply.cost_per_unit = row['quantity_on_hand'], row['cost_per_unit']
+        supply.location, supply.last_updated = row['location'], row.get('last_updated')
+        return supply
+
+    @property
+    def total_cost(self):
+        return (self.quantity_on_hand or 0) * (self.cost_per_unit or 0)
+
+    def to_item_dict(self):
+        return {
+            'id': self.id, 'internal_type': self.item_type,
+            'supply_name': self.supply_name, 'display_name': self.supply_name,
+            'description': self.description, 'unit_of_measure': self.unit_of_measure,
+            'purchase_date': self.purchase_date, 'quantity_on_hand': self.quantity_on_hand,
+            'cost_per_unit': self.cost_per_unit, 'location': self.location,
+        }
+
+
+ITEM_CLASSES = {cls.item_type: cls for cls in (Card, SealedProduct, ShippingSupply)}
+
+def inventory_item_from_row(row):
+    """
+    Builds the model for a database.get_inventory_page() row, whose columns are normalized across
+    the three tables (display_name, quantity, buy_price, current_market_price, ...).
+    """
+    item_type = row['item_type']
+    if item_type == 'single_card':
+        # The page query only carries the price that applies to this printing.
+        is_foil = bool(row['is_foil'])
+        return Card.from_row(dict(row, name=row['display_name'],
+                                  market_price_usd=None if is_foil else row['current_market_price'],
+                                  foil_market_price_usd=row['current_market_price'] if is_foil else None))
+    if item_type == 'sealed_product':
+        return SealedProduct.from_row(dict(row, product_name=row['display_name'], manual_market_price=row['current_market_price']))
+    return ShippingSupply.from_row(dict(row, supply_name=row['display_name'], quantity_on_hand=row['quantity'],
+                                        cost_per_unit=row['buy_price']))
+
+
+class SaleItem:
+    """One line of a recorded sale (a `sale_items` row)."""
+
+    __slots__ = ('id', 'sale_event_id', 'item_type', 'inventory_item_id', 'original_item_name', 'original_item_details',
+                 'quantity_sold', 'sell_price_per_item', 'buy_price_per_item', 'item_profit_loss')
+
+    @classmethod
+    def from_row(cls, row):
+        """From a `sale_items` row; columns the query didn't select are None."""
+        sale_item = cls()
+        for field in cls.__slots__:
+            setattr(sale_item, field, row.get(field))
+        return sale_item
+
+    @property
+    def inventory_item_id_with_prefix(self):
+        """The "<item_type>-<id>" key the sale forms use for inventory items."""
+        return f"{self.item_type}-{self.inventory_item_id}"
+
+    def to_form_dict(self):
+        """Pre-population entry for the edit-sale form's item rows."""
+        return {
+            'inventory_item_id_with_prefix': self.inventory_item_id_with_prefix,
+            'quantity_sold': self.quantity_sold,
+            'sell_price_per_item': self.sell_price_per_item,
+            'display_name': self.original_item_name,
+            'display_details': self.original_item_details,
+        }
@@ -0,0 +1,21 @@
+import sys
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+import database
+
+# One-off migration: converts sale_events and sale_items to tables range-partitioned by sale year
+# (see database.partition_sales_tables). init_db runs first so the old tables have every column
+# being copied. The tables are locked for the copy, so run it while the app is idle:
+#   python partition_sales.py
+
+if __name__ == "__main__":
+    print("Bringing the schema up to date...")
+    database.init_db()
+    print("Partitioning sale_events and sale_items by year...")
+    success, message = database.partition_sales_tables()
+    print(message)
+    print("Script finished.")
+    sys.exit(0 if success else 1)
@@ -0,0 +1,18 @@
+import sys
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+import database
+
+# Meant to run nightly (e.g. from cron). Keys older than SALE_IDEMPOTENCY_KEY_TTL_DAYS (default 7)
+# are deleted; a retry of a sale after that would be recorded as a new sale.
+
+if __name__ == "__main__":
+    older_than_days = int(sys.argv[1]) if len(sys.argv) > 1 else database.SALE_IDEMPOTENCY_KEY_TTL_DAYS
+    print(f"Deleting sale idempotency keys older than {older_than_days} day(s)...")
+    success, message, _ = database.prune_sale_idempotency_keys(older_than_days=older_than_days)
+    print(message)
+    print("Script finished.")
+    sys.exit(0 if success else 1)
@@ -0,0 +1,60 @@
+import sys
+import time
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+import database
+import scryfall
+
+# Refreshes market prices and images for every card in stock: printings are looked up 75 at a time
+# through Scryfall's collection endpoint, then written with set-based UPDATEs, which also record the
+# changed prices in price_history and the big moves in price_movers. Meant to run nightly (e.g. from cron):
+#   python refresh_prices.py
+
+
+def printing_identifier(card):
+    """The Scryfall identifier for a card row, and the key get_prices_for_printings returns its data under."""
+    if card.scryfall_id:
+        return {'id': card.scryfall_id}, ('id', card.scryfall_id)
+    set_code, collector_number = card.set_code.lower(), (card.collector_number or '').lower()
+    return {'set': set_code, 'collector_number': collector_number}, ('set', set_code, collector_number)
+
+def refresh_card_prices():
+    """
+    :return: Tuple (cards_in_stock, printings_found, cards_updated, price_points_recorded, price_movers_found);
+             the last three are None if the database write failed.
+    """
+    identifiers, card_ids_by_key = [], {}
+    for card in database.iter_cards():
+        identifier, key = printing_identifier(card)
+        if key not in card_ids_by_key:
+            identifiers.append(identifier)
+            card_ids_by_key[key] = []
+        card_ids_by_key[key].append(card.id)
+
+    prices = scryfall.get_prices_for_printings(identifiers)
+    updates = []
+    for key, card_ids in card_ids_by_key.items():
+        details = prices.get(key)
+        if details is None:
+            continue
+        updates += [(card_id, details['market_price_usd'], details['foil_market_price_usd'], details['image_uri'])
+                    for card_id in card_ids]
+    result = database.update_card_prices_bulk(updates)
+    cards_updated, points_recorded, movers_found = result if result is not None else (None, None, None)
+    cards_in_stock = sum(len(card_ids) for card_ids in card_ids_by_key.values())
+    printings_found = sum(1 for key in card_ids_by_key if key in prices)
+    return cards_in_stock, printings_found, cards_updated, points_recorded, movers_found
+
+
+if __name__ == "__main__":
+    started = time.time()
+    cards_in_stock, printings_found, cards_updated, points_recorded, movers_found = refresh_card_prices()
+    print(f"Looked up {cards_in_stock} card(s); Scryfall returned prices for {printings_found} printing(s).")
+    if cards_updated is None:
+        print("Failed to write the refreshed prices.")
+        sys.exit(1)
+    print(f"Updated {cards_updated} card(s) and recorded {points_recorded} price change(s) in {time.time() - started:.1f}s.")
+    print(f"{movers_found} printing(s) moved at least {database.PRICE_MOVER_MIN_PERCENT:g}% or ${database.PRICE_MOVER_MIN_CHANGE:.2f}; see the dashboard's Price Movers.")
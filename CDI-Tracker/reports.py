@@ -0,0 +1,139 @@
+# --- P/L reports ---
+# Profit and loss over recorded sales, grouped by any combination of REPORT_DIMENSIONS. One
+# query aggregates sale_events left-joined to sale_items with GROUP BY ROLLUP / CUBE / GROUPING SETS,
+# so every subtotal comes out of the same pass. Event-level amounts (platform fee, shipping charged,
+# postage, supplies) are spread over the event's items by their share of its revenue (evenly for
+# an event with no revenue), so they add up correctly under item dimensions like set or rarity.
+# An event with no items is one line with share 1, so the totals match the events' own amounts.
+# Set, rarity and location come from the sold item's inventory row (or its archived copy).
+
+REPORT_DIMENSIONS = {
+    'month': "to_char(se.sale_date, 'YYYY-MM')",
+    'platform': "COALESCE(NULLIF(TRIM(se.platform), ''), '')",
+    'item_type': "COALESCE(si.item_type, '')",
+    'set': "COALESCE(stock.set_key, '')",
+    'rarity': "COALESCE(stock.rarity_key, '')",
+    'location': "COALESCE(stock.location, '')",
+}
+# Dimensions read from the inventory tables rather than the sale itself.
+INVENTORY_DIMENSIONS = ('set', 'rarity', 'location')
+REPORT_MODES = {
+    'rollup': "ROLLUP",  # Subtotals down the dimensions in the order given, then a grand total.
+    'cube': "CUBE",  # Subtotals for every combination of the dimensions.
+    'sets': "GROUPING SETS",  # Each dimension on its own, plus a grand total.
+    'detail': "GROUPING SETS",  # Only the full combination, no subtotals.
+}
+MEASURES = ('sales_count', 'units_sold', 'revenue', 'cogs', 'gross_profit', 'platform_fees',
+            'shipping_charged', 'postage', 'supplies', 'net_profit', 'margin_percent')
+
+_STOCK_SELECT = """
+    SELECT 'single_card'::text AS item_type, id, LOWER(set_code) AS set_key, LOWER(rarity) AS rarity_key, location FROM cards
+    UNION ALL SELECT 'single_card', id, LOWER(set_code), LOWER(rarity), location FROM cards_archive
+    UNION ALL SELECT 'sealed_product', id, set_name, NULL, location FROM sealed_products
+    UNION ALL SELECT 'sealed_product', id, set_name, NULL, location FROM sealed_products_archive
+"""
+
+
+def parse_dimensions(value):
+    """
+    Dimension list from a comma-separated string (e.g. "month,platform"), in the given order.
+
+    :raises ValueError: For an unknown or repeated dimension.
+    """
+    dimensions = [name.strip() for name in (value or '').split(',') if name.strip()]
+    for name in dimensions:
+        if name not in REPORT_DIMENSIONS:
+            raise ValueError(f"Unknown dimension '{name}'; use {', '.join(REPORT_DIMENSIONS)}.")
+    if len(set(dimensions)) != len(dimensions):
+        raise ValueError("Each dimension can only be used once.")
+    return dimensions
+
+def cache_groups(dimensions):
+    """The metrics_cache groups a report over these dimensions reads."""
+    return ('sales', 'inventory') if set(dimensions) & set(INVENTORY_DIMENSIONS) else ('sales',)
+
+def _group_by_sql(dimensions, mode):
+    if not dimensions:
+        return "GROUP BY ()"
+    columns = [f"{name}_key" for name in dimensions]
+    if mode == 'sets':
+        return f"GROUP BY GROUPING SETS ({', '.join(f'({column})' for column in columns)}, ())"
+    if mode == 'detail':
+        return f"GROUP BY GROUPING SETS (({', '.join(columns)}))"
+    return f"GROUP BY {REPORT_MODES[mode]} ({', '.join(columns)})"
+
+def compile_pl_report(dimensions, mode='rollup', start_date=None, end_date=None):
+    """
+    Builds the P/L query for a report.
+
+    :param dimensions: List of REPORT_DIMENSIONS keys (see parse_dimensions); empty for just the grand total.
+    :param mode: One of REPORT_MODES.
+    :param start_date: Optional first sale date, inclusive; end_date likewise.
+    :return: Tuple (sql, params). Each row has one <dimension>_key column per dimension (NULL where the
+             row is a subtotal over it), grouping_id (the GROUPING() bitmask, first dimension highest)
+             and the MEASURES.
+    :raises ValueError: For an unknown mode.
+    """
+    if mode not in REPORT_MODES:
+        raise ValueError(f"Unknown mode '{mode}'; use {', '.join(REPORT_MODES)}.")
+    key_columns = [f"{name}_key" for name in dimensions]
+    stock_join = ""
+    if set(dimensions) & set(INVENTORY_DIMENSIONS):
+        stock_join = f"LEFT JOIN ({_STOCK_SELECT}) stock ON stock.item_type = si.item_type AND stock.id = si.inventory_item_id"
+    dimension_selects = "".join(f"{REPORT_DIMENSIONS[name]} AS {name}_key, " for name in dimensions)
+    grouping_sql = f"GROUPING({', '.join(key_columns)})" if key_columns else "0"
+    if mode == 'rollup':
+        order_sql = ", ".join(f"{column} NULLS LAST" for column in key_columns) or "1"
+    else:
+        order_sql = ", ".join(["grouping_id"] + key_columns)
+    sql = f"""
+        WITH lines AS (
+            SELECT {dimension_selects}se.id AS sale_event_id, COALESCE(si.quantity_sold, 0) AS quantity_sold,
+                   COALESCE(si.quantity_sold * si.sell_price_per_item::float8, 0) AS revenue,
+                   COALESCE(si.quantity_sold * si.buy_price_per_item::float8, 0) AS cogs,
+                   COALESCE(se.platform_fee, 0)::float8 AS platform_fee,
+                   COALESCE(se.customer_shipping_charge, 0)::float8 AS shipping_charged,
+                   COALESCE(se.total_shipping_cost, 0)::float8 AS postage,
+                   COALESCE(se.total_supplies_cost_for_sale, 0)::float8 AS supplies,
+                   COALESCE(si.quantity_sold * si.sell_price_per_item::float8
+                                / NULLIF(SUM(si.quantity_sold * si.sell_price_per_item::float8) OVER (PARTITION BY se.id), 0),
+                            1.0 / COUNT(*) OVER (PARTITION BY se.id)) AS event_share
+            FROM sale_events se
+            LEFT JOIN sale_items si ON si.sale_event_id = se.id AND si.sale_date = se.sale_date
+                AND si.sale_date >= COALESCE(%s::date, '-infinity') AND si.sale_date <= COALESCE(%s::date, 'infinity')
+            {stock_join}
+            WHERE se.sale_date >= COALESCE(%s::date, '-infinity') AND se.sale_date <= COALESCE(%s::date, 'infinity')
+        )
+        SELECT *, revenue - cogs AS gross_profit,
+               revenue - cogs - platform_fees + shipping_charged - postage - supplies AS net_profit,
+               (revenue - cogs - platform_fees + shipping_charged - postage - supplies) * 100 / NULLIF(revenue, 0) AS margin_percent
+        FROM (
+            SELECT {''.join(f'{column}, ' for column in key_columns)}{grouping_sql} AS grouping_id,
+                   COUNT(DISTINCT sale_event_id) AS sales_count, COALESCE(SUM(quantity_sold), 0) AS units_sold,
+                   COALESCE(SUM(revenue), 0) AS revenue, COALESCE(SUM(cogs), 0) AS cogs,
+                   COALESCE(SUM(platform_fee * event_share), 0) AS platform_fees,
+                   COALESCE(SUM(shipping_charged * event_share), 0) AS shipping_charged,
+                   COALESCE(SUM(postage * event_share), 0) AS postage,
+                   COALESCE(SUM(supplies * event_share), 0) AS supplies
+            FROM lines
+            {_group_by_sql(dimensions, mode)}
+        ) totals
+        ORDER BY {order_sql}
+    """
+    # The range bounds both tables so each only reads the yearly partitions it covers.
+    return sql, [start_date, end_date, start_date, end_date]
+
+def shape_pl_rows(dimensions, rows):
+    """
+    Report rows as JSON-ready dicts: {"dimensions": {name: value}, "subtotal_of": [...], <measures>}.
+    A dimension in subtotal_of is one the row adds up over (its value is None); the grand total has all of them.
+    """
+    shaped = []
+    for row in rows:
+        subtotal_of = [name for position, name in enumerate(dimensions)
+                       if row['grouping_id'] & (1 << (len(dimensions) - 1 - position))]
+        shaped_row = {'dimensions': {name: None if name in subtotal_of else row[f"{name}_key"] for name in dimensions},
+                      'subtotal_of': subtotal_of}
+        shaped_row.update({measure: row[measure] for measure in MEASURES})
+        shaped.append(shaped_row)
+    return shaped
@@ -0,0 +1,191 @@
+# --- Rule-based repricing ---
+# Sets sell_price for cards and sealed products from their market price. A rule set is JSON:
+#
+#   {"defaults": {"percent_of_market": 95, "ending": 0.99},
+#    "rules": [{"rarity": "common", "floor": 0.25},
+#              {"condition": ["Heavily Played", "Damaged"], "percent_of_market": 60},
+#              {"item_type": "sealed_product", "percent_of_market": 110, "round_to": 1}]}
+#
+# Rules are tried in order and the first whose match keys all hold prices the row; its price keys
+# are layered over `defaults`. Rows no rule matches are priced by `defaults` alone when it has a
+# percent_of_market, otherwise left as they are. Rows without a market price are never touched.
+# compile_rule_set() turns the rules into one CASE expression per table, so a whole run is a
+# single set-based UPDATE per table (see database.reprice_inventory).
+
+PRICE_KEYS = ('percent_of_market', 'round_to', 'ending', 'floor', 'ceiling')
+TEXT_MATCH_KEYS = ('rarity', 'condition', 'set', 'product_type', 'language', 'location')
+REPRICE_TABLES = {
+    'cards': {
+        'item_type': 'single_card',
+        'market_price': "CASE WHEN is_foil = 1 THEN foil_market_price_usd ELSE market_price_usd END",
+        'text': {'rarity': "LOWER(rarity)", 'condition': "LOWER(condition)", 'set': "LOWER(set_code)",
+                 'language': "LOWER(language)", 'location': "LOWER(location)"},
+        'flags': {'is_foil': "is_foil"},
+        'display_name': "name",
+        'columns': "rarity, condition, set_code, language, location, is_foil",
+    },
+    'sealed_products': {
+        'item_type': 'sealed_product',
+        'market_price': "manual_market_price",
+        'text': {'set': "LOWER(set_name)", 'product_type': "LOWER(product_type)",
+                 'language': "LOWER(language)", 'location': "LOWER(location)"},
+        'flags': {'is_collectors_item': "is_collectors_item"},
+        'display_name': "product_name",
+        'columns': "set_name, product_type, language, location, is_collectors_item",
+    },
+}
+FLAG_MATCH_KEYS = ('is_foil', 'is_collectors_item')
+RANGE_MATCH_KEYS = ('min_market', 'max_market')
+MATCH_KEYS = ('item_type',) + TEXT_MATCH_KEYS + FLAG_MATCH_KEYS + RANGE_MATCH_KEYS
+
+
+def _number(rule_label, key, value, minimum=0.0):
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value < minimum:
+        raise ValueError(f"{rule_label}: '{key}' must be a number of at least {minimum:g}.")
+    return float(value)
+
+def _validate_prices(rule_label, prices):
+    for key in prices:
+        if key not in PRICE_KEYS:
+            raise ValueError(f"{rule_label}: unknown key '{key}'.")
+    for key in PRICE_KEYS:
+        if key in prices:
+            _number(rule_label, key, prices[key])
+    if 'round_to' in prices and prices['round_to'] <= 0:
+        raise ValueError(f"{rule_label}: 'round_to' must be greater than 0.")
+    if 'ending' in prices and prices['ending'] >= 1:
+        raise ValueError(f"{rule_label}: 'ending' is the cents a price ends in, e.g. 0.99.")
+    if 'floor' in prices and 'ceiling' in prices and prices['floor'] > prices['ceiling']:
+        raise ValueError(f"{rule_label}: 'floor' is above 'ceiling'.")
+
+def validate_rule_set(rule_set):
+    """
+    Checks a rule set's shape and values.
+
+    :return: Tuple (defaults, rules), each rule split into (match dict, price dict with defaults applied).
+    :raises ValueError: Describing the first problem found.
+    """
+    if not isinstance(rule_set, dict):
+        raise ValueError("The rule set must be a JSON object with 'defaults' and/or 'rules'.")
+    defaults = rule_set.get('defaults') or {}
+    rules = rule_set.get('rules') or []
+    if not isinstance(defaults, dict) or not isinstance(rules, list):
+        raise ValueError("'defaults' must be an object and 'rules' a list of objects.")
+    _validate_prices("defaults", defaults)
+
+    compiled_rules = []
+    for number, rule in enumerate(rules, start=1):
+        rule_label = f"Rule {number}"
+        if not isinstance(rule, dict):
+            raise ValueError(f"{rule_label} must be an object.")
+        match = {key: value for key, value in rule.items() if key in MATCH_KEYS}
+        prices = {key: value for key, value in rule.items() if key not in MATCH_KEYS}
+        _validate_prices(rule_label, prices)
+        if match.get('item_type') not in (None, 'single_card', 'sealed_product'):
+            raise ValueError(f"{rule_label}: 'item_type' must be 'single_card' or 'sealed_product'.")
+        for key in RANGE_MATCH_KEYS:
+            if key in match:
+                _number(rule_label, key, match[key])
+        prices = dict(defaults, **prices)
+        _validate_prices(rule_label, prices)
+        if 'percent_of_market' not in prices:
+            raise ValueError(f"{rule_label}: needs 'percent_of_market' (or a default one).")
+        compiled_rules.append((match, prices))
+    if not compiled_rules and 'percent_of_market' not in defaults:
+        raise ValueError("The rule set has no rules and no default 'percent_of_market'.")
+    return defaults, compiled_rules
+
+def _match_sql(table_name, match):
+    """SQL condition (and params) for one rule on one table; None if the rule can't apply to the table."""
+    table = REPRICE_TABLES[table_name]
+    if match.get('item_type', table['item_type']) != table['item_type']:
+        return None
+    clauses, params = [], []
+    for key, value in match.items():
+        if key in TEXT_MATCH_KEYS:
+            if key not in table['text']:
+                return None
+            values = value if isinstance(value, list) else [value]
+            clauses.append(f"{table['text'][key]} = ANY(%s)")
+            params.append([str(v).strip().lower() for v in values])
+        elif key in FLAG_MATCH_KEYS:
+            if key not in table['flags']:
+                return None
+            clauses.append(f"{table['flags'][key]} = %s")
+            params.append(1 if value else 0)
+        elif key == 'min_market':
+            clauses.append("market_price >= %s")
+            params.append(float(value))
+        elif key == 'max_market':
+            clauses.append("market_price <= %s")
+            params.append(float(value))
+    return " AND ".join(clauses) or "TRUE", params
+
+def _price_sql(prices):
+    """Price expression over market_price: percentage, then rounding / price ending, then floor and ceiling."""
+    expression, params = "(market_price::numeric * %s / 100)", [prices['percent_of_market']]
+    if 'round_to' in prices:
+        expression, params = f"(ROUND({expression} / %s) * %s)", params + [prices['round_to']] * 2
+    if 'ending' in prices:
+        # Up to the next price ending in these cents, e.g. 3.20 -> 3.99 for 0.99.
+        expression, params = f"(CEIL({expression} - %s) + %s)", params + [prices['ending']] * 2
+    if 'floor' in prices:
+        expression, params = f"GREATEST({expression}, %s)", params + [prices['floor']]
+    if 'ceiling' in prices:
+        expression, params = f"LEAST({expression}, %s)", params + [prices['ceiling']]
+    return f"ROUND({expression}, 2)::real", params
+
+def compile_rule_set(rule_set, item_type='all'):
+    """
+    Compiles a rule set into one query per table selecting the rows it would reprice.
+
+    :param item_type: 'all', 'single_card' or 'sealed_product' (the inventory tab's type filter).
+    :return: Dict {table_name: (sql, params)}; each query selects item_type, id, display_name, quantity,
+             old_price, market_price, rule (1-based rule number, 0 for defaults, NULL for no match) and
+             new_price. The sql has a {scope} slot for " AND ..." conditions on the table, whose params
+             come after `params`. Tables no rule applies to are left out.
+    :raises ValueError: For an invalid rule set (see validate_rule_set).
+    """
+    defaults, rules = validate_rule_set(rule_set)
+    queries = {}
+    for table_name, table in REPRICE_TABLES.items():
+        if item_type not in ('all', table['item_type']):
+            continue
+        when_clauses, when_params, price_clauses, price_params = [], [], [], []
+        for number, (match, prices) in enumerate(rules, start=1):
+            condition = _match_sql(table_name, match)
+            if condition is None:
+                continue
+            when_clauses.append(f"WHEN {condition[0]} THEN {number}")
+            when_params += condition[1]
+            price_sql, params = _price_sql(prices)
+            price_clauses.append(f"WHEN {number} THEN {price_sql}")
+            price_params += params
+        unmatched_rule = "NULL"
+        if 'percent_of_market' in defaults:
+            unmatched_rule = "0"
+            price_sql, params = _price_sql(defaults)
+            price_clauses.append(f"WHEN 0 THEN {price_sql}")
+            price_params += params
+        if not price_clauses:
+            continue
+        price_sql = ' '.join(price_clauses)
+        rule_sql = f"CASE {' '.join(when_clauses)} ELSE {unmatched_rule} END" if when_clauses else unmatched_rule
+        # {scope} is left for the caller's extra conditions on the table (e.g. the inventory filters).
+        sql = f"""
+            SELECT item_type, id, display_name, quantity, old_price, market_price, rule,
+                   CASE rule {price_sql} END AS new_price
+            FROM (
+                SELECT '{table['item_type']}'::text AS item_type, id, display_name, quantity, old_price, market_price,
+                       {rule_sql} AS rule
+                FROM (
+                    SELECT id, {table['display_name']} AS display_name, quantity, sell_price AS old_price,
+                           {table['market_price']} AS market_price, {table['columns']}
+                    FROM {table_name}
+                    WHERE quantity > 0 AND {table['market_price']} IS NOT NULL {{scope}}
+                ) stock
+            ) matched
+        """
+        # Placeholders appear in the text as: new_price CASE, then rule CASE.
+        queries[table_name] = (sql, price_params + when_params)
+    return queries
@@ -1,8 +1,42 @@
+import hashlib
+import json
+import os
 import requests
+import threading
 import time
 import urllib.parse
 
 SCRYFALL_API_BASE_URL = "https://api.scryfall.com"
+SCRYFALL_TIMEOUT_SECONDS = float(os.environ.get('SCRYFALL_TIMEOUT_SECONDS', 10))
+
+# One keep-alive HTTP session per process (and per thread, since requests.Session isn't
+# guaranteed thread-safe), so repeated lookups reuse the TLS connection to Scryfall.
+# Sessions are tagged with the pid that created them; a forked worker builds its own.
+_session_local = threading.local()
+
+def _session():
+    session = getattr(_session_local, 'session', None)
+    if session is None or _session_local.pid != os.getpid():
+        session = requests.Session()
+        session.headers.update({'User-Agent': 'CDI-Tracker/1.0', 'Accept': 'application/json'})
+        _session_local.session = session
+        _session_local.pid = os.getpid()
+    return session
+
+def reset_session():
+    """Drops this thread's session. gunicorn's post_fork hook calls it so no socket is shared with the master."""
+    _session_local.session = None
+
+def _image_uri(card_data):
+    """Small image of the card (or of its first face that has images), None if there is none."""
+    image_uris_data = card_data.get('image_uris')
+    if not image_uris_data and card_data.get('card_faces'):
+        for face in card_data['card_faces']:
+            if face.get('image_uris'):
+                image_uris_data = face.get('image_uris'); break
+    if image_uris_data:
+        return image_uris_data.get('small', image_uris_data.get('normal', image_uris_data.get('large')))
+    return None
 
 def get_card_details(card_name=None, set_code=None, collector_number=None, lang=None, variant_info_from_app=None):
     url = None
@@ -96,7 +130,7 @@ def get_card_details(card_name=None, set_code=None, collector_number=None, lang=
     try:
         if url is None: return None
         
-        response = requests.get(url)
+        response = _session().get(url, timeout=SCRYFALL_TIMEOUT_SECONDS)
         response.raise_for_status()
         time.sleep(0.1) 
 
@@ -156,13 +190,7 @@ def get_card_details(card_name=None, set_code=None, collector_number=None, lang=
             market_price_usd = card_data_to_parse['prices'].get('usd')
             foil_market_price_usd = card_data_to_parse['prices'].get('usd_foil')
 
-        image_uris_data = card_data_to_parse.get('image_uris')
-        if not image_uris_data and card_data_to_parse.get('card_faces'): 
-            for face in card_data_to_parse['card_faces']:
-                if face.get('image_uris'):
-                    image_uris_data = face.get('image_uris'); break
-        if image_uris_data:
-            image_uri = image_uris_data.get('small', image_uris_data.get('normal', image_uris_data.get('large')))
+        image_uri = _image_uri(card_data_to_parse)
 
         return {
             "name": name_from_api, "collector_number": collector_number_from_api,
@@ -194,10 +222,50 @@ def get_card_details(card_name=None, set_code=None, collector_number=None, lang=
         import traceback; traceback.print_exc()
         return None
 
+# /cards/collection resolves up to 75 identifiers per request, so a full price refresh needs
+# one request per 75 printings instead of one per card.
+COLLECTION_BATCH_SIZE = 75
+
+def _price(value):
+    return float(value) if value else None
+
+def get_prices_for_printings(identifiers):
+    """
+    Fetches current prices and images for many printings through /cards/collection.
+
+    :param identifiers: List of Scryfall identifier dicts, either {'id': scryfall_id} or
+                        {'set': set_code, 'collector_number': collector_number}.
+    :return: Dict keyed like the identifiers (('id', scryfall_id) or ('set', set_code, collector_number),
+             codes lower-cased) -> {'market_price_usd', 'foil_market_price_usd', 'image_uri'}.
+             Printings Scryfall doesn't know, and batches whose request failed, are missing.
+    """
+    prices = {}
+    for start in range(0, len(identifiers), COLLECTION_BATCH_SIZE):
+        batch = identifiers[start:start + COLLECTION_BATCH_SIZE]
+        try:
+            response = _session().post(f"{SCRYFALL_API_BASE_URL}/cards/collection", json={'identifiers': batch},
+                                       timeout=SCRYFALL_TIMEOUT_SECONDS)
+            response.raise_for_status()
+            cards = response.json().get('data', [])
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print(f"Error fetching prices for printings {start + 1}-{start + len(batch)} from Scryfall: {e}")
+            cards = []
+        for card_data in cards:
+            card_prices = card_data.get('prices') or {}
+            details = {
+                'market_price_usd': _price(card_prices.get('usd')),
+                'foil_market_price_usd': _price(card_prices.get('usd_foil')),
+                'image_uri': _image_uri(card_data),
+            }
+            prices[('id', card_data.get('id'))] = details
+            prices[('set', (card_data.get('set') or '').lower(), (card_data.get('collector_number') or '').lower())] = details
+        time.sleep(0.1)  # Scryfall asks for 50-100 ms between requests.
+    return prices
+
 def fetch_all_set_data():
     url = f"{SCRYFALL_API_BASE_URL}/sets"
     try:
-        response = requests.get(url)
+        response = _session().get(url, timeout=SCRYFALL_TIMEOUT_SECONDS)
         response.raise_for_status()
         time.sleep(0.1)
         set_data = response.json()
@@ -214,4 +282,25 @@ def fetch_all_set_data():
         return None
     except Exception as e:
         print(f"Unexpected error fetching all sets: {e}")
-        return None
\ No newline at end of file
+        return None
+
+# The set list changes a few times a month, so it is kept in-process between requests and
+# identified by a content hash that /api/all_sets_info uses as its ETag.
+SET_DATA_TTL_SECONDS = 6 * 60 * 60
+_set_data_cache = {'data': None, 'etag': None, 'fetched_at': 0.0}
+_set_data_lock = threading.Lock()
+
+def get_all_set_data_cached():
+    """
+    Returns (set_data, etag) from the in-process cache, refreshing from Scryfall when older than SET_DATA_TTL_SECONDS.
+    If a refresh fails, the previous data is served; (None, None) if nothing has been fetched yet.
+    """
+    with _set_data_lock:
+        if _set_data_cache['data'] is not None and time.time() - _set_data_cache['fetched_at'] < SET_DATA_TTL_SECONDS:
+            return _set_data_cache['data'], _set_data_cache['etag']
+        set_data = fetch_all_set_data()
+        if set_data:
+            _set_data_cache['data'] = set_data
+            _set_data_cache['etag'] = hashlib.sha1(json.dumps(set_data, sort_keys=True).encode('utf-8')).hexdigest()
+            _set_data_cache['fetched_at'] = time.time()
+        return _set_data_cache['data'], _set_data_cache['etag']
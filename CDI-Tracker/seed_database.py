@@ -0,0 +1,376 @@
+import argparse
+import csv
+import datetime
+import io
+import random
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+import database
+import metrics_cache
+import wipe_database
+
+# --- Distributions ---
+# Weighted choices roughly matching a singles shop's stock.
+RARITIES = [('common', 55), ('uncommon', 28), ('rare', 13), ('mythic', 4)]
+RARITY_MEDIAN_PRICE = {'common': 0.10, 'uncommon': 0.25, 'rare': 1.50, 'mythic': 6.00}
+LANGUAGES = [('en', 88), ('ja', 5), ('de', 2), ('fr', 2), ('es', 1), ('it', 1), ('pt', 1)]
+CONDITIONS = [('Near Mint', 70), ('Lightly Played', 17), ('Moderately Played', 7), ('Heavily Played', 3), ('Damaged', 2), ('Mint', 1)]
+LOCATIONS = [f"Box {n}" for n in range(1, 41)] + [f"Binder {c}" for c in "ABCDEF"] + ["Display Case"]
+SEALED_TYPES = [('Set Booster Pack', 30), ('Draft Booster Pack', 20), ('Collector Booster Pack', 10), ('Bundle', 12),
+                ('Booster Box', 10), ('Collector Booster Box', 4), ('Commander Deck', 10), ('Prerelease Kit', 4)]
+SEALED_TYPE_PRICE = {'Set Booster Pack': 5.0, 'Draft Booster Pack': 4.0, 'Collector Booster Pack': 25.0, 'Bundle': 45.0,
+                     'Booster Box': 130.0, 'Collector Booster Box': 280.0, 'Commander Deck': 45.0, 'Prerelease Kit': 30.0}
+SUPPLIES = [
+    ('Penny Sleeves', 'Standard 100ct', 'unit', 0.01),
+    ('Toploaders', '3x4 35pt', 'unit', 0.06),
+    ('Team Bags', 'Resealable', 'unit', 0.03),
+    ('Plain White Envelope', '#10', 'envelope', 0.04),
+    ('Bubble Mailer', '4x8', 'mailer', 0.22),
+    ('Bubble Mailer', '6x10', 'mailer', 0.31),
+    ('Cardboard Stiffener', '3x5', 'unit', 0.02),
+    ('Painter Tape', '1in roll', 'roll', 3.99),
+    ('Thank You Card', 'Printed', 'unit', 0.05),
+    ('Stamps', 'Forever', 'unit', 0.73),
+]
+NAME_PREFIXES = ["Ancient", "Blazing", "Cursed", "Drowned", "Eternal", "Feral", "Gilded", "Hollow", "Iron", "Jade",
+                 "Kindled", "Lunar", "Mystic", "Night", "Obsidian", "Primal", "Quiet", "Runic", "Storm", "Thorned",
+                 "Umbral", "Verdant", "Wild", "Zealous"]
+NAME_NOUNS = ["Angel", "Behemoth", "Champion", "Dragon", "Elemental", "Familiar", "Golem", "Hydra", "Invoker",
+              "Juggernaut", "Knight", "Leviathan", "Mage", "Nomad", "Oracle", "Phoenix", "Ranger", "Sphinx",
+              "Titan", "Unicorn", "Vampire", "Wurm", "Zombie", "Bolt", "Growth", "Counterspell", "Ritual", "Wrath"]
+LEDGER_EXPENSES = [('Inventory Purchase', 300.0), ('Shipping Supplies', 40.0), ('Software', 15.0),
+                   ('Platform Fees', 25.0), ('Event Fees', 30.0), ('Travel', 60.0)]
+LEDGER_INCOME = [('Store Credit', 50.0), ('Event Prizes', 40.0), ('Other', 25.0)]
+PRESET_DEFINITIONS = [
+    ('Seed PWE Single', [('Penny Sleeves', 1), ('Toploaders', 1), ('Plain White Envelope', 1), ('Stamps', 1)]),
+    ('Seed PWE Multi', [('Penny Sleeves', 4), ('Team Bags', 1), ('Cardboard Stiffener', 2), ('Plain White Envelope', 1), ('Stamps', 2)]),
+    ('Seed Bubble Mailer', [('Penny Sleeves', 2), ('Toploaders', 2), ('Bubble Mailer', 1), ('Thank You Card', 1)]),
+    ('Seed Sealed Box', [('Bubble Mailer', 1), ('Painter Tape', 1)]),
+]
+PLATFORMS = [('TCGPlayer', 55), ('eBay', 22), ('In Person', 15), ('Cardmarket', 8)]
+
+CARD_COLUMNS = ['id', 'set_code', 'collector_number', 'name', 'quantity', 'buy_price', 'is_foil', 'market_price_usd',
+                'foil_market_price_usd', 'image_uri', 'sell_price', 'location', 'rarity', 'language', 'condition',
+                'date_added', 'last_updated', 'scryfall_id']
+SEALED_COLUMNS = ['id', 'product_name', 'set_name', 'product_type', 'language', 'is_collectors_item', 'quantity',
+                  'buy_price', 'manual_market_price', 'sell_price', 'image_uri', 'location', 'date_added', 'last_updated']
+SUPPLY_COLUMNS = ['id', 'supply_name', 'description', 'unit_of_measure', 'purchase_date', 'quantity_on_hand',
+                  'cost_per_unit', 'location', 'date_added', 'last_updated']
+PRESET_COLUMNS = ['id', 'name', 'description', 'date_created']
+PRESET_ITEM_COLUMNS = ['id', 'preset_id', 'supply_id', 'quantity']
+SALE_EVENT_COLUMNS = ['id', 'sale_date', 'total_shipping_cost', 'notes', 'total_profit_loss', 'date_recorded',
+                      'customer_shipping_charge', 'platform_fee', 'total_supplies_cost_for_sale', 'platform']
+SALE_ITEM_COLUMNS = ['id', 'sale_event_id', 'inventory_item_id', 'item_type', 'original_item_name',
+                     'original_item_details', 'quantity_sold', 'sell_price_per_item', 'buy_price_per_item',
+                     'item_profit_loss', 'sale_date']
+SALE_SUPPLY_COLUMNS = ['id', 'sale_event_id', 'supply_id', 'quantity_used', 'cost_per_unit_snapshot',
+                       'supply_name_snapshot', 'supply_description_snapshot']
+LEDGER_COLUMNS = ['id', 'entry_date', 'description', 'category', 'entry_type', 'amount', 'notes', 'date_recorded']
+
+COPY_CHUNK_ROWS = 50000
+
+
+def _weighted(rng, choices):
+    values, weights = zip(*choices)
+    return rng.choices(values, weights=weights, k=1)[0]
+
+def _price(rng, median, sigma=0.9):
+    """Log-normal price around `median`, rounded to cents (never below $0.01)."""
+    return max(0.01, round(median * rng.lognormvariate(0, sigma), 2))
+
+def _quantity(rng, mean_extra=1.5):
+    """Mostly 1s with a long tail of larger stacks."""
+    return 1 + int(rng.expovariate(1 / mean_extra))
+
+def _random_timestamp(rng, start_date, end_date):
+    span_seconds = int((end_date - start_date).total_seconds())
+    return start_date + datetime.timedelta(seconds=rng.randint(0, max(span_seconds, 1)))
+
+def _growth_date(rng, start_date, end_date):
+    """A date skewed towards `end_date`, modelling a shop whose sales volume grows over time."""
+    span_days = (end_date - start_date).days
+    return start_date + datetime.timedelta(days=int(span_days * (rng.random() ** 0.6)))
+
+
+class _TableCopier:
+    """Buffers rows for one table as CSV and streams them to PostgreSQL with COPY in chunks."""
+
+    def __init__(self, cursor, table_name, columns):
+        self.cursor = cursor
+        self.table_name = table_name
+        self.columns = columns
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer)
+        self.pending = 0
+        self.total = 0
+
+    def add(self, row):
+        self.writer.writerow(row)
+        self.pending += 1
+        if self.pending >= COPY_CHUNK_ROWS:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        self.buffer.seek(0)
+        self.cursor.copy_expert(
+            f"COPY {self.table_name} ({', '.join(self.columns)}) FROM STDIN WITH (FORMAT csv)", self.buffer)
+        self.total += self.pending
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer)
+        self.pending = 0
+
+
+def _next_id(cursor, table_name):
+    tables = [table_name]
+    if table_name in database.ARCHIVE_TABLES:
+        tables.append(database.ARCHIVE_TABLES[table_name])
+    next_id = 1
+    for table in tables:
+        cursor.execute(f"SELECT COALESCE(MAX(id), 0) + 1 FROM {table}")
+        next_id = max(next_id, cursor.fetchone()[0])
+    return next_id
+
+def _sync_sequence(cursor, table_name):
+    cursor.execute(f"SELECT setval(pg_get_serial_sequence('{table_name}', 'id'), GREATEST((SELECT COALESCE(MAX(id), 0) FROM {table_name}), 1))")
+
+
+def seed_database(num_cards, num_sealed, num_sales, num_ledger, years, sold_out_ratio, seed, end_date):
+    """
+    Generates a deterministic synthetic dataset (same seed and end date => same rows) and loads it
+    with COPY. Rows are appended after any existing ids; sequences are advanced afterwards.
+    """
+    rng = random.Random(seed)
+    end_date = datetime.datetime.combine(end_date, datetime.time(23, 59, 59))
+    start_date = end_date - datetime.timedelta(days=365 * years)
+
+    conn = database.get_db_connection()
+    cursor = conn.cursor()
+    try:
+        # Preset names are unique; a second run with the same seed would otherwise fail only after generating everything.
+        preset_names = [f"{preset_name} {seed}" for preset_name, _ in PRESET_DEFINITIONS]
+        cursor.execute("SELECT name FROM shipping_supply_presets WHERE name = ANY(%s)", (preset_names,))
+        existing_presets = [row[0] for row in cursor.fetchall()]
+        if existing_presets:
+            raise ValueError(f"Presets from an earlier run with seed {seed} already exist ({', '.join(existing_presets)}); "
+                             f"pass --wipe to start from empty tables, or use a different --seed.")
+
+        # --- Cards ---
+        print(f"Generating {num_cards} card stacks...")
+        set_codes = sorted({''.join(rng.choice('ABCDEFGHJKLMNPQRSTUVWXYZ') for _ in range(3)) for _ in range(400)})
+        card_copier = _TableCopier(cursor, 'cards', CARD_COLUMNS)
+        card_id = _next_id(cursor, 'cards')
+        seen_card_keys = set()
+        cards_for_sales = []
+        while card_copier.total + card_copier.pending < num_cards:
+            set_code = rng.choice(set_codes)
+            collector_number = str(rng.randint(1, 350))
+            printing_rng = random.Random(f"{seed}-{set_code}-{collector_number}")  # same printing => same name/rarity
+            name = f"{printing_rng.choice(NAME_PREFIXES)} {printing_rng.choice(NAME_NOUNS)}"
+            rarity = _weighted(printing_rng, RARITIES)
+            market_price = _price(printing_rng, RARITY_MEDIAN_PRICE[rarity])
+            foil_market_price = round(market_price * printing_rng.uniform(1.3, 3.0), 2)
+            is_foil = 1 if rng.random() < 0.15 else 0
+            language = _weighted(rng, LANGUAGES)
+            condition = _weighted(rng, CONDITIONS)
+            location = rng.choice(LOCATIONS)
+            current_price = foil_market_price if is_foil else market_price
+            buy_price = round(current_price * rng.uniform(0.35, 0.8), 2)
+            key = (set_code, collector_number, is_foil, location, rarity, language, buy_price, condition)
+            if key in seen_card_keys:
+                continue
+            seen_card_keys.add(key)
+            quantity = 0 if rng.random() < sold_out_ratio else _quantity(rng)
+            sell_price = round(current_price * 1.1, 2) if rng.random() < 0.6 else None
+            date_added = _random_timestamp(rng, start_date, end_date)
+            card_copier.add([card_id, set_code, collector_number, name, quantity, buy_price, is_foil, market_price,
+                             foil_market_price, None, sell_price, location, rarity, language, condition,
+                             date_added, date_added, f"seed-{set_code.lower()}-{collector_number}"])
+            details = f"{set_code}-{collector_number} {'(Foil)' if is_foil else ''} (R: {rarity.capitalize()}, L: {language.upper()}, C: {condition})"
+            cards_for_sales.append((card_id, name, details, buy_price, current_price))
+            card_id += 1
+        card_copier.flush()
+
+        # --- Sealed products ---
+        print(f"Generating {num_sealed} sealed product stacks...")
+        set_names = [f"{rng.choice(NAME_PREFIXES)} {rng.choice(['Realms', 'Horizons', 'Legends', 'Dominion', 'Chronicles', 'Frontiers'])}" for _ in range(80)]
+        sealed_copier = _TableCopier(cursor, 'sealed_products', SEALED_COLUMNS)
+        sealed_id = _next_id(cursor, 'sealed_products')
+        seen_sealed_keys = set()
+        sealed_for_sales = []
+        attempts = 0
+        while sealed_copier.total + sealed_copier.pending < num_sealed and attempts < num_sealed * 20:
+            attempts += 1
+            set_name = rng.choice(set_names)
+            product_type = _weighted(rng, SEALED_TYPES)
+            is_collectors = 1 if 'Collector' in product_type else 0
+            language = _weighted(rng, LANGUAGES)
+            location = rng.choice(LOCATIONS)
+            market_price = _price(rng, SEALED_TYPE_PRICE[product_type], sigma=0.35)
+            buy_price = round(market_price * rng.uniform(0.6, 0.9), 2)
+            product_name = f"{set_name} {product_type}"
+            key = (product_name, set_name, product_type, language, location, is_collectors, buy_price)
+            if key in seen_sealed_keys:
+                continue
+            seen_sealed_keys.add(key)
+            quantity = 0 if rng.random() < sold_out_ratio else _quantity(rng, mean_extra=3)
+            date_added = _random_timestamp(rng, start_date, end_date)
+            sealed_copier.add([sealed_id, product_name, set_name, product_type, language, is_collectors, quantity,
+                               buy_price, market_price, round(market_price * 1.05, 2), None, location,
+                               date_added, date_added])
+            details = f"{set_name} - {product_type} {'(Collector)' if is_collectors else ''} (L: {language.upper()})"
+            sealed_for_sales.append((sealed_id, product_name, details, buy_price, market_price))
+            sealed_id += 1
+        sealed_copier.flush()
+
+        # --- Shipping supplies and presets ---
+        print("Generating shipping supplies and presets...")
+        supply_copier = _TableCopier(cursor, 'shipping_supplies_inventory', SUPPLY_COLUMNS)
+        supply_id = _next_id(cursor, 'shipping_supplies_inventory')
+        supplies_by_name = {}
+        for supply_name, description, unit, cost in SUPPLIES:
+            for location in rng.sample(LOCATIONS[:5], 2):
+                purchase_date = _random_timestamp(rng, start_date, end_date)
+                supply_copier.add([supply_id, supply_name, description, unit, purchase_date.date(),
+                                   rng.randint(50, 2000), cost, location, purchase_date, purchase_date])
+                supplies_by_name.setdefault(supply_name, []).append((supply_id, supply_name, description, cost))
+                supply_id += 1
+        supply_copier.flush()
+
+        preset_copier = _TableCopier(cursor, 'shipping_supply_presets', PRESET_COLUMNS)
+        preset_item_copier = _TableCopier(cursor, 'shipping_preset_items', PRESET_ITEM_COLUMNS)
+        preset_id = _next_id(cursor, 'shipping_supply_presets')
+        preset_item_id = _next_id(cursor, 'shipping_preset_items')
+        presets = []
+        for preset_name, preset_items in PRESET_DEFINITIONS:
+            preset_copier.add([preset_id, f"{preset_name} {seed}", "Generated by seed_database.py", end_date])
+            resolved_items = []
+            for supply_name, quantity in preset_items:
+                supply = supplies_by_name[supply_name][0]
+                preset_item_copier.add([preset_item_id, preset_id, supply[0], quantity])
+                resolved_items.append((supply, quantity))
+                preset_item_id += 1
+            presets.append(resolved_items)
+            preset_id += 1
+        preset_copier.flush()
+        preset_item_copier.flush()
+
+        # --- Sales ---
+        print(f"Generating {num_sales} sale events...")
+        # Every seeded year gets its partition before the COPY; rows left in the DEFAULT partition would
+        # make creating that year's partition fail later.
+        database._ensure_sale_partitions_with_cursor(cursor, range(start_date.year, end_date.year + 1))
+        event_copier = _TableCopier(cursor, 'sale_events', SALE_EVENT_COLUMNS)
+        item_copier = _TableCopier(cursor, 'sale_items', SALE_ITEM_COLUMNS)
+        sale_supply_copier = _TableCopier(cursor, 'sale_event_shipping_supplies', SALE_SUPPLY_COLUMNS)
+        event_id = _next_id(cursor, 'sale_events')
+        sale_item_id = _next_id(cursor, 'sale_items')
+        sale_supply_id = _next_id(cursor, 'sale_event_shipping_supplies')
+        for _ in range(num_sales if (cards_for_sales or sealed_for_sales) else 0):
+            sale_date = _growth_date(rng, start_date, end_date).date()
+            platform = _weighted(rng, PLATFORMS)
+            items_profit_loss = 0.0
+            gross = 0.0
+            for _ in range(min(1 + int(rng.expovariate(0.8)), 12)):
+                if sealed_for_sales and (rng.random() < 0.08 or not cards_for_sales):
+                    item_type = 'sealed_product'
+                    inventory_id, name, details, buy_price, market_price = rng.choice(sealed_for_sales)
+                else:
+                    item_type = 'single_card'
+                    inventory_id, name, details, buy_price, market_price = rng.choice(cards_for_sales)
+                quantity_sold = _quantity(rng, mean_extra=0.4)
+                sell_price = round(market_price * rng.uniform(0.85, 1.25), 2)
+                item_profit_loss = round((sell_price - buy_price) * quantity_sold, 2)
+                items_profit_loss += item_profit_loss
+                gross += sell_price * quantity_sold
+                item_copier.add([sale_item_id, event_id, inventory_id, item_type, name, details, quantity_sold,
+                                 sell_price, buy_price, item_profit_loss, sale_date])
+                sale_item_id += 1
+
+            supplies_cost = 0.0
+            preset = presets[0] if gross < 20 else (presets[2] if gross < 200 else presets[3])
+            for (used_supply_id, supply_name, description, cost), quantity_used in preset:
+                supplies_cost += cost * quantity_used
+                sale_supply_copier.add([sale_supply_id, event_id, used_supply_id, quantity_used, cost,
+                                        supply_name, description])
+                sale_supply_id += 1
+
+            if gross < 5:
+                customer_shipping_charge = 1.00
+            else:
+                customer_shipping_charge = rng.choice([0.0, 4.99]) if gross >= 20 else 0.0
+            our_postage_cost = 0.0 if gross < 20 else round(rng.uniform(4.0, 9.0), 2)
+            platform_fee = 0.0 if platform == 'In Person' else round(gross * 0.129 + 0.30, 2)
+            total_profit_loss = round(items_profit_loss + customer_shipping_charge - our_postage_cost - supplies_cost - platform_fee, 2)
+            event_copier.add([event_id, sale_date, our_postage_cost, None, total_profit_loss,
+                              datetime.datetime.combine(sale_date, datetime.time(12)), customer_shipping_charge,
+                              platform_fee, round(supplies_cost, 2), platform])
+            event_id += 1
+        # sale_items and sale_event_shipping_supplies reference sale_events, so events go in first.
+        event_copier.flush()
+        item_copier.flush()
+        sale_supply_copier.flush()
+
+        # --- Ledger ---
+        print(f"Generating {num_ledger} ledger entries...")
+        ledger_copier = _TableCopier(cursor, 'financial_entries', LEDGER_COLUMNS)
+        ledger_id = _next_id(cursor, 'financial_entries')
+        for _ in range(num_ledger):
+            entry_date = _growth_date(rng, start_date, end_date).date()
+            if rng.random() < 0.8:
+                category, median = rng.choice(LEDGER_EXPENSES)
+                entry_type = 'expense'
+            else:
+                category, median = rng.choice(LEDGER_INCOME)
+                entry_type = 'income'
+            ledger_copier.add([ledger_id, entry_date, f"{category} ({entry_date.strftime('%b %Y')})", category,
+                               entry_type, _price(rng, median, sigma=0.6), "Generated by seed_database.py",
+                               datetime.datetime.combine(entry_date, datetime.time(9))])
+            ledger_id += 1
+        ledger_copier.flush()
+
+        for table_name in ['cards', 'sealed_products', 'shipping_supplies_inventory', 'shipping_supply_presets',
+                           'shipping_preset_items', 'sale_events', 'sale_items', 'sale_event_shipping_supplies',
+                           'financial_entries']:
+            _sync_sequence(cursor, table_name)
+
+        conn.commit()
+        metrics_cache.invalidate_all()
+        print(f"Seeded {card_copier.total} cards, {sealed_copier.total} sealed products, {supply_copier.total} supply batches, "
+              f"{preset_copier.total} presets, {event_copier.total} sale events ({item_copier.total} items), "
+              f"{ledger_copier.total} ledger entries.")
+    except Exception as e:
+        print(f"Error while seeding database: {e}")
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load a deterministic synthetic dataset for performance testing.")
+    parser.add_argument('--cards', type=int, default=200000, help="Number of card stacks (default: 200000)")
+    parser.add_argument('--sealed', type=int, default=5000, help="Number of sealed product stacks (default: 5000)")
+    parser.add_argument('--sales', type=int, default=50000, help="Number of sale events (default: 50000)")
+    parser.add_argument('--ledger', type=int, default=5000, help="Number of ledger entries (default: 5000)")
+    parser.add_argument('--years', type=int, default=3, help="Years of history to spread dates over (default: 3)")
+    parser.add_argument('--sold-out-ratio', type=float, default=0.3, help="Share of stacks generated with quantity 0 (default: 0.3)")
+    parser.add_argument('--seed', type=int, default=42, help="Random seed; the same seed produces the same data (default: 42)")
+    parser.add_argument('--end-date', type=datetime.date.fromisoformat, default=datetime.date.today(),
+                        help="Last day of generated history, YYYY-MM-DD (default: today)")
+    parser.add_argument('--wipe', action='store_true', help="Truncate all tables before seeding")
+    args = parser.parse_args()
+
+    if args.wipe:
+        wipe_database.wipe_all_data()
+    started = datetime.datetime.now()
+    try:
+        seed_database(args.cards, args.sealed, args.sales, args.ledger, args.years, args.sold_out_ratio, args.seed, args.end_date)
+    except ValueError:
+        raise SystemExit(1)  # Already reported by seed_database.
+    print(f"Script finished in {(datetime.datetime.now() - started).total_seconds():.1f}s.")
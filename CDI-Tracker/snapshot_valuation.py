@@ -0,0 +1,18 @@
+import sys
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+import database
+
+# Nightly job: saves today's inventory valuation (total plus the per-location/set/rarity/type
+# breakdowns) to valuation_snapshots for the dashboard's value-over-time panel. Run it after
+# refresh_prices.py so the snapshot uses the refreshed prices.
+
+if __name__ == "__main__":
+    print("Taking inventory valuation snapshot...")
+    success, message, _ = database.take_valuation_snapshot()
+    print(message)
+    print("Script finished.")
+    sys.exit(0 if success else 1)
@@ -5,6 +5,8 @@ from dotenv import load_dotenv
 # Load environment variables from .env file
 load_dotenv()
 
+import metrics_cache
+
 # --- PostgreSQL Connection Details from your .env ---
 DB_USER = os.environ.get('DB_USER')
 DB_PASSWORD = os.environ.get('DB_PASSWORD')
@@ -37,11 +39,21 @@ def wipe_all_data():
         # but TRUNCATE ... CASCADE is safer for all.
         tables_to_wipe = [
             "sale_items",
+            "sale_event_shipping_supplies",  # No longer reached by CASCADE from the partitioned sale_events.
             "sale_events",
             "cards",
             "sealed_products",
             "financial_entries",
-            "shipping_supplies_inventory"
+            "shipping_supplies_inventory",
+            "shipping_supply_presets",
+            "cards_archive",
+            "sealed_products_archive",
+            "shipping_supplies_inventory_archive",
+            "import_batches",  # Checkpoints would otherwise make a re-import skip the wiped cards.
+            "price_history",
+            "valuation_snapshots",
+            "price_movers",
+            "sale_idempotency_keys"
         ]
 
         print("Attempting to wipe data from tables on Render.com...")
@@ -54,6 +66,7 @@ def wipe_all_data():
             print(f"Data wiped from '{table_name}'.")
 
         conn.commit()
+        metrics_cache.invalidate_all()
         print("Database wipe complete. All tables are now empty.")
 
     except psycopg2.Error as e:
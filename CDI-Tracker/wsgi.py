@@ -0,0 +1,5 @@
+# WSGI entry point for production servers, e.g. `gunicorn -c gunicorn.conf.py wsgi:app`.
+# `python app.py` still starts Flask's development server for local work.
+from app import app
+
+application = app